@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) Pootle contributors.
+#
+# This file is a part of the Pootle project. It is distributed under the GPL3
+# or later license. See the LICENSE file for a copy of the license and the
+# AUTHORS file for copyright and authorship information.
+
+"""asyncio variants of fetching and pushing git projects.
+
+Fetching and pushing run the same steps as the sync API, see
+``pootle_fs_git.commands``, but the git commands that talk to the remote
+(``clone``, ``ls-remote``, ``pull``, ``fetch`` and ``push``) are run with
+``asyncio.create_subprocess_exec``, so a single event loop can keep the
+network operations of many projects in flight. The lines of progress that
+git writes to stderr are passed to an optional ``progress`` callable as
+they arrive.
+
+Everything else, reading the config and the database, building commits
+and reading the changed paths, is local and runs in the loop.
+
+This module requires Python 3.5 or later, it is not installed with
+Python 2.
+"""
+
+import asyncio
+import os
+import re
+import time
+import weakref
+
+from django.conf import settings
+
+from pootle_fs.exceptions import FSFetchError
+from pootle_fs.utils import FSPlugin
+
+from .commands import Delay, GitResult, Steps
+from .fetch import (
+    DEFAULT_FETCH_HOST_WORKERS, DEFAULT_FETCH_WORKERS, fetching,
+    fs_url_host)
+from .instrumentation import GitOperation, operation_done
+from .locks import LOCK_POLL_INTERVAL, HeldLock, fcntl
+from .plugin import GitPlugin
+
+
+PROGRESS_CHUNK_SIZE = 4096
+
+# coroutines waiting for each lock file, by event loop
+_waiting = weakref.WeakKeyDictionary()
+
+
+class AsyncRepoLock(object):
+    """Write lock on a repository for coroutines.
+
+    Coroutines in the same event loop wait for each other, other threads
+    and processes are locked out with the ``flock`` of the ``RepoLock``,
+    which is polled so that the loop is not blocked. While it is held, sync
+    code run from the loop's thread sees the ``RepoLock`` as already held.
+    """
+
+    def __init__(self, lock):
+        self.lock = lock
+        self.waiting = None
+
+    async def __aenter__(self):
+        loop = asyncio.get_event_loop()
+        waiting = _waiting.setdefault(loop, {})
+        self.waiting = waiting.get(self.lock.path)
+        if self.waiting is None:
+            self.waiting = waiting[self.lock.path] = asyncio.Lock()
+        await self.waiting.acquire()
+        try:
+            await self.acquire()
+        except BaseException:
+            self.waiting.release()
+            raise
+        return self
+
+    async def __aexit__(self, *exc_info):
+        try:
+            self.release()
+        finally:
+            self.waiting.release()
+
+    async def acquire(self):
+        if fcntl is None:
+            return
+        fd = self.lock.open()
+        start = time.time()
+        try:
+            while not self.lock.try_lock(fd, True):
+                timeout = self.lock.timeout
+                if timeout is not None and time.time() - start >= timeout:
+                    raise self.lock.timed_out()
+                await asyncio.sleep(LOCK_POLL_INTERVAL)
+        except BaseException:
+            os.close(fd)
+            raise
+        held = self.lock.held[self.lock.path] = HeldLock(fd, True)
+        held.depth = 1
+
+    def release(self):
+        if fcntl is None:
+            return
+        held = self.lock.held.pop(self.lock.path)
+        fcntl.flock(held.fd, fcntl.LOCK_UN)
+        os.close(held.fd)
+
+
+async def read_progress(stream, progress=None):
+    """Reads ``stream`` to the end, passing each line to ``progress``.
+
+    git ends the lines that update a progress meter with a carriage return
+    rather than a newline, both end a line here.
+    """
+    chunks = []
+    pending = b""
+    while True:
+        chunk = await stream.read(PROGRESS_CHUNK_SIZE)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        if progress is None:
+            continue
+        lines = re.split(b"[\r\n]", pending + chunk)
+        pending = lines.pop()
+        for line in lines:
+            if line.strip():
+                progress(line.decode("utf-8", "replace"))
+    if progress is not None and pending.strip():
+        progress(pending.decode("utf-8", "replace"))
+    return b"".join(chunks)
+
+
+async def execute(command, progress=None):
+    """Runs a ``GitCommand``, asking git for its progress if ``progress``
+    is given
+
+    :returns: a ``GitResult``
+    """
+    operation = GitOperation(command.name, command.project)
+    # the output is parsed, so it must not be translated
+    env = dict(os.environ, LANGUAGE="C", LC_ALL="C")
+    start = time.time()
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *command.command(progress=progress is not None),
+            cwd=command.cwd,
+            env=env,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE)
+        operation.subprocesses += 1
+        stdout, stderr = await asyncio.gather(
+            process.stdout.read(),
+            read_progress(process.stderr, progress))
+        status = await process.wait()
+        stdout = stdout.decode("utf-8", "replace").rstrip("\n")
+        stderr = stderr.decode("utf-8", "replace").rstrip("\n")
+        operation.add_output(stdout)
+        operation.add_output(stderr)
+        operation.failed = bool(status)
+    except BaseException:
+        operation.failed = True
+        raise
+    finally:
+        operation.duration = time.time() - start
+        operation_done(operation)
+    return GitResult(command, status, stdout, stderr)
+
+
+async def run_steps(steps, progress=None):
+    """Runs a generator of steps, as ``pootle_fs_git.commands.run_steps``
+    does, and returns its result
+
+    :param progress: called with each line of git's progress output
+    """
+    steps = Steps(steps)
+    step = steps.resume()
+    while step is not None:
+        if isinstance(step, Delay):
+            await asyncio.sleep(step.seconds)
+            step = steps.resume()
+            continue
+        try:
+            result = await execute(step, progress)
+        except Exception as e:
+            step = steps.resume(error=e)
+        else:
+            step = steps.resume(result)
+    return steps.result
+
+
+async def fetch(plugin, progress=None):
+    """Clones or updates the repository of ``plugin``, as
+    ``GitPlugin.fetch`` does
+
+    :param progress: called with each line of git's progress output
+    :returns: a ``FetchResult``, which is never profiled
+    """
+    async with AsyncRepoLock(plugin.lock):
+        return await run_steps(plugin.fetch_steps(), progress)
+
+
+async def push(plugin, response, progress=None):
+    """Commits and pushes the completed actions of ``response``, as
+    ``GitPlugin.push`` does. The response is never profiled.
+
+    :param progress: called with each line of git's progress output
+    """
+    # the settings are read again for each push
+    plugin.invalidate_settings()
+    async with AsyncRepoLock(plugin.lock):
+        return await run_steps(plugin.push_steps(response), progress)
+
+
+class AsyncProjectsFetcher(object):
+    """Fetches many projects concurrently in an event loop, limiting the
+    number of concurrent fetches overall and from any single host, as
+    ``ProjectsFetcher`` does with threads
+    """
+
+    def __init__(self, projects, workers=None, host_workers=None,
+                 progress=None):
+        self.projects = list(projects)
+        self.workers = workers or getattr(
+            settings,
+            "POOTLE_FS_GIT_FETCH_WORKERS",
+            DEFAULT_FETCH_WORKERS)
+        self.host_workers = host_workers or getattr(
+            settings,
+            "POOTLE_FS_GIT_FETCH_HOST_WORKERS",
+            DEFAULT_FETCH_HOST_WORKERS)
+        # called with the project and each line of git's progress output
+        self.progress = progress
+        self._workers = None
+        self._host_workers = None
+
+    def project_progress(self, project):
+        if self.progress is None:
+            return None
+
+        def progress(line):
+            self.progress(project, line)
+        return progress
+
+    def host_workers_for(self, plugin):
+        host = fs_url_host(plugin.fs_url)
+        if host not in self._host_workers:
+            self._host_workers[host] = asyncio.Semaphore(self.host_workers)
+        return self._host_workers[host]
+
+    async def fetch_project(self, project):
+        with fetching(project) as fetched:
+            async with self._workers:
+                plugin = FSPlugin(project)
+                if not isinstance(plugin, GitPlugin):
+                    raise FSFetchError(
+                        "Project is not configured with git: %s"
+                        % project.code)
+                async with self.host_workers_for(plugin):
+                    fetched.result = await fetch(
+                        plugin, self.project_progress(project))
+        return fetched
+
+    async def fetch(self):
+        """Fetches the projects, returning a ``ProjectFetch`` for each in
+        the order they were given
+        """
+        self._workers = asyncio.Semaphore(self.workers)
+        self._host_workers = {}
+        return list(
+            await asyncio.gather(
+                *[self.fetch_project(project)
+                  for project in self.projects]))
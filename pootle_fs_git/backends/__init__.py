@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) Pootle contributors.
+#
+# This file is a part of the Pootle project. It is distributed under the GPL3
+# or later license. See the LICENSE file for a copy of the license and the
+# AUTHORS file for copyright and authorship information.
+
+import importlib
+import threading
+
+
+BACKENDS = {
+    "gitpython": "pootle_fs_git.backends.gitpython.GitPythonBackend",
+    "dulwich": "pootle_fs_git.backends.dulwich.DulwichBackend"}
+
+
+def get_backend_class(name):
+    if name not in BACKENDS:
+        raise ValueError("Unknown git backend: %s" % name)
+    module_name, class_name = BACKENDS[name].rsplit(".", 1)
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+class Backends(object):
+    """Keeps a backend instance for each repository path and backend name"""
+
+    def __init__(self):
+        self._backends = {}
+        self._lock = threading.RLock()
+
+    def get(self, name, path):
+        with self._lock:
+            if (name, path) not in self._backends:
+                self._backends[(name, path)] = get_backend_class(name)(path)
+            return self._backends[(name, path)]
+
+    def invalidate(self, path):
+        with self._lock:
+            for key in list(self._backends):
+                if key[1] == path:
+                    del self._backends[key]
+
+
+backends = Backends()
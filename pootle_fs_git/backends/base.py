@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) Pootle contributors.
+#
+# This file is a part of the Pootle project. It is distributed under the GPL3
+# or later license. See the LICENSE file for a copy of the license and the
+# AUTHORS file for copyright and authorship information.
+
+
+class GitBackend(object):
+    """Interface to the reads of trees, changes and history from a local
+    clone at ``path``. Cloning, fetching, committing and pushing are done
+    with the ``git`` command by the plugin
+
+    Paths given to and returned from a backend are relative to the root of
+    the repository, and are returned with a leading ``/`` as in the rest of
+    the plugin. Shas are hex strings.
+    """
+
+    name = None
+
+    def __init__(self, path):
+        self.path = path
+
+    @property
+    def head(self):
+        """The sha of the checked out commit"""
+        raise NotImplementedError
+
+    def read_tree(self, sha, prefixes=None):
+        """Returns a dictionary of ``/path`` -> blob sha for the files in
+        commit ``sha``, limited to ``prefixes``
+        """
+        raise NotImplementedError
+
+    def read_changes(self, base_sha, sha, prefixes=None):
+        """Returns a dictionary of ``/path`` -> blob sha, or ``None`` if it
+        was removed, for the files that changed between two commits, or
+        ``None`` if they cannot be compared
+        """
+        raise NotImplementedError
+
+    def iter_log(self, sha, prefixes=None):
+        """Yields ``LastCommit``, ``/path`` for the files changed by each
+        commit from ``sha`` backwards, newest first
+        """
+        raise NotImplementedError
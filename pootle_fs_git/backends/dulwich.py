@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) Pootle contributors.
+#
+# This file is a part of the Pootle project. It is distributed under the GPL3
+# or later license. See the LICENSE file for a copy of the license and the
+# AUTHORS file for copyright and authorship information.
+
+from __future__ import absolute_import
+
+from dulwich.diff_tree import tree_changes
+from dulwich.object_store import tree_lookup_path
+from dulwich.objects import S_ISGITLINK
+from dulwich.repo import Repo
+
+from ..history import LastCommit
+from .base import GitBackend
+
+try:
+    from dulwich.object_store import iter_tree_contents
+except ImportError:
+    def iter_tree_contents(store, tree_id):
+        return store.iter_tree_contents(tree_id)
+
+
+def _text(value):
+    return value.decode("utf-8")
+
+
+def _bytes(value):
+    if isinstance(value, bytes):
+        return value
+    return value.encode("utf-8")
+
+
+def _parse_identity(identity):
+    name, email = _text(identity).rsplit("<", 1)
+    return name.strip(), email.rstrip(">")
+
+
+class DulwichBackend(GitBackend):
+    """In-process backend using dulwich, no ``git`` command is run"""
+
+    name = "dulwich"
+
+    def __init__(self, path):
+        super(DulwichBackend, self).__init__(path)
+        self._repo = None
+
+    @property
+    def repo(self):
+        if self._repo is None:
+            self._repo = Repo(self.path)
+        return self._repo
+
+    @property
+    def head(self):
+        return _text(self.repo.head())
+
+    def _subtree(self, tree_id, prefix):
+        store = self.repo.object_store
+        try:
+            mode, sha = tree_lookup_path(
+                store.__getitem__, tree_id, _bytes(prefix))
+        except KeyError:
+            return None
+        if mode & 0o040000:
+            return sha
+
+    def _iter_blobs(self, tree_id, prefix=None):
+        store = self.repo.object_store
+        for entry in iter_tree_contents(store, tree_id):
+            if S_ISGITLINK(entry.mode):
+                continue
+            path = _text(entry.path)
+            if prefix:
+                path = "%s/%s" % (prefix, path)
+            yield "/%s" % path, _text(entry.sha)
+
+    def read_tree(self, sha, prefixes=None):
+        tree_id = self.repo[_bytes(sha)].tree
+        if not prefixes:
+            return dict(self._iter_blobs(tree_id))
+        hashes = {}
+        for prefix in prefixes:
+            subtree = self._subtree(tree_id, prefix)
+            if subtree:
+                hashes.update(self._iter_blobs(subtree, prefix))
+        return hashes
+
+    def read_changes(self, base_sha, sha, prefixes=None):
+        repo = self.repo
+        try:
+            base_tree = repo[_bytes(base_sha)].tree
+            tree = repo[_bytes(sha)].tree
+        except KeyError:
+            return None
+        prefixes = tuple("%s/" % prefix for prefix in prefixes or ())
+        changes = {}
+        for change in tree_changes(repo.object_store, base_tree, tree):
+            path = _text(change.new.path or change.old.path)
+            if prefixes and not path.startswith(prefixes):
+                continue
+            is_blob = (
+                change.new.sha is not None
+                and not S_ISGITLINK(change.new.mode))
+            changes["/%s" % path] = is_blob and _text(change.new.sha) or None
+        return changes
+
+    def iter_log(self, sha, prefixes=None):
+        repo = self.repo
+        walker = repo.get_walker(
+            include=[_bytes(sha)],
+            paths=[_bytes(prefix) for prefix in prefixes or ()] or None)
+        prefixes = tuple("%s/" % prefix for prefix in prefixes or ())
+        for entry in walker:
+            commit = entry.commit
+            # like git log, merges do not list their files
+            if len(commit.parents) > 1:
+                continue
+            last_commit = LastCommit(
+                _text(commit.id), *_parse_identity(commit.author))
+            for change in entry.changes():
+                path = _text(change.new.path or change.old.path)
+                if prefixes and not path.startswith(prefixes):
+                    continue
+                yield last_commit, "/%s" % path
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) Pootle contributors.
+#
+# This file is a part of the Pootle project. It is distributed under the GPL3
+# or later license. See the LICENSE file for a copy of the license and the
+# AUTHORS file for copyright and authorship information.
+
+from ..hashes import read_changes, read_tree
+from ..history import iter_log
+from ..repo import repos
+from .base import GitBackend
+
+
+class GitPythonBackend(GitBackend):
+    """Backend using GitPython, which runs the ``git`` command for most
+    operations
+    """
+
+    name = "gitpython"
+
+    @property
+    def repo(self):
+        return repos.get(self.path)
+
+    @property
+    def head(self):
+        return self.repo.head.commit.hexsha
+
+    def read_tree(self, sha, prefixes=None):
+        return read_tree(self.repo, sha, prefixes)
+
+    def read_changes(self, base_sha, sha, prefixes=None):
+        return read_changes(self.repo, base_sha, sha, prefixes)
+
+    def iter_log(self, sha, prefixes=None):
+        return iter_log(self.repo, sha, prefixes)
@@ -8,22 +8,78 @@
 
 from contextlib import contextmanager
 import logging
+import os
+import shutil
+import tempfile
+import time
 import uuid
 
+from git.util import bin_to_hex
+
+from django.utils.functional import cached_property
+
+from .commands import Delay, GitCommand, run_steps
+from .hashes import read_changes
+from .instrumentation import InstrumentedGit, git_operation
+from .objects import TreeBuilder
+
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_PUSH_RETRIES = 3
+DEFAULT_PUSH_BACKOFF = 0.5
+
 
 class PushError(Exception):
     pass
 
 
+class PushRejected(PushError):
+    """The remote branch has moved on since the branch was created"""
+    pass
+
+
+def remove_cached(git, paths):
+    """Removes those of ``paths`` that are in the index from it, with the
+    git cli of ``git``
+
+    :returns: the paths that were removed
+    """
+    indexed = set(
+        path for path
+        in git.ls_files("-z", "--", *paths).split("\0")
+        if path)
+    tracked = [path for path in paths if path in indexed]
+    if tracked:
+        git.rm("--cached", "-q", "--", *tracked)
+    return tracked
+
+
+def commit_index(git, msg, author=None, committer=None):
+    """Commits the index with the git cli of ``git``, as ``author`` and
+    ``committer`` if they are given
+    """
+    env = {}
+    if author:
+        env.update(
+            GIT_AUTHOR_NAME=author.name,
+            GIT_AUTHOR_EMAIL=author.email)
+    if committer:
+        env.update(
+            GIT_COMMITTER_NAME=committer.name,
+            GIT_COMMITTER_EMAIL=committer.email)
+    with git.custom_environment(**env):
+        git.commit("-q", "-m", msg)
+
+
 class GitBranch(object):
 
     def __init__(self, plugin, name):
         self.plugin = plugin
         self.name = name
         self.master = self.repo.active_branch
+        # fs paths that could not be pushed as they changed upstream
+        self.conflicts = set()
 
     @property
     def exists(self):
@@ -37,10 +93,40 @@ class GitBranch(object):
     def repo(self):
         return self.plugin.repo
 
+    @cached_property
+    def is_sparse(self):
+        # GitPython can only read version 2 index files, sparse checkouts
+        # need version 3, so the git cli is used for the index instead.
+        # ``git sparse-checkout`` keeps the setting in the worktree config,
+        # which GitPython does not read. The config is read once for the
+        # lifetime of the branch, which is a single push
+        status_, stdout, stderr_ = self.repo.git.config(
+            "--bool", "core.sparseCheckout",
+            with_extended_output=True,
+            with_exceptions=False)
+        return stdout == "true"
+
     @property
     def is_active(self):
         return self.repo.active_branch.name == self.name
 
+    @property
+    def is_dirty(self):
+        # only staged changes are committed
+        return self.repo.is_dirty(working_tree=False)
+
+    @property
+    def head_sha(self):
+        return self.repo.head.commit.hexsha
+
+    @property
+    def remote(self):
+        return self.plugin.repo.remotes.origin
+
+    @property
+    def refspec(self):
+        return "%s:%s" % (self.name, self.master.name)
+
     @property
     def branch(self):
         if not self.exists:
@@ -64,67 +150,495 @@ class GitBranch(object):
                 % (self.project.code, self.name))
 
     def add(self, paths):
-        if paths:
+        if paths and self.is_sparse:
+            self.repo.git.add("--", *paths)
+        elif paths:
             self.repo.index.add(paths)
-            # logger.info(
-            #    "Adding paths (%s): %s"
-            #    % (self.project.code, self.name))
 
     def rm(self, paths):
+        """Removes ``paths`` from the index in a single operation
+
+        :returns: the paths that were not tracked
+        """
         paths = [p[1:] for p in paths]
-        indexed = set(x[0] for x in self.repo.index.entries.keys())
-        paths = set(paths).intersection(indexed)
-        for path in paths:
-            self.repo.index.remove(path)
-            logger.debug(
-                "Removing path (%s:%s): %s"
-                % (self.project.code, path, self.name))
+        if not paths:
+            return []
+        if self.is_sparse:
+            tracked = remove_cached(self.repo.git, paths)
+        else:
+            indexed = set(x[0] for x in self.repo.index.entries.keys())
+            tracked = [path for path in paths if path in indexed]
+            if tracked:
+                self.repo.index.remove(tracked)
+        logger.debug(
+            "Removing paths (%s): %s paths from %s"
+            % (self.project.code, len(tracked), self.name))
+        tracked = set(tracked)
+        return ["/%s" % path for path in paths if path not in tracked]
 
     def commit(self, msg, author=None, committer=None):
-        # commit
-        result = self.repo.index.commit(
+        if self.is_sparse:
+            commit_index(
+                self.repo.git, msg, author=author, committer=committer)
+            return self.repo.head.commit
+        return self.repo.index.commit(
             msg, author=author, committer=committer)
-        # logger.info(
-        #    "Committing from git branch (%s): %s"
-        #    % (self.project.code, self.name))
-        return result
 
-    def push(self):
-        # push to remote/$master
+    def reset(self, sha):
+        """Moves the branch back to ``sha``, dropping any commits made since
+        but leaving the files as they are
+        """
+        self.repo.git.reset("-q", sha)
+
+    def git_command(self, name, args):
+        return GitCommand(
+            name, args,
+            project=self.project.code,
+            cwd=self.plugin.repo.working_dir,
+            progress=True)
+
+    def push_steps(self):
+        """Yields the steps to push the branch to the remote master"""
         try:
-            result = self.repo.remotes.origin.push(
-                "%s:%s"
-                % (self.name, self.master.name))
+            result = yield self.git_command(
+                "push", ["push", "--porcelain", "origin", self.refspec])
         except Exception as e:
             raise PushError(e)
-
-        if result[0].flags != 256:
+        if result.status and "[rejected]" in result.stdout:
+            raise PushRejected(
+                "Commit was rejected: %s"
+                % result.stdout.strip())
+        if result.status:
             raise PushError(
                 "Commit was unsuccessful: %s"
-                % result[0].summary)
-
+                % (result.stdout.strip() or result.stderr.strip()))
         logger.info(
             "Pushing to remote git branch (%s --> %s): %s"
             % (self.project.code,
-               self.repo.remotes.origin.url,
+               self.remote.url,
                self.name))
-        return result
+
+    def push(self):
+        # push to remote/$master
+        run_steps(self.push_steps())
+
+    def update_master(self, sha, paths=None):
+        """Moves the local and remote tracking master refs to the pushed
+        commit ``sha``, and updates the index of the main checkout, whose
+        working tree already has the pushed content. If ``paths`` are given
+        only their index entries are updated.
+        """
+        git = self.plugin.repo.git
+        git.update_ref("refs/heads/%s" % self.master.name, sha)
+        git.update_ref("refs/remotes/origin/%s" % self.master.name, sha)
+        if paths is None:
+            git.reset("-q")
+        elif paths:
+            git.reset("-q", sha, "--", *paths)
+
+    def checkout_paths(self, sha, paths):
+        """Writes the content of ``paths`` as of commit ``sha`` to the
+        working tree of the main checkout, removing the files that do not
+        exist in it
+        """
+        repo = self.plugin.repo
+        tree_paths = set(
+            path for path
+            in repo.git.ls_tree(
+                "-r", "-z", "--name-only", "--full-tree",
+                sha, "--", *paths).split("\0")
+            if path)
+        if tree_paths:
+            repo.git.checkout("-q", sha, "--", *sorted(tree_paths))
+        for path in paths:
+            file_path = os.path.join(repo.working_dir, path)
+            if path not in tree_paths and os.path.exists(file_path):
+                os.unlink(file_path)
 
     def destroy(self):
         self.repo.git.reset("--hard", "HEAD")
         self.master.checkout()
         self.repo.delete_head(self.name, force=True)
-        self.repo.remotes.origin.pull()
+        self.plugin.invalidate_repo()
         logger.debug(
             "Destroying git branch (%s): %s"
             % (self.project.code, self.name))
 
+    def update_steps(self):
+        """Yields the steps to update the main checkout once the branch is
+        destroyed, pulling what was pushed into master
+        """
+        # shallow clones cannot tell that the pull is a fast-forward
+        (yield self.git_command(
+            "pull", ["pull", "--no-rebase", "origin"])).check()
+        self.plugin.invalidate_repo()
+
 
 @contextmanager
 def tmp_branch(plugin):
     branch = GitBranch(plugin, uuid.uuid4().hex)
-    branch.checkout()
+    with git_operation("branch_create", plugin.project.code):
+        branch.checkout()
+    try:
+        yield branch
+    finally:
+        with git_operation("branch_destroy", plugin.project.code):
+            branch.destroy()
+
+
+class GitWorktreeBranch(GitBranch):
+    """Commits in a disposable ``git worktree`` so that the main checkout
+    is never switched, reset or pulled.
+
+    The worktree is created without checking out any files, changed files
+    are copied into it from the main checkout, and after a successful push
+    the main checkout's refs and index are moved to the pushed commit. The
+    working tree of the main checkout already has the pushed content.
+    """
+
+    def __init__(self, plugin, name):
+        self.plugin = plugin
+        self.name = name
+        self.master = self.main_repo.active_branch
+        self.path = None
+        self.pushed = None
+        self.conflicts = set()
+
+    @property
+    def main_repo(self):
+        return self.plugin.repo
+
+    @property
+    def exists(self):
+        return bool(self.path) and os.path.exists(self.path)
+
+    @property
+    def git(self):
+        return InstrumentedGit(self.path)
+
+    @property
+    def head(self):
+        return self.git.rev_parse("HEAD")
+
+    @property
+    def head_sha(self):
+        return self.head
+
+    @property
+    def is_active(self):
+        return self.exists
+
+    @property
+    def is_dirty(self):
+        status, stdout_, stderr_ = self.git.diff(
+            "--cached", "--quiet",
+            with_extended_output=True,
+            with_exceptions=False)
+        return status != 0
+
+    def create(self):
+        logger.debug(
+            "Creating git worktree (%s): %s"
+            % (self.project.code, self.name))
+        self.path = tempfile.mkdtemp(prefix="pootle_fs_git_")
+        self.main_repo.git.worktree(
+            "add", "--no-checkout", "-b", self.name,
+            self.path, self.master.commit.hexsha)
+        # populate the index without writing any files
+        self.git.reset("-q")
+
+    def checkout(self):
+        if not self.is_active:
+            self.create()
+
+    def add(self, paths):
+        if not paths:
+            return
+        rel_paths = []
+        for path in paths:
+            rel_path = os.path.relpath(path, self.main_repo.working_dir)
+            target = os.path.join(self.path, rel_path)
+            if not os.path.exists(os.path.dirname(target)):
+                os.makedirs(os.path.dirname(target))
+            shutil.copyfile(path, target)
+            rel_paths.append(rel_path)
+        self.git.add("--", *rel_paths)
+
+    def rm(self, paths):
+        paths = [p[1:] for p in paths]
+        if not paths:
+            return []
+        tracked = set(remove_cached(self.git, paths))
+        return ["/%s" % path for path in paths if path not in tracked]
+
+    def commit(self, msg, author=None, committer=None):
+        commit_index(self.git, msg, author=author, committer=committer)
+        return self.main_repo.commit(self.head)
+
+    def reset(self, sha):
+        self.git.reset("-q", sha)
+
+    def push_steps(self):
+        head = self.head
+        yield super(GitWorktreeBranch, self).push_steps()
+        self.pushed = head
+
+    def update_steps(self):
+        # the checkout is updated when the worktree is destroyed
+        if False:
+            yield
+
+    def destroy(self):
+        if self.exists:
+            self.main_repo.git.worktree("remove", "--force", self.path)
+        self.main_repo.delete_head(self.name, force=True)
+        if self.pushed:
+            self.update_master(self.pushed)
+        logger.debug(
+            "Destroying git worktree (%s): %s"
+            % (self.project.code, self.name))
+
+
+@contextmanager
+def tmp_worktree(plugin):
+    branch = GitWorktreeBranch(plugin, uuid.uuid4().hex)
+    with git_operation("branch_create", plugin.project.code):
+        branch.checkout()
+    try:
+        yield branch
+    finally:
+        with git_operation("branch_destroy", plugin.project.code):
+            branch.destroy()
+
+
+class GitObjectBranch(GitBranch):
+    """Commits by writing blobs, trees and commits straight into the object
+    store of the main checkout.
+
+    Nothing is checked out and neither the index nor the working tree are
+    scanned. The new tree is built from the tree of the branch's head,
+    reusing every unchanged subtree, and a commit is only made if the tree
+    changed. After a successful push the main checkout's refs are moved to
+    the pushed commit and the index entries of the changed paths are
+    updated.
+
+    If the push is rejected because the remote has moved on, only the new
+    remote commits are fetched, the changes of each commit are re-applied
+    on top of them, and the push is retried with a growing delay. Paths
+    that were also changed upstream, to different content, are left out
+    and recorded in ``conflicts``.
+
+    If a ``profile`` is given the time taken to stage each path is added
+    to it.
+    """
+
+    def __init__(self, plugin, name, retries=None, backoff=None,
+                 profile=None):
+        self.plugin = plugin
+        self.name = name
+        self.profile = profile
+        self.master = self.repo.active_branch
+        self.retries = (
+            DEFAULT_PUSH_RETRIES
+            if retries is None
+            else retries)
+        self.backoff = (
+            DEFAULT_PUSH_BACKOFF
+            if backoff is None
+            else backoff)
+        self.base = None
+        self.head = None
+        self.tree = None
+        self.commits = []
+        self.changed_paths = set()
+        self.remote_paths = set()
+        self.conflicts = set()
+        self.pushed = None
+
+    @property
+    def exists(self):
+        return self.head is not None
+
+    @property
+    def is_active(self):
+        return self.exists
+
+    @property
+    def is_dirty(self):
+        return self.tree.is_dirty
+
+    @property
+    def head_sha(self):
+        return self.head.hexsha
+
+    def create(self):
+        logger.debug(
+            "Creating git object branch (%s): %s"
+            % (self.project.code, self.name))
+        self.head = self.master.commit
+        self.base = self.head.hexsha
+        self.tree = TreeBuilder(self.repo, self.head.tree.hexsha)
+
+    def checkout(self):
+        if not self.is_active:
+            self.create()
+
+    def add(self, paths):
+        for path in paths:
+            rel_path = os.path.relpath(path, self.repo.working_dir)
+            start = time.time()
+            self.tree.add(rel_path, path)
+            if self.profile:
+                self.profile.add_path(
+                    "/%s" % rel_path, time.time() - start)
+            self.changed_paths.add(rel_path)
+
+    def rm(self, paths):
+        paths = [p[1:] for p in paths]
+        if not paths:
+            return []
+        tracked = set(
+            path for path
+            in self.repo.git.ls_tree(
+                "-r", "-z", "--name-only", "--full-tree",
+                self.head.hexsha, "--", *paths).split("\0")
+            if path)
+        for path in paths:
+            if path in tracked:
+                self.tree.remove(path)
+                self.changed_paths.add(path)
+        return ["/%s" % path for path in paths if path not in tracked]
+
+    def commit(self, msg, author=None, committer=None):
+        changes = dict(self.tree.changes)
+        commit = self.tree.commit(
+            msg, self.head, author=author, committer=committer)
+        if commit is not None:
+            self.commits.append((changes, msg, author, committer))
+            self.head = commit
+            self.repo.git.update_ref(
+                "refs/heads/%s" % self.name, commit.hexsha)
+        return commit
+
+    def reset(self, sha):
+        self.head = self.repo.commit(sha)
+        self.tree = TreeBuilder(self.repo, self.head.tree.hexsha)
+        self.commits = []
+        self.repo.git.update_ref("refs/heads/%s" % self.name, sha)
+
+    @property
+    def remote_sha(self):
+        """The sha of the last fetched remote master"""
+        return self.repo.git.rev_parse(
+            "refs/remotes/origin/%s" % self.master.name)
+
+    def rebase_steps(self):
+        """Yields the steps to fetch the remote master and rebase the branch
+        onto it
+        """
+        try:
+            (yield self.git_command(
+                "fetch", ["fetch", "origin", self.master.name])).check()
+        except Exception as e:
+            raise PushError(e)
+        self.rebase_onto(self.remote_sha)
+
+    def rebase_onto(self, remote_sha):
+        """Re-applies the commits of the branch on top of ``remote_sha``,
+        leaving out conflicting paths
+        """
+        git = self.repo.git
+        remote_changes = read_changes(self.repo, self.base, remote_sha)
+        if remote_changes is None:
+            raise PushError(
+                "Unable to compare with the remote branch: %s"
+                % remote_sha)
+        conflicts = set()
+        for changes, msg_, author_, committer_ in self.commits:
+            for path, binsha in changes.items():
+                fs_path = "/%s" % path
+                remote_sha_ = remote_changes.get(fs_path, False)
+                if remote_sha_ is False:
+                    continue
+                ours = binsha and bin_to_hex(binsha).decode("ascii")
+                if remote_sha_ != ours:
+                    conflicts.add(fs_path)
+        logger.info(
+            "Rebasing git object branch (%s): %s -> %s, %s conflicts"
+            % (self.project.code, self.base, remote_sha, len(conflicts)))
+        commits, self.commits = self.commits, []
+        self.base = remote_sha
+        self.head = self.repo.commit(remote_sha)
+        self.tree = TreeBuilder(self.repo, self.head.tree.hexsha)
+        git.update_ref("refs/heads/%s" % self.name, remote_sha)
+        for changes, msg, author, committer in commits:
+            self.tree.update(
+                dict((path, binsha)
+                     for path, binsha in changes.items()
+                     if "/%s" % path not in conflicts))
+            self.commit(msg, author=author, committer=committer)
+        self.conflicts.update(conflicts)
+        self.remote_paths.update(path[1:] for path in remote_changes)
+
+    def retry_delay(self, attempt, error):
+        """Returns the delay before retrying a rejected push, re-raising
+        ``error`` if there are no retries left
+        """
+        if attempt >= self.retries:
+            raise error
+        delay = self.backoff * (2 ** attempt)
+        logger.info(
+            "Push rejected (%s), retrying in %.2fs: %s"
+            % (self.project.code, delay, error))
+        return delay
+
+    def set_pushed(self):
+        self.pushed = self.base = self.head.hexsha
+        # pushed commits never need to be re-applied
+        self.commits = []
+
+    def push_steps(self):
+        attempt = 0
+        while True:
+            try:
+                yield super(GitObjectBranch, self).push_steps()
+            except PushRejected as e:
+                yield Delay(self.retry_delay(attempt, e))
+                attempt += 1
+                yield self.rebase_steps()
+                if not self.commits:
+                    # everything left to push conflicted
+                    return
+                continue
+            self.set_pushed()
+            return
+
+    def update_steps(self):
+        # the checkout is updated when the branch is destroyed
+        if False:
+            yield
+
+    def destroy(self):
+        if self.name in [h.name for h in self.repo.heads]:
+            self.repo.delete_head(self.name, force=True)
+        sha = self.pushed or (self.remote_paths and self.base)
+        if sha:
+            self.update_master(
+                sha, sorted(self.changed_paths | self.remote_paths))
+        if sha and self.remote_paths:
+            self.checkout_paths(sha, sorted(self.remote_paths))
+        logger.debug(
+            "Destroying git object branch (%s): %s"
+            % (self.project.code, self.name))
+
+
+@contextmanager
+def tmp_object_branch(plugin, **kwargs):
+    branch = GitObjectBranch(plugin, uuid.uuid4().hex, **kwargs)
+    with git_operation("branch_create", plugin.project.code):
+        branch.checkout()
     try:
         yield branch
     finally:
-        branch.destroy()
+        with git_operation("branch_destroy", plugin.project.code):
+            branch.destroy()
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) Pootle contributors.
+#
+# This file is a part of the Pootle project. It is distributed under the GPL3
+# or later license. See the LICENSE file for a copy of the license and the
+# AUTHORS file for copyright and authorship information.
+
+"""Steps of fetching and pushing that talk to the remote.
+
+Fetching and pushing are written as generators of steps. They yield a
+``GitCommand`` for each ``git`` command that talks to the remote, and are
+sent back its ``GitResult``, or a ``Delay`` to wait before retrying. They
+can also yield another generator of steps, which is run in their place,
+and they end by yielding their result, if they have one.
+
+``run_steps`` runs them with GitPython, which is how the plugin fetches and
+pushes, and ``pootle_fs_git.aio`` runs the same steps in an event loop.
+"""
+
+import os
+import time
+import types
+
+from git import Git
+from git.exc import GitCommandError
+
+from .instrumentation import InstrumentedGit, git_operation
+
+
+class GitCommand(object):
+    """A ``git`` command run as the git operation ``name``. If ``progress``
+    is set, git can be asked to report its progress
+    """
+
+    def __init__(self, name, args, project=None, cwd=None, progress=False):
+        self.name = name
+        self.args = list(args)
+        self.project = project
+        self.cwd = cwd
+        self.progress = progress
+
+    def __repr__(self):
+        return "<GitCommand %s: git %s>" % (self.name, " ".join(self.args))
+
+    def command(self, progress=False):
+        """The command line, asking for progress if ``progress`` is set"""
+        args = self.args
+        if progress and self.progress:
+            args = args[:1] + ["--progress"] + args[1:]
+        return ["git"] + args
+
+
+class GitResult(object):
+    """The exit status and output of running a ``GitCommand``"""
+
+    def __init__(self, command, status, stdout, stderr):
+        self.command = command
+        self.status = status
+        self.stdout = stdout
+        self.stderr = stderr
+
+    def check(self):
+        """Returns the output, raising ``GitCommandError`` if the command
+        failed
+        """
+        if self.status:
+            raise GitCommandError(
+                self.command.command(), self.status,
+                self.stderr, self.stdout)
+        return self.stdout
+
+
+class Delay(object):
+    """Waits ``seconds`` before the next step"""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+
+def git_options(**kwargs):
+    """Converts ``kwargs`` to command line options as GitPython does"""
+    return Git().transform_kwargs(**kwargs)
+
+
+class Steps(object):
+    """Runs a generator of steps, and the generators it yields, as a
+    single series of ``GitCommand`` and ``Delay`` steps
+    """
+
+    def __init__(self, steps):
+        self.stack = [steps]
+        self.result = None
+
+    def resume(self, value=None, error=None):
+        """Sends ``value``, or raises ``error``, in the running steps
+
+        :returns: the next ``GitCommand`` or ``Delay``, or ``None`` once
+          the steps are done and their result is set
+        """
+        while self.stack:
+            steps = self.stack[-1]
+            try:
+                if error is not None:
+                    step = steps.throw(error)
+                else:
+                    step = steps.send(value)
+            except StopIteration:
+                step = None
+            except Exception as e:
+                self.stack.pop()
+                if not self.stack:
+                    raise
+                # raised where the failed steps were yielded
+                value, error = None, e
+                continue
+            else:
+                if isinstance(step, (GitCommand, Delay)):
+                    return step
+                if isinstance(step, types.GeneratorType):
+                    self.stack.append(step)
+                    value, error = None, None
+                    continue
+                steps.close()
+            # finished, the value is sent to the steps that yielded them
+            self.stack.pop()
+            value, error = step, None
+        self.result = value
+        return None
+
+
+def run_command(command):
+    """Runs ``command`` with GitPython
+
+    :returns: a ``GitResult``
+    """
+    git = InstrumentedGit(command.cwd or os.getcwd())
+    with git_operation(command.name, command.project) as operation:
+        status, stdout, stderr = git.execute(
+            command.command(),
+            with_extended_output=True,
+            with_exceptions=False)
+        operation.failed = bool(status)
+    return GitResult(command, status, stdout, stderr)
+
+
+def run_steps(steps):
+    """Runs a generator of steps with GitPython and returns its result"""
+    steps = Steps(steps)
+    step = steps.resume()
+    while step is not None:
+        if isinstance(step, Delay):
+            time.sleep(step.seconds)
+            step = steps.resume()
+            continue
+        try:
+            result = run_command(step)
+        except Exception as e:
+            step = steps.resume(error=e)
+        else:
+            step = steps.resume(result)
+    return steps.result
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) Pootle contributors.
+#
+# This file is a part of the Pootle project. It is distributed under the GPL3
+# or later license. See the LICENSE file for a copy of the license and the
+# AUTHORS file for copyright and authorship information.
+
+import logging
+import re
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
+
+from django.conf import settings
+from django.db import connections
+
+from pootle_fs.exceptions import FSFetchError
+from pootle_fs.utils import FSPlugin
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FETCH_WORKERS = 4
+DEFAULT_FETCH_HOST_WORKERS = 2
+
+
+def fs_url_host(fs_url):
+    """Returns the host that a git url points to, or an empty string for
+    local repositories
+    """
+    match = re.match(r"^[\w+.-]+://(?:[^@/]*@)?([^/:]*)", fs_url)
+    if match:
+        return match.group(1)
+    match = re.match(r"^(?:[^@/:]*@)?([^/:]+):", fs_url)
+    if match:
+        return match.group(1)
+    return ""
+
+
+class ProjectFetch(object):
+    """Outcome of fetching a single project"""
+
+    def __init__(self, project):
+        self.project = project
+        self.result = None
+        self.error = None
+        self.duration = None
+
+    def __str__(self):
+        return (
+            "<%s(%s)%s: %.2fs>"
+            % (self.__class__.__name__,
+               self.project.code,
+               self.failed and " FAILED" or "",
+               self.duration or 0))
+
+    @property
+    def failed(self):
+        return self.error is not None
+
+
+@contextmanager
+def fetching(project):
+    """Times fetching ``project`` and yields the ``ProjectFetch`` to set its
+    result on. Errors are logged and kept as the ``error`` of the fetch
+    rather than raised, so that a failing project does not stop the others
+    """
+    fetched = ProjectFetch(project)
+    start = time.time()
+    try:
+        yield fetched
+    except FSFetchError as e:
+        fetched.error = e
+        logger.error(
+            "Failed fetching project (%s): %s"
+            % (project.code, e))
+    except Exception as e:
+        fetched.error = e
+        logger.exception(
+            "Failed fetching project (%s)"
+            % project.code)
+    fetched.duration = time.time() - start
+    logger.info(
+        "Fetching project (%s) took %.2fs"
+        % (project.code, fetched.duration))
+
+
+class ProjectsFetcher(object):
+    """Fetches many projects in a bounded pool of threads, limiting the
+    number of concurrent fetches from any single host
+    """
+
+    def __init__(self, projects, workers=None, host_workers=None):
+        self.projects = list(projects)
+        self.workers = workers or getattr(
+            settings,
+            "POOTLE_FS_GIT_FETCH_WORKERS",
+            DEFAULT_FETCH_WORKERS)
+        self.host_workers = host_workers or getattr(
+            settings,
+            "POOTLE_FS_GIT_FETCH_HOST_WORKERS",
+            DEFAULT_FETCH_HOST_WORKERS)
+        self._host_locks = defaultdict(
+            lambda: threading.BoundedSemaphore(self.host_workers))
+        self._lock = threading.Lock()
+
+    def host_lock(self, plugin):
+        with self._lock:
+            return self._host_locks[fs_url_host(plugin.fs_url)]
+
+    def fetch_project(self, project):
+        with fetching(project) as fetched:
+            plugin = FSPlugin(project)
+            with self.host_lock(plugin):
+                fetched.result = plugin.fetch()
+        return fetched
+
+    def fetch_in_thread(self, project):
+        try:
+            return self.fetch_project(project)
+        finally:
+            # db connections are per thread
+            for connection in connections.all():
+                connection.close()
+
+    def fetch(self):
+        if not self.projects:
+            return []
+        pool = ThreadPool(min(self.workers, len(self.projects)))
+        try:
+            return pool.map(self.fetch_in_thread, self.projects)
+        finally:
+            pool.close()
+            pool.join()
+
+
+def fetch_projects(projects, workers=None, host_workers=None):
+    """Fetches the filesystems of ``projects`` concurrently
+
+    :returns: a list of ``ProjectFetch`` in the order of ``projects``. A
+      failing project does not stop the others from being fetched.
+    """
+    return ProjectsFetcher(
+        projects,
+        workers=workers,
+        host_workers=host_workers).fetch()
@@ -22,17 +22,18 @@ class GitFSFile(FSFile):
 
     @property
     def last_commit(self):
-        return self.repo.iter_commits(
-            paths=self.path[1:],
-            max_count=1).next()
+        last_commit = self.plugin.get_last_commit(self.path)
+        if last_commit:
+            return self.repo.commit(last_commit.hexsha)
 
     @property
     def latest_hash(self):
-        tree = self.repo.tree()
-        if self.path[1:] in tree:
-            return tree[self.path[1:]].hexsha
+        # read under the lock the plugin holds for the state or sync
+        return self.plugin.tree_index.get(self.path)
 
     @property
     def latest_author(self):
-        author = self.last_commit.author
-        return author.name, author.email
+        last_commit = self.plugin.get_last_commit(self.path)
+        if not last_commit:
+            return None, None
+        return last_commit.author_name, last_commit.author_email
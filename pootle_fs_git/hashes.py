@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) Pootle contributors.
+#
+# This file is a part of the Pootle project. It is distributed under the GPL3
+# or later license. See the LICENSE file for a copy of the license and the
+# AUTHORS file for copyright and authorship information.
+
+import binascii
+import errno
+import logging
+import os
+import tempfile
+import threading
+import zlib
+
+from git.exc import GitCommandError
+
+from django.utils.functional import cached_property
+
+from .instrumentation import git_operation, repo_project
+
+
+logger = logging.getLogger(__name__)
+
+
+def translation_prefixes(mappings):
+    """Returns the repository directories that can contain translation files
+    for the given translation mappings, or an empty list if a mapping starts
+    with a <tag> and the whole tree has to be searched.
+    """
+    prefixes = set()
+    for mapping in mappings:
+        root = mapping.split("<")[0]
+        root = root[:root.rfind("/") + 1].strip("/")
+        if not root:
+            return []
+        prefixes.add(root)
+    return sorted(
+        prefix for prefix in prefixes
+        if not any(prefix.startswith("%s/" % other) for other in prefixes))
+
+
+def parse_ls_tree(output):
+    """Yields ``/path``, ``blob sha`` for the blobs in ``ls-tree -r -z``
+    output
+    """
+    for line in output.split("\0"):
+        if not line:
+            continue
+        info, path = line.split("\t", 1)
+        mode_, object_type, sha = info.split(" ")
+        if object_type == "blob":
+            yield "/%s" % path, sha
+
+
+def parse_diff_raw(output):
+    """Yields ``/path``, ``blob sha`` for the files in ``diff --raw -z
+    --no-abbrev --no-renames`` output, where the sha is ``None`` if the file
+    no longer exists as a blob
+    """
+    items = output.split("\0")
+    for info, path in zip(items[0::2], items[1::2]):
+        if not info:
+            continue
+        mode_, new_mode, sha_, new_sha, status = info[1:].split(" ")
+        is_blob = (
+            status != "D"
+            and new_mode not in ["000000", "160000"])
+        yield "/%s" % path, is_blob and new_sha or None
+
+
+def read_tree(repo, sha, prefixes=None):
+    """Returns a dictionary of ``/path`` -> blob sha for the files in commit
+    ``sha``, limited to ``prefixes``
+    """
+    return dict(
+        parse_ls_tree(
+            repo.git.ls_tree(
+                "-r", "-z", "--full-tree", sha,
+                "--", *(prefixes or ()))))
+
+
+def read_changes(repo, base_sha, sha, prefixes=None):
+    """Returns a dictionary of the paths that changed between ``base_sha``
+    and ``sha`` with their new blob shas, or ``None`` if the commits cannot
+    be compared
+    """
+    try:
+        output = repo.git.diff(
+            "--raw", "-z", "--no-abbrev", "--no-renames",
+            base_sha, sha, "--", *(prefixes or ()))
+    except GitCommandError as e:
+        logger.warning(
+            "Unable to compare git commits (%s): %s"
+            % (repo.working_dir, e))
+        return None
+    return dict(parse_diff_raw(output))
+
+
+class TreeHashCache(object):
+    """Stores a path -> blob sha map on disk together with the commit sha it
+    was read from.
+
+    The file is zlib compressed, and holds the commit sha on the first line
+    followed by a binary blob sha and a NUL terminated path for each file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return None, None
+        try:
+            with open(self.path, "rb") as f:
+                data = zlib.decompress(f.read())
+        except (IOError, OSError, zlib.error) as e:
+            logger.warning(
+                "Unable to read git hash cache (%s): %s"
+                % (self.path, e))
+            return None, None
+        sha, data = data.split(b"\n", 1)
+        hashes = {}
+        offset = 0
+        while offset < len(data):
+            end = data.index(b"\0", offset + 20)
+            path = data[offset + 20:end].decode("utf-8")
+            hashes[path] = binascii.hexlify(
+                data[offset:offset + 20]).decode("ascii")
+            offset = end + 1
+        return sha.decode("ascii"), hashes
+
+    def save(self, sha, hashes):
+        data = [sha.encode("ascii"), b"\n"]
+        for path, blob_sha in hashes.items():
+            data.append(binascii.unhexlify(blob_sha))
+            data.append(path.encode("utf-8"))
+            data.append(b"\0")
+        directory = os.path.dirname(self.path)
+        if not os.path.exists(directory):
+            try:
+                os.makedirs(directory)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+        # each save writes its own file, so that threads and processes
+        # saving at the same time each replace the cache whole
+        fd, tmp_path = tempfile.mkstemp(
+            prefix="%s." % os.path.basename(self.path),
+            suffix=".tmp",
+            dir=directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(zlib.compress(b"".join(data)))
+            os.rename(tmp_path, self.path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+
+class TreeHashIndex(object):
+    """Path -> blob sha index of the translation files in a commit
+
+    The index is read with a single ``git ls-tree`` and is limited to the
+    translation prefixes. If a ``cache`` is given, the index is loaded from
+    it when it was stored for the same commit. If it was stored for another
+    commit the cached map is patched with a single ``git diff --raw`` and
+    ``changed_paths`` holds the paths that changed since that commit.
+
+    If a ``backend`` is given the tree and changes are read with it instead.
+    """
+
+    def __init__(self, repo, sha, prefixes=None, cache=None, backend=None):
+        self.repo = repo
+        self.sha = sha
+        self.prefixes = tuple(prefixes or ())
+        self.cache = cache
+        self.backend = backend
+        self.base_sha = None
+        self.changed_paths = None
+
+    def __contains__(self, path):
+        return path in self.hashes
+
+    def __getitem__(self, path):
+        return self.hashes[path]
+
+    def get(self, path, default=None):
+        return self.hashes.get(path, default)
+
+    @cached_property
+    def hashes(self):
+        cached_sha = hashes = None
+        if self.cache:
+            cached_sha, hashes = self.cache.load()
+        if cached_sha == self.sha:
+            self.base_sha = cached_sha
+            self.changed_paths = set()
+            return hashes
+        changes = cached_sha and self.read_changes(cached_sha)
+        if changes is None:
+            hashes = self.read_tree()
+        else:
+            self.base_sha = cached_sha
+            self.changed_paths = set(changes)
+            for path, blob_sha in changes.items():
+                if blob_sha:
+                    hashes[path] = blob_sha
+                else:
+                    hashes.pop(path, None)
+        if self.cache:
+            self.cache.save(self.sha, hashes)
+        return hashes
+
+    def read_changes(self, base_sha):
+        logger.debug(
+            "Updating git tree index (%s): %s..%s"
+            % (self.repo.working_dir, base_sha, self.sha))
+        with git_operation("tree_changes", repo_project(self.repo)):
+            if self.backend:
+                return self.backend.read_changes(
+                    base_sha, self.sha, self.prefixes)
+            return read_changes(
+                self.repo, base_sha, self.sha, self.prefixes)
+
+    def read_tree(self):
+        logger.debug(
+            "Indexing git tree (%s): %s"
+            % (self.repo.working_dir, self.sha))
+        with git_operation("tree", repo_project(self.repo)):
+            if self.backend:
+                return self.backend.read_tree(self.sha, self.prefixes)
+            return read_tree(self.repo, self.sha, self.prefixes)
+
+
+class TreeHashIndexes(object):
+    """Keeps the index for the latest commit of each repository"""
+
+    index_class = TreeHashIndex
+
+    def __init__(self):
+        self._indexes = {}
+        self._lock = threading.RLock()
+
+    def get(self, repo, sha, prefixes=None, cache=None, backend=None):
+        key = repo.working_dir
+        prefixes = tuple(prefixes or ())
+        with self._lock:
+            index = self._indexes.get(key)
+            stale = (
+                index is None
+                or index.sha != sha
+                or index.prefixes != prefixes)
+            if stale:
+                index = self._indexes[key] = self.index_class(
+                    repo, sha, prefixes, cache=cache, backend=backend)
+            else:
+                index.repo = repo
+                index.backend = backend
+            return index
+
+    def invalidate(self, repo_path):
+        with self._lock:
+            self._indexes.pop(repo_path, None)
+
+
+tree_indexes = TreeHashIndexes()
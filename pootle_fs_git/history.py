@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) Pootle contributors.
+#
+# This file is a part of the Pootle project. It is distributed under the GPL3
+# or later license. See the LICENSE file for a copy of the license and the
+# AUTHORS file for copyright and authorship information.
+
+import logging
+import threading
+from collections import namedtuple
+
+from .instrumentation import git_operation, repo_project
+
+
+logger = logging.getLogger(__name__)
+
+LOG_FORMAT = "--format=%x01%H%x00%an%x00%ae"
+
+LastCommit = namedtuple(
+    "LastCommit",
+    ["hexsha", "author_name", "author_email"])
+
+
+def parse_log(stream, chunk_size=65536):
+    """Yields ``LastCommit``, ``/path`` for each path in a streamed
+    ``git log -z --name-only`` using ``LOG_FORMAT``
+    """
+    commit = None
+    header = [None] * 3
+    remainder = b""
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        tokens = (remainder + chunk).split(b"\0")
+        remainder = tokens.pop()
+        for token in tokens:
+            token = token.decode("utf-8")
+            if len(header) < 3:
+                header.append(token)
+                if len(header) == 3:
+                    commit = LastCommit(*header)
+                continue
+            token = token.lstrip("\n")
+            if token.startswith("\x01"):
+                header = [token[1:]]
+            elif token:
+                yield commit, "/%s" % token
+
+
+def iter_log(repo, sha, prefixes=None):
+    """Yields ``LastCommit``, ``/path`` for the files changed by each commit
+    from ``sha`` backwards, streamed from ``git log``. Closing the generator
+    interrupts git.
+    """
+    proc = repo.git.log(
+        "-z", "--name-only", "--no-renames", LOG_FORMAT,
+        sha, "--", *(prefixes or ()),
+        as_process=True)
+    try:
+        for commit, path in parse_log(proc.stdout):
+            yield commit, path
+        proc.wait()
+    finally:
+        # interrupts git if history was not read to the end
+        proc.__del__()
+
+
+class LastCommits(object):
+    """Last commit touching each translation file, as of commit ``sha``
+
+    Paths are resolved in batches with a single streamed ``git log`` that is
+    interrupted as soon as every requested path has been seen. As history is
+    walked from the newest commit, the first commit seen for any path is its
+    last commit, so every path seen along the way is kept.
+
+    If a ``backend`` is given history is read with it instead.
+    """
+
+    def __init__(self, repo, sha, prefixes=None, backend=None):
+        self.repo = repo
+        self.sha = sha
+        self.prefixes = tuple(prefixes or ())
+        self.backend = backend
+        self.commits = {}
+        self.unresolved = set()
+
+    def __contains__(self, path):
+        return path in self.commits or path in self.unresolved
+
+    def get(self, path):
+        return self.commits.get(path)
+
+    def resolve(self, paths):
+        pending = set(
+            path for path in paths
+            if path not in self)
+        if not pending:
+            return
+        logger.debug(
+            "Resolving last commits (%s): %s paths"
+            % (self.repo.working_dir, len(pending)))
+        with git_operation("log", repo_project(self.repo)):
+            if self.backend:
+                log = self.backend.iter_log(self.sha, self.prefixes)
+            else:
+                log = iter_log(self.repo, self.sha, self.prefixes)
+            try:
+                for commit, path in log:
+                    self.commits.setdefault(path, commit)
+                    pending.discard(path)
+                    if not pending:
+                        break
+            finally:
+                log.close()
+        self.unresolved.update(pending)
+
+
+class LastCommitsCache(object):
+    """Keeps the last commits resolved for the latest commit of each
+    repository
+    """
+
+    last_commits_class = LastCommits
+
+    def __init__(self):
+        self._last_commits = {}
+        self._lock = threading.RLock()
+
+    def get(self, repo, sha, prefixes=None, backend=None):
+        key = repo.working_dir
+        prefixes = tuple(prefixes or ())
+        with self._lock:
+            last_commits = self._last_commits.get(key)
+            stale = (
+                last_commits is None
+                or last_commits.sha != sha
+                or last_commits.prefixes != prefixes)
+            if stale:
+                last_commits = self._last_commits[key] = (
+                    self.last_commits_class(
+                        repo, sha, prefixes, backend=backend))
+            else:
+                last_commits.repo = repo
+                last_commits.backend = backend
+            return last_commits
+
+    def invalidate(self, repo_path):
+        with self._lock:
+            self._last_commits.pop(repo_path, None)
+
+
+last_commits = LastCommitsCache()
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) Pootle contributors.
+#
+# This file is a part of the Pootle project. It is distributed under the GPL3
+# or later license. See the LICENSE file for a copy of the license and the
+# AUTHORS file for copyright and authorship information.
+
+"""Timing and subprocess accounting for the plugin's git operations.
+
+Each operation is timed with ``git_operation``, which counts the ``git``
+processes started and the bytes of output read from them by repositories
+opened with ``InstrumentedRepo``. Operations can be nested, the processes
+of an inner operation are counted in all of the enclosing ones.
+
+When an operation ends ``git_operation_done`` is sent with it, and the
+default receiver aggregates the operations of each project in ``stats``.
+"""
+
+from contextlib import contextmanager
+import logging
+import os
+import threading
+import time
+
+from git import Git, Repo
+
+from django.dispatch import Signal
+
+
+logger = logging.getLogger(__name__)
+
+git_operation_done = Signal(providing_args=["operation"])
+
+_local = threading.local()
+
+
+class GitOperation(object):
+
+    def __init__(self, name, project=None):
+        self.name = name
+        self.project = project
+        self.duration = None
+        self.subprocesses = 0
+        self.bytes = 0
+        self.failed = False
+
+    def __repr__(self):
+        return (
+            "<GitOperation %s (%s): %.3fs, %s subprocesses, %s bytes>"
+            % (self.name, self.project, self.duration or 0,
+               self.subprocesses, self.bytes))
+
+    def add_output(self, output):
+        if isinstance(output, tuple):
+            for item in output[1:]:
+                self.add_output(item)
+        elif isinstance(output, (bytes, type(u""))):
+            self.bytes += len(output)
+
+
+def active_operations():
+    if not hasattr(_local, "operations"):
+        _local.operations = []
+    return _local.operations
+
+
+def repo_project(repo):
+    """The code of the project a working copy belongs to, which is the name
+    of its directory
+    """
+    return os.path.basename(repo.working_dir.rstrip(os.sep))
+
+
+@contextmanager
+def git_operation(name, project=None):
+    operation = GitOperation(name, project)
+    operations = active_operations()
+    operations.append(operation)
+    start = time.time()
+    try:
+        yield operation
+    except Exception:
+        operation.failed = True
+        raise
+    finally:
+        operation.duration = time.time() - start
+        operations.remove(operation)
+        operation_done(operation)
+
+
+def operation_done(operation):
+    """Logs a finished ``operation`` and sends ``git_operation_done``"""
+    logger.debug(
+        "Git operation %s (%s): %.3fs, %s subprocesses, %s bytes%s",
+        operation.name, operation.project, operation.duration,
+        operation.subprocesses, operation.bytes,
+        operation.failed and ", failed" or "")
+    git_operation_done.send(sender=GitOperation, operation=operation)
+
+
+class InstrumentedGit(Git):
+    """Counts the processes run and their output in the active operations"""
+
+    def execute(self, *args, **kwargs):
+        operations = active_operations()
+        for operation in operations:
+            operation.subprocesses += 1
+        result = super(InstrumentedGit, self).execute(*args, **kwargs)
+        for operation in operations:
+            operation.add_output(result)
+        return result
+
+
+class InstrumentedRepo(Repo):
+    GitCommandWrapperType = InstrumentedGit
+
+
+def clone_repo(url, path, **kwargs):
+    """Clones ``url`` into ``path`` with the ``git clone`` options in
+    ``kwargs``
+    """
+    InstrumentedGit(os.getcwd()).clone(url, path, **kwargs)
+    return InstrumentedRepo(path)
+
+
+class GitOperationStats(object):
+    """Totals of the git operations of each project by operation name"""
+
+    fields = ("count", "failed", "duration", "max_duration",
+              "subprocesses", "bytes")
+
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.RLock()
+
+    def add(self, operation):
+        key = (operation.project, operation.name)
+        with self._lock:
+            stat = self._stats.get(key)
+            if stat is None:
+                stat = self._stats[key] = dict.fromkeys(self.fields, 0)
+            stat["count"] += 1
+            stat["failed"] += int(operation.failed)
+            stat["duration"] += operation.duration
+            stat["max_duration"] = max(
+                stat["max_duration"], operation.duration)
+            stat["subprocesses"] += operation.subprocesses
+            stat["bytes"] += operation.bytes
+
+    def get(self, project=None):
+        """Returns a copy of the totals by ``(project, name)``, limited to
+        ``project`` if given
+        """
+        with self._lock:
+            return dict(
+                (key, dict(stat))
+                for key, stat in self._stats.items()
+                if project is None or key[0] == project)
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+
+
+stats = GitOperationStats()
+
+
+def aggregate_operation(sender, operation, **kwargs):
+    stats.add(operation)
+
+
+git_operation_done.connect(
+    aggregate_operation,
+    sender=GitOperation,
+    dispatch_uid="pootle_fs_git.instrumentation.aggregate_operation")
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) Pootle contributors.
+#
+# This file is a part of the Pootle project. It is distributed under the GPL3
+# or later license. See the LICENSE file for a copy of the license and the
+# AUTHORS file for copyright and authorship information.
+
+from contextlib import contextmanager
+import errno
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # locking is not available on this platform
+    fcntl = None
+
+
+LOCK_POLL_INTERVAL = 0.1
+
+_local = threading.local()
+
+
+class LockTimeout(Exception):
+    pass
+
+
+class HeldLock(object):
+
+    def __init__(self, fd, exclusive):
+        self.fd = fd
+        self.exclusive = exclusive
+        self.depth = 0
+
+
+class RepoLock(object):
+    """Read/write lock on a repository shared between threads, processes and
+    nodes, using ``flock`` on a lock file.
+
+    Locks are reentrant within a thread, taking a read lock while holding a
+    write lock keeps the write lock. Taking a write lock while holding a
+    read lock upgrades it for the duration, which is not atomic, another
+    writer may get the lock in between. If the upgrade times out the read
+    lock is taken again before ``LockTimeout`` is raised.
+
+    If ``timeout`` is set, ``LockTimeout`` is raised if the lock could not be
+    taken within that many seconds.
+    """
+
+    def __init__(self, path, timeout=None):
+        self.path = path
+        self.timeout = timeout
+
+    @property
+    def held(self):
+        if not hasattr(_local, "locks"):
+            _local.locks = {}
+        return _local.locks
+
+    def read(self):
+        return self.acquire(exclusive=False)
+
+    def write(self):
+        return self.acquire(exclusive=True)
+
+    @contextmanager
+    def acquire(self, exclusive):
+        if fcntl is None:
+            yield
+            return
+        lock = self.held.get(self.path)
+        if lock is None:
+            lock = self.held[self.path] = HeldLock(self.open(), exclusive)
+            try:
+                self.lock(lock.fd, exclusive)
+            except Exception:
+                del self.held[self.path]
+                os.close(lock.fd)
+                raise
+            upgraded = False
+        else:
+            upgraded = exclusive and not lock.exclusive
+            if upgraded:
+                try:
+                    self.lock(lock.fd, True)
+                except Exception:
+                    # converting the lock drops the shared lock first, it
+                    # is taken again for the enclosing read
+                    fcntl.flock(lock.fd, fcntl.LOCK_SH)
+                    raise
+                lock.exclusive = True
+        lock.depth += 1
+        try:
+            yield
+        finally:
+            lock.depth -= 1
+            if upgraded:
+                fcntl.flock(lock.fd, fcntl.LOCK_SH)
+                lock.exclusive = False
+            if not lock.depth:
+                del self.held[self.path]
+                fcntl.flock(lock.fd, fcntl.LOCK_UN)
+                os.close(lock.fd)
+
+    def open(self):
+        directory = os.path.dirname(self.path)
+        if not os.path.exists(directory):
+            try:
+                os.makedirs(directory)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+        return os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+
+    def lock(self, fd, exclusive):
+        operation = exclusive and fcntl.LOCK_EX or fcntl.LOCK_SH
+        if self.timeout is None:
+            fcntl.flock(fd, operation)
+            return
+        start = time.time()
+        while not self.try_lock(fd, exclusive):
+            if time.time() - start >= self.timeout:
+                raise self.timed_out()
+            time.sleep(LOCK_POLL_INTERVAL)
+
+    def try_lock(self, fd, exclusive):
+        """Takes the lock without waiting, returning whether it was taken"""
+        operation = exclusive and fcntl.LOCK_EX or fcntl.LOCK_SH
+        try:
+            fcntl.flock(fd, operation | fcntl.LOCK_NB)
+        except (IOError, OSError) as e:
+            if e.errno not in (errno.EAGAIN, errno.EACCES):
+                raise
+            return False
+        return True
+
+    def timed_out(self):
+        return LockTimeout(
+            "Unable to lock git repository within %ss: %s"
+            % (self.timeout, self.path))
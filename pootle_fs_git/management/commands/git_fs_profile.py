@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) Pootle contributors.
+#
+# This file is a part of the Pootle project. It is distributed under the GPL3
+# or later license. See the LICENSE file for a copy of the license and the
+# AUTHORS file for copyright and authorship information.
+
+from django.core.management.base import CommandError
+
+from pootle_fs.exceptions import FSStateError
+from pootle_fs.management.commands import ProjectSubCommand
+
+from pootle_fs_git.plugin import GitPlugin
+from pootle_fs_git.profile import DEFAULT_PROFILE_PATHS
+
+
+class Command(ProjectSubCommand):
+    help = (
+        "Fetch, and optionally sync, a git project and show where the time "
+        "was spent. Profiling must be enabled with the project's "
+        "``pootle.fs.profile`` config.")
+
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument(
+            '--sync',
+            action='store_true',
+            dest='sync',
+            help='Sync the project after fetching')
+        parser.add_argument(
+            '-p', '--fs_path',
+            action='store',
+            dest='fs_path',
+            help='Filter synced translations by filesystem path')
+        parser.add_argument(
+            '-P', '--pootle_path',
+            action='store',
+            dest='pootle_path',
+            help='Filter synced translations by Pootle path')
+        parser.add_argument(
+            '--paths',
+            type=int,
+            default=DEFAULT_PROFILE_PATHS,
+            dest='paths',
+            help='Number of slowest paths to show')
+
+    def write_profile(self, profile, paths):
+        for line in profile.lines(paths):
+            self.stdout.write(line)
+        self.stdout.write("")
+
+    def handle(self, *args, **options):
+        fs = self.get_fs(options["project"])
+        if not isinstance(fs.plugin, GitPlugin):
+            raise CommandError(
+                "Project is not configured with git: %s"
+                % options["project"])
+        if not fs.plugin.profile_enabled:
+            raise CommandError(
+                "Profiling is not enabled for project: %s"
+                % options["project"])
+        self.write_profile(fs.fetch().profile, options["paths"])
+        if not options["sync"]:
+            return
+        try:
+            response = fs.sync(
+                fs_path=options["fs_path"],
+                pootle_path=options["pootle_path"])
+        except FSStateError as e:
+            raise CommandError(e)
+        profile = getattr(response, "profile", None)
+        if profile is None:
+            self.stdout.write("Nothing was pushed")
+            return
+        self.write_profile(profile, options["paths"])
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) Pootle contributors.
+#
+# This file is a part of the Pootle project. It is distributed under the GPL3
+# or later license. See the LICENSE file for a copy of the license and the
+# AUTHORS file for copyright and authorship information.
+
+import logging
+import os
+from io import BytesIO
+
+from gitdb.base import IStream
+from gitdb.typ import str_blob_type, str_tree_type
+
+from git.objects import Commit
+from git.objects.fun import tree_entries_from_data, tree_to_stream
+from git.util import bin_to_hex, hex_to_bin
+
+
+logger = logging.getLogger(__name__)
+
+BLOB_MODE = 0o100644
+TREE_MODE = 0o040000
+
+
+def _tree_sort_key(entry):
+    # git sorts trees by name, with directories compared as "name/"
+    binsha_, mode, name = entry
+    name = name.encode("utf-8")
+    if mode == TREE_MODE:
+        return name + b"/"
+    return name
+
+
+class TreeBuilder(object):
+    """Builds a new tree from the tree ``tree_sha`` and a set of changed
+    paths, writing blobs and trees straight into the object store.
+
+    Neither the index nor the working tree are read or written. Only the
+    trees on the path to a changed file are read and rewritten, every other
+    subtree is reused by sha.
+    """
+
+    def __init__(self, repo, tree_sha=None):
+        self.repo = repo
+        self.tree_sha = tree_sha
+        self.changes = {}
+        self._written = None
+
+    @property
+    def odb(self):
+        return self.repo.odb
+
+    @property
+    def is_dirty(self):
+        return self.write() != self.tree_sha
+
+    def store(self, type_, data):
+        return self.odb.store(
+            IStream(type_, len(data), BytesIO(data))).binsha
+
+    def store_blob(self, data):
+        return self.store(str_blob_type, data)
+
+    def add(self, path, file_path):
+        """Stores the content of ``file_path`` as a blob at ``path``"""
+        with open(file_path, "rb") as f:
+            self.changes[path.strip("/")] = self.store_blob(f.read())
+        self._written = None
+
+    def remove(self, path):
+        self.changes[path.strip("/")] = None
+        self._written = None
+
+    def update(self, changes):
+        """Applies a dictionary of ``path`` -> blob binsha, or ``None`` to
+        remove the path
+        """
+        for path, binsha in changes.items():
+            self.changes[path.strip("/")] = binsha
+        self._written = None
+
+    def read_tree(self, binsha):
+        if binsha is None:
+            return {}
+        return dict(
+            (name, (entry_sha, mode))
+            for entry_sha, mode, name
+            in tree_entries_from_data(self.odb.stream(binsha).read()))
+
+    def write_tree(self, binsha, changes):
+        entries = self.read_tree(binsha)
+        for name, change in changes.items():
+            if isinstance(change, dict):
+                current = entries.get(name)
+                subtree = self.write_tree(
+                    (current[0]
+                     if current and current[1] == TREE_MODE
+                     else None),
+                    change)
+                if subtree is None:
+                    entries.pop(name, None)
+                else:
+                    entries[name] = (subtree, TREE_MODE)
+            elif change is None:
+                entries.pop(name, None)
+            else:
+                current = entries.get(name)
+                mode = (
+                    current[1]
+                    if current and current[1] != TREE_MODE
+                    else BLOB_MODE)
+                entries[name] = (change, mode)
+        if not entries:
+            return None
+        tree = BytesIO()
+        tree_to_stream(
+            sorted(
+                ((entry_sha, mode, name)
+                 for name, (entry_sha, mode)
+                 in entries.items()),
+                key=_tree_sort_key),
+            tree.write)
+        return self.store(str_tree_type, tree.getvalue())
+
+    def write(self):
+        """Writes the changed trees and returns the sha of the new root
+        tree
+        """
+        if self._written:
+            return self._written
+        changes = {}
+        for path, change in self.changes.items():
+            parts = path.split("/")
+            parent = changes
+            for part in parts[:-1]:
+                if not isinstance(parent.get(part), dict):
+                    parent[part] = {}
+                parent = parent[part]
+            parent[parts[-1]] = change
+        binsha = self.write_tree(
+            self.tree_sha and hex_to_bin(self.tree_sha),
+            changes)
+        if binsha is None:
+            # an empty tree
+            binsha = self.store(str_tree_type, b"")
+        self._written = bin_to_hex(binsha).decode("ascii")
+        return self._written
+
+    def commit(self, msg, parent, author=None, committer=None):
+        """Creates a commit of the new tree on top of ``parent``.
+
+        :returns: the new ``Commit``, or ``None`` if the tree is unchanged
+        """
+        tree_sha = self.write()
+        if tree_sha == self.tree_sha:
+            return None
+        commit = Commit.create_from_tree(
+            self.repo,
+            self.repo.tree(tree_sha),
+            msg,
+            parent_commits=[parent],
+            head=False,
+            author=author,
+            committer=committer)
+        logger.debug(
+            "Created commit (%s): %s"
+            % (os.path.basename(self.repo.working_dir), commit.hexsha))
+        self.tree_sha = tree_sha
+        self.changes = {}
+        self._written = None
+        return self.repo.commit(commit.hexsha)
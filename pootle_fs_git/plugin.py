@@ -6,25 +6,54 @@
 # or later license. See the LICENSE file for a copy of the license and the
 # AUTHORS file for copyright and authorship information.
 
+import hashlib
 import logging
 import os
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
 
-from git import Actor, Repo
+from git import Actor
 from git.exc import GitCommandError
 
 from django.conf import settings
+from django.utils.functional import cached_property
 
 from pootle_fs.exceptions import FSFetchError
+from pootle_fs.models import StoreFS
 from pootle_fs.plugin import Plugin
 
-from .branch import tmp_branch, PushError
+from .backends import backends
+from .branch import (
+    DEFAULT_PUSH_BACKOFF, DEFAULT_PUSH_RETRIES, PushError, tmp_branch,
+    tmp_object_branch, tmp_worktree)
+from .commands import GitCommand, git_options, run_steps
 from .files import GitFSFile
+from .hashes import (
+    TreeHashCache, translation_prefixes, tree_indexes)
+from .history import last_commits
+from .instrumentation import git_operation
+from .locks import RepoLock
+from .profile import SyncProfile, profile_iter, profile_phase
+from .repo import repos
 
 
 logger = logging.getLogger(__name__)
 
 DEFAULT_COMMIT_MSG = "Translation files updated from Pootle"
 
+FetchResult = namedtuple(
+    "FetchResult",
+    ["old_sha", "new_sha", "changed_paths", "profile"])
+FetchResult.__new__.__defaults__ = (None, )
+
+# settings read once for all of the commits of a push
+GitSettings = namedtuple(
+    "GitSettings",
+    ["author", "committer", "commit_message"])
+
+PUSH_ACTIONS = (
+    "pushed_to_fs", "merged_from_pootle", "merged_from_fs", "removed")
+
 
 class Commit(object):
 
@@ -32,60 +61,207 @@ class Commit(object):
         self.to_add = set()
         self.to_remove = set()
         self.authors = set()
+        # fs paths of both additions and removals
+        self.paths = set()
+        # the response actions that the commit is made from
+        self.actions = []
+        # bytes of the files to add
+        self.size = 0
+
+    def __contains__(self, path):
+        return path in self.paths
 
-    def add(self, path):
+    def add(self, path, size=0):
         self.to_add.add(path)
+        self.paths.add(path)
+        self.size += size
 
     def remove(self, path):
         self.to_remove.add(path)
+        self.paths.add(path)
 
     def add_author(self, name, email):
         self.authors.add((name, email))
 
-    @property
-    def paths(self):
-        return self.to_add.union(self.to_remove)
-
 
 class Changelog(object):
+    """Groups the completed actions of a response into commits.
+
+    ``grouping`` is one of:
 
-    def __init__(self, plugin, response):
+    - ``single``: a single commit, crediting multiple authors in the
+      commit message
+    - ``author``: a commit for each author, removals are committed
+      separately
+    - ``language``: a commit for each language
+
+    If ``max_files`` or ``max_bytes`` are set, each group is split into
+    commits of at most that many files or bytes, and commits are yielded
+    as soon as they are full.
+
+    If a ``profile`` is given, building the changelog and resolving the
+    authors are timed in it.
+    """
+
+    groupings = ("single", "author", "language")
+
+    def __init__(self, plugin, response, grouping="single",
+                 max_files=None, max_bytes=None, profile=None):
         self.plugin = plugin
+        self.profile = profile
         self.response = response
+        if grouping not in self.groupings:
+            raise ValueError(
+                "Unknown commit grouping: %s" % grouping)
+        self.grouping = grouping
+        self.max_files = max_files
+        self.max_bytes = max_bytes
 
     @property
     def commits(self):
-        return self.by_author(self.response)
+        return list(self.iter_commits())
+
+    @property
+    def is_chunked(self):
+        return bool(self.max_files or self.max_bytes)
+
+    def iter_commits(self):
+        return profile_iter(
+            self.profile, "changelog", self.by_author(self.response))
+
+    @property
+    def completed(self):
+        return list(
+            self.response.completed(
+                "pushed_to_fs", "merged_from_pootle",
+                "removed", "merged_from_fs"))
+
+    @property
+    def tree_paths(self):
+        """Translation file paths in the current tree, translation files can
+        only be removed if they are tracked
+        """
+        return self.plugin.tree_index
+
+    def get_submitters(self, store_fs_ids):
+        """Returns a dictionary of ``store_fs_id`` -> (``display_name``,
+        ``email``) of the last submitter to the store of each of
+        ``store_fs_ids``, loading them all in a single query
+        """
+        if not store_fs_ids:
+            return {}
+        store_fses = StoreFS.objects.filter(
+            pk__in=store_fs_ids,
+            store__data__last_submission__submitter__isnull=False)
+        store_fses = store_fses.select_related(
+            "store__data__last_submission__submitter")
+        submitters = {}
+        for store_fs in store_fses.iterator():
+            user = store_fs.store.data.last_submission.submitter
+            submitters[store_fs.pk] = (user.display_name, user.email)
+        return submitters
+
+    def get_group(self, resp, author):
+        if self.grouping == "author":
+            return author
+        elif self.grouping == "language":
+            return resp.pootle_path.split("/")[1]
+
+    def get_size(self, resp):
+        if not self.max_bytes or resp.action_type == "removed":
+            return 0
+        return os.path.getsize(
+            os.path.join(
+                self.plugin.project.local_fs_path,
+                resp.fs_path[1:]))
+
+    def is_full(self, commit, size):
+        return bool(
+            (self.max_files
+             and len(commit.paths) >= self.max_files)
+            or (self.max_bytes
+                and commit.paths
+                and commit.size + size > self.max_bytes))
 
     def by_author(self, response):
-        """Groups into a single commit, if there is more than one author
-        credits, are added in commit message"""
-        commit = Commit()
-        completed = response.completed(
-            "pushed_to_fs", "merged_from_pootle", "removed", "merged_from_fs")
-        tree = self.plugin.repo.tree()
+        """Yields the completed actions grouped into commits, if a commit
+        has more than one author, they are credited in the commit message"""
+        completed = self.completed
+        with profile_phase(self.profile, "author resolution"):
+            submitters = self.get_submitters(
+                set(resp.store_fs.pk
+                    for resp in completed
+                    if resp.action_type != "removed"))
+        commits = OrderedDict()
+        paths = set()
+        tree_paths = self.tree_paths
         for resp in completed:
-            if resp.pootle_path in commit.paths:
+            # each path is committed once, whichever commit it falls in
+            if resp.fs_path in paths:
                 continue
+            paths.add(resp.fs_path)
+            if resp.action_type == "removed":
+                author = None
+            else:
+                author = submitters.get(resp.store_fs.pk)
+            group = self.get_group(resp, author)
+            size = self.get_size(resp)
+            commit = commits.get(group)
+            if commit is not None and self.is_full(commit, size):
+                yield commits.pop(group)
+                commit = None
+            if commit is None:
+                commit = commits[group] = Commit()
             if resp.action_type == "removed":
-                try:
-                    tree[resp.fs_path[1:]]
-                    commit.remove(resp.fs_path)
-                except KeyError:
-                    pass
+                if resp.fs_path not in tree_paths:
+                    continue
+                commit.remove(resp.fs_path)
             else:
-                commit.add(resp.fs_path)
-                user = resp.store_fs.store.data.last_submission.submitter
-                commit.add_author(user.display_name, user.email)
-        return [commit]
+                commit.add(resp.fs_path, size)
+                if author:
+                    commit.add_author(*author)
+            commit.actions.append(resp)
+        for commit in commits.values():
+            yield commit
 
 
 class GitPlugin(Plugin):
     name = "git"
     file_class = GitFSFile
+    # the ``SyncProfile`` of the running fetch or push, if profiling
+    profile = None
+
+    @cached_property
+    def git_settings(self):
+        """Snapshot of the commit settings, read from the project config
+        once until they are invalidated
+        """
+        return GitSettings(
+            author=self.get_author(),
+            committer=self.get_committer(),
+            commit_message=self.get_commit_message())
+
+    def invalidate_settings(self):
+        if "git_settings" in self.__dict__:
+            del self.__dict__["git_settings"]
+
+    def reload(self):
+        super(GitPlugin, self).reload()
+        self.invalidate_settings()
 
     @property
     def author(self):
+        return self.git_settings.author
+
+    @property
+    def committer(self):
+        return self.git_settings.committer
+
+    @property
+    def commit_message(self):
+        return self.git_settings.commit_message
+
+    def get_author(self):
         author_name = self.project.config.get(
             "pootle.fs.author_name",
             getattr(settings, "POOTLE_FS_AUTHOR", None))
@@ -96,8 +272,7 @@ class GitPlugin(Plugin):
             return None
         return Actor(author_name, author_email)
 
-    @property
-    def committer(self):
+    def get_committer(self):
         committer_name = self.project.config.get(
             "pootle.fs.committer_name",
             getattr(settings, "POOTLE_FS_COMMITTER", None))
@@ -108,27 +283,270 @@ class GitPlugin(Plugin):
             return None
         return Actor(committer_name, committer_email)
 
+    @property
+    def clone_depth(self):
+        return self.project.config.get(
+            "pootle.fs.clone_depth",
+            getattr(settings, "POOTLE_FS_GIT_CLONE_DEPTH", None))
+
+    @property
+    def clone_filter(self):
+        return self.project.config.get(
+            "pootle.fs.clone_filter",
+            getattr(settings, "POOTLE_FS_GIT_CLONE_FILTER", None))
+
+    @property
+    def sparse_checkout(self):
+        return self.project.config.get(
+            "pootle.fs.sparse_checkout",
+            getattr(settings, "POOTLE_FS_GIT_SPARSE_CHECKOUT", False))
+
+    @property
+    def commit_grouping(self):
+        return self.project.config.get(
+            "pootle.fs.commit_grouping",
+            getattr(settings, "POOTLE_FS_GIT_COMMIT_GROUPING", "single"))
+
+    @property
+    def commit_max_files(self):
+        return self.project.config.get(
+            "pootle.fs.commit_max_files",
+            getattr(settings, "POOTLE_FS_GIT_COMMIT_MAX_FILES", None))
+
+    @property
+    def commit_max_bytes(self):
+        return self.project.config.get(
+            "pootle.fs.commit_max_bytes",
+            getattr(settings, "POOTLE_FS_GIT_COMMIT_MAX_BYTES", None))
+
+    @property
+    def push_mode(self):
+        return self.project.config.get(
+            "pootle.fs.push_mode",
+            getattr(settings, "POOTLE_FS_GIT_PUSH_MODE", "checkout"))
+
+    @property
+    def push_retries(self):
+        return self.project.config.get(
+            "pootle.fs.push_retries",
+            getattr(
+                settings,
+                "POOTLE_FS_GIT_PUSH_RETRIES",
+                DEFAULT_PUSH_RETRIES))
+
+    @property
+    def push_backoff(self):
+        return self.project.config.get(
+            "pootle.fs.push_backoff",
+            getattr(
+                settings,
+                "POOTLE_FS_GIT_PUSH_BACKOFF",
+                DEFAULT_PUSH_BACKOFF))
+
+    @property
+    def profile_enabled(self):
+        return self.project.config.get(
+            "pootle.fs.profile",
+            getattr(settings, "POOTLE_FS_GIT_PROFILE", False))
+
+    def new_profile(self, name):
+        """Returns a ``SyncProfile`` for a fetch or push, or ``None`` if
+        profiling is not enabled for the project
+        """
+        if self.profile_enabled:
+            return SyncProfile(self.project.code, name)
+
+    @contextmanager
+    def profiling(self, profile):
+        self.profile = profile
+        try:
+            with profile.profiling():
+                yield profile
+        finally:
+            self.profile = None
+
+    def tmp_branch(self):
+        if self.push_mode == "worktree":
+            return tmp_worktree(self)
+        elif self.push_mode == "objects":
+            return tmp_object_branch(
+                self,
+                retries=self.push_retries,
+                backoff=self.push_backoff,
+                profile=self.profile)
+        return tmp_branch(self)
+
+    @property
+    def clone_kwargs(self):
+        kwargs = {}
+        if self.clone_depth:
+            kwargs["depth"] = self.clone_depth
+        if self.clone_filter:
+            kwargs["filter"] = self.clone_filter
+        if self.sparse_checkout and self.translation_prefixes:
+            kwargs["sparse"] = True
+        return kwargs
+
     @property
     def repo(self):
-        return Repo(self.project.local_fs_path)
+        return repos.get(self.project.local_fs_path)
+
+    @property
+    def git_backend(self):
+        return self.project.config.get(
+            "pootle.fs.git_backend",
+            getattr(settings, "POOTLE_FS_GIT_BACKEND", "gitpython"))
+
+    @property
+    def backend(self):
+        return backends.get(self.git_backend, self.project.local_fs_path)
+
+    def git_operation(self, name):
+        return git_operation(name, self.project.code)
+
+    @property
+    def lock_timeout(self):
+        return self.project.config.get(
+            "pootle.fs.lock_timeout",
+            getattr(settings, "POOTLE_FS_GIT_LOCK_TIMEOUT", None))
+
+    @property
+    def lock(self):
+        """Lock on the project's repository, write locks are taken to fetch,
+        sync and push, read locks to read hashes and history
+        """
+        return RepoLock(
+            "%s.lock" % self.project.local_fs_path.rstrip(os.sep),
+            timeout=self.lock_timeout)
+
+    def invalidate_repo(self):
+        repos.invalidate(self.project.local_fs_path)
+        backends.invalidate(self.project.local_fs_path)
+
+    def clear_repo(self):
+        with self.lock.write():
+            self.invalidate_repo()
+            super(GitPlugin, self).clear_repo()
+
+    def git_command(self, name, args, progress=False):
+        return GitCommand(
+            name, args,
+            project=self.project.code,
+            cwd=self.project.local_fs_path,
+            progress=progress)
+
+    def remote_hash_steps(self):
+        """Yields the steps to read the sha of the remote master, and then
+        the sha, or ``None`` if it cannot be read
+        """
+        result = yield self.git_command(
+            "ls_remote", ["ls-remote", "origin", "refs/heads/master"])
+        try:
+            refs = result.check()
+        except GitCommandError as e:
+            logger.warning(
+                "Unable to read remote git branch (%s): %s"
+                % (self.project.code, e))
+            refs = None
+        yield refs and refs.split()[0] or None
 
     def fetch(self):
+        """Clones or updates the repository
+
+        :returns: a ``FetchResult`` with the shas of HEAD before and after
+          fetching, the set of translation file paths that changed, or
+          ``None`` if they are unknown, and a ``SyncProfile`` if profiling
+          is enabled
+        """
+        profile = self.new_profile("fetch")
+        with self.lock.write():
+            if profile is None:
+                return self.fetch_repo()
+            with self.profiling(profile):
+                result = self.fetch_repo()
+        if result.changed_paths is not None:
+            profile.actions["changed"] = len(result.changed_paths)
+        return result._replace(profile=profile)
+
+    def fetch_repo(self):
+        return run_steps(self.fetch_steps())
+
+    def fetch_steps(self):
+        """Yields the steps to clone or update the repository, and then the
+        ``FetchResult``
+        """
         if not self.is_cloned:
             logger.info(
                 "Cloning git repository(%s): %s"
                 % (self.project.code, self.fs_url))
+            self.invalidate_repo()
+            clone_kwargs = self.clone_kwargs
             try:
-                Repo.clone_from(self.fs_url, self.project.local_fs_path)
+                (yield GitCommand(
+                    "clone",
+                    (["clone"]
+                     + git_options(**clone_kwargs)
+                     + ["--", self.fs_url, self.project.local_fs_path]),
+                    project=self.project.code,
+                    progress=True)).check()
+                if clone_kwargs.get("sparse"):
+                    (yield self.git_command(
+                        "clone",
+                        (["sparse-checkout", "set"]
+                         + self.translation_prefixes))).check()
             except GitCommandError as e:
                 raise FSFetchError(e)
-        else:
+            yield FetchResult(None, self.latest_hash, None)
+            return
+        old_sha = self.latest_hash
+        if (yield self.remote_hash_steps()) == old_sha:
             logger.info(
-                "Pulling git repository(%s): %s"
+                "Git repository is up to date(%s): %s"
                 % (self.project.code, self.fs_url))
-            try:
-                self.repo.remote().pull("master:master", force=True)
-            except GitCommandError as e:
-                raise FSFetchError(e)
+            yield FetchResult(old_sha, old_sha, set())
+            return
+        logger.info(
+            "Pulling git repository(%s): %s"
+            % (self.project.code, self.fs_url))
+        # shallow clones cannot tell that the pull is a fast-forward, so
+        # git refuses to pull without being told how to reconcile branches
+        pull_kwargs = dict(force=True, no_rebase=True)
+        if self.clone_depth:
+            pull_kwargs["depth"] = self.clone_depth
+        try:
+            (yield self.git_command(
+                "pull",
+                (["pull"]
+                 + git_options(**pull_kwargs)
+                 + ["origin", "master:master"]),
+                progress=True)).check()
+        except GitCommandError as e:
+            raise FSFetchError(e)
+        finally:
+            self.invalidate_repo()
+        new_sha = self.latest_hash
+        yield FetchResult(
+            old_sha, new_sha, self.get_changed_paths(old_sha, new_sha))
+
+    def get_changed_paths(self, old_sha, new_sha):
+        """Returns the set of translation file paths that changed between
+        two commits, or ``None`` if they cannot be compared
+        """
+        if old_sha == new_sha:
+            return set()
+        tree_index = self.tree_index
+        # loading the hashes patches them from the last indexed commit
+        tree_index.hashes
+        index_matches = (
+            tree_index.sha == new_sha
+            and tree_index.base_sha == old_sha)
+        if index_matches:
+            return tree_index.changed_paths
+        with self.git_operation("tree_changes"):
+            changes = self.backend.read_changes(
+                old_sha, new_sha, self.translation_prefixes)
+        if changes is not None:
+            return set(changes)
 
     @property
     def latest_hash(self):
@@ -136,7 +554,52 @@ class GitPlugin(Plugin):
             return self.repo.commit().hexsha
 
     @property
-    def commit_message(self):
+    def translation_prefixes(self):
+        return translation_prefixes(
+            self.project.config.get(
+                "pootle_fs.translation_mappings", {}).values())
+
+    @property
+    def tree_hash_cache(self):
+        key = hashlib.sha1(
+            ("%s:%s"
+             % (self.project.code,
+                ":".join(self.translation_prefixes))).encode("utf-8"))
+        return TreeHashCache(
+            os.path.join(
+                self.repo.git_dir,
+                "pootle_fs",
+                "hashes.%s" % key.hexdigest()))
+
+    @property
+    def tree_index(self):
+        return tree_indexes.get(
+            self.repo,
+            self.latest_hash,
+            self.translation_prefixes,
+            cache=self.tree_hash_cache,
+            backend=self.backend)
+
+    @property
+    def last_commits(self):
+        return last_commits.get(
+            self.repo,
+            self.latest_hash,
+            self.translation_prefixes,
+            backend=self.backend)
+
+    def get_last_commit(self, path):
+        """Returns the ``LastCommit`` for ``path``, resolving all of the
+        translation files in the current tree at the same time
+        """
+        with self.lock.read():
+            last_commits = self.last_commits
+            if path not in last_commits:
+                last_commits.resolve(
+                    set(self.tree_index.hashes).union([path]))
+            return last_commits.get(path)
+
+    def get_commit_message(self):
         return self.project.config.get(
             "pootle.fs.commit_message",
             getattr(
@@ -165,58 +628,210 @@ class GitPlugin(Plugin):
                 Actor(*commit.authors.pop())
                 if commit.authors
                 else self.author)
-        branch.rm(commit.to_remove)
-        branch.add(add_paths)
-        if self.repo.is_dirty():
-            branch.commit(
-                commit_message,
-                author=author,
-                committer=self.committer)
+        with self.git_operation("index_remove"):
+            untracked = branch.rm(commit.to_remove)
+        if untracked:
+            logger.debug(
+                "Paths to remove are not tracked (%s): %s"
+                % (self.project.code, ", ".join(untracked)))
+        with self.git_operation("index_add"):
+            branch.add(add_paths)
+        if branch.is_dirty:
+            with self.git_operation("commit"):
+                branch.commit(
+                    commit_message,
+                    author=author,
+                    committer=self.committer)
             return True
 
+    def _push_chunk(self, branch, commit):
+        """Yields the steps to commit and push a single chunk of a chunked
+        changelog. If it fails, the actions of the chunk are marked as
+        failed and the branch is reset to the last pushed commit
+        """
+        head = branch.head_sha
+        try:
+            if self._commit_to_branch(branch, commit):
+                yield branch.push_steps()
+        except PushError as e:
+            logger.exception(e)
+            for action in commit.actions:
+                action.complete = False
+            with self.git_operation("reset"):
+                branch.reset(head)
+
     def _push_to_branch(self, changelog):
+        """Yields the steps to commit and push ``changelog``, and then the
+        paths that conflicted with upstream changes
+        """
         pushed = False
         try:
-            with tmp_branch(self) as branch:
-                for commit in changelog.commits:
-                    if commit.paths:
-                        _pushed = self._commit_to_branch(branch, commit)
-                        pushed = pushed or _pushed
+            with self.tmp_branch() as branch:
+                for commit in changelog.iter_commits():
+                    if not commit.paths:
+                        continue
+                    if changelog.is_chunked:
+                        yield self._push_chunk(branch, commit)
+                        continue
+                    _pushed = self._commit_to_branch(branch, commit)
+                    pushed = pushed or _pushed
                 if pushed:
-                    branch.push()
+                    yield branch.push_steps()
         except PushError as e:
             logger.exception(e)
             raise e
+        yield branch.update_steps()
+        yield branch.conflicts
+
+    def sync(self, *args, **kwargs):
+        """Syncs with the repository, holding the write lock as the store
+        files are written to the working tree before they are pushed
+        """
+        with self.lock.write():
+            return super(GitPlugin, self).sync(*args, **kwargs)
+
+    def sync_merge(self, *args, **kwargs):
+        with self.lock.write():
+            return super(GitPlugin, self).sync_merge(*args, **kwargs)
+
+    def sync_pull(self, *args, **kwargs):
+        with self.lock.write():
+            return super(GitPlugin, self).sync_pull(*args, **kwargs)
+
+    def sync_push(self, *args, **kwargs):
+        with self.lock.write():
+            return super(GitPlugin, self).sync_push(*args, **kwargs)
+
+    def sync_rm(self, *args, **kwargs):
+        with self.lock.write():
+            return super(GitPlugin, self).sync_rm(*args, **kwargs)
 
     def push(self, response):
+        """Commits and pushes the completed actions of ``response``. If
+        profiling is enabled a ``SyncProfile`` is set as
+        ``response.profile``
+        """
+        # the settings are read again for each push
+        self.invalidate_settings()
+        profile = self.new_profile("push")
+        with self.lock.write():
+            if profile is None:
+                return self.push_response(response)
+            with self.profiling(profile):
+                self.push_response(response)
+        profile.add_actions(response, PUSH_ACTIONS)
+        response.profile = profile
+        return response
+
+    def needs_push(self, response):
+        """Whether ``response`` made changes that should be pushed"""
         push_from_pootle = (
             "pushed_to_fs" in response
             or "merged_from_pootle" in response
             or "merged_from_fs" in response
             or "removed" in response)
-        if response.made_changes and push_from_pootle:
+        return bool(response.made_changes and push_from_pootle)
+
+    def get_changelog(self, response):
+        return Changelog(
+            self, response,
+            grouping=self.commit_grouping,
+            max_files=self.commit_max_files,
+            max_bytes=self.commit_max_bytes,
+            profile=self.profile)
+
+    def push_failed(self, response):
+        for action in response["pushed_to_fs"]:
+            action.complete = False
+        for action in response["merged_from_pootle"]:
+            action.complete = False
+        for action in response["merged_from_fs"]:
+            action.complete = False
+        for action in response["removed"]:
+            action.complete = False
+
+    def push_conflicted(self, response, conflicts):
+        if conflicts:
+            logger.warning(
+                "Files changed upstream while pushing (%s): %s"
+                % (self.project.code, ", ".join(sorted(conflicts))))
+        for action in response.completed(*PUSH_ACTIONS):
+            if action.fs_path in conflicts:
+                action.complete = False
+
+    def push_response(self, response):
+        return run_steps(self.push_steps(response))
+
+    def push_steps(self, response):
+        """Yields the steps to commit and push the completed actions of
+        ``response``, and then ``response``
+        """
+        if self.needs_push(response):
             try:
-                self._push_to_branch(Changelog(self, response))
+                conflicts = yield self._push_to_branch(
+                    self.get_changelog(response))
             except PushError as e:
-                for action in response["pushed_to_fs"]:
-                    action.failed = True
-                for action in response["merged_from_pootle"]:
-                    action.failed = True
-                for action in response["merged_from_fs"]:
-                    action.failed = True
-                for action in response["removed"]:
-                    action.failed = True
+                self.push_failed(response)
                 raise e
-        return response
-
-    def get_file_hash(self, path):
+            self.push_conflicted(response, conflicts)
+            self.update_file_hashes(response)
+        yield response
+
+    def update_file_hashes(self, response):
+        """Updates the file hashes cached in the state of ``response`` with
+        the pushed blob shas, as ``sync`` reads them after pushing to set
+        the ``last_sync_hash`` of the stores
+        """
+        resources = getattr(response.context, "resources", None)
+        # the hashes are only cached once the state has read them
+        file_hashes = resources and resources.__dict__.get("file_hashes")
+        if file_hashes is None:
+            return
+        tree_index = self.tree_index
+        for action in response.completed(*PUSH_ACTIONS):
+            file_hashes[action.pootle_path] = tree_index.get(action.fs_path)
+
+    def get_file_hashes(self, paths):
+        """Returns a dictionary of ``path`` -> sha of the last commit that
+        touched it, for each of ``paths`` that exists in the current tree
+        """
+        with self.lock.read():
+            tree_index = self.tree_index
+            prefixes = tuple(
+                "/%s/" % prefix for prefix in self.translation_prefixes)
+            tree_paths = {}
+            unindexed = []
+            for path in paths:
+                tree_path = "/%s" % path.strip("/")
+                if tree_path in tree_index:
+                    tree_paths[path] = tree_path
+                elif prefixes and not tree_path.startswith(prefixes):
+                    unindexed.append(path)
+            last_commits = self.last_commits
+            last_commits.resolve(tree_paths.values())
+            hashes = {}
+            for path, tree_path in tree_paths.items():
+                last_commit = last_commits.get(tree_path)
+                if last_commit:
+                    hashes[path] = last_commit.hexsha
+            for path in unindexed:
+                file_hash = self.get_unindexed_file_hash(path)
+                if file_hash:
+                    hashes[path] = file_hash
+            return hashes
+
+    def get_unindexed_file_hash(self, path):
+        """Returns the sha of the last commit that touched ``path``, for
+        files outside of the translation mappings, which are not indexed
+        """
         file_path = os.path.join(
             self.project.local_fs_path,
             path.strip("/"))
-        if os.path.exists(file_path):
+        if not os.path.exists(file_path):
+            return None
+        with self.git_operation("log"):
             return self.repo.git.log(
-                '-1',
-                '--pretty=%H',
-                '--follow',
-                '--',
-                file_path)
+                "-1", "--pretty=%H", "--", path.strip("/")) or None
+
+    def get_file_hash(self, path):
+        return self.get_file_hashes([path]).get(path)
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) Pootle contributors.
+#
+# This file is a part of the Pootle project. It is distributed under the GPL3
+# or later license. See the LICENSE file for a copy of the license and the
+# AUTHORS file for copyright and authorship information.
+
+from collections import OrderedDict
+from contextlib import contextmanager
+import threading
+import time
+
+from .instrumentation import (
+    GitOperation, active_operations, git_operation_done)
+
+
+DEFAULT_PROFILE_PATHS = 10
+
+# phases that git operations are reported in
+OPERATION_PHASES = {
+    "branch_create": "branch creation",
+    "branch_destroy": "branch destroy",
+    "index_add": "staging",
+    "index_remove": "staging",
+    "ls_remote": "remote check",
+    "tree": "changed paths",
+    "tree_changes": "changed paths"}
+
+
+class SyncProfile(object):
+    """Breakdown of the time spent in a fetch or push of a project.
+
+    While ``profiling`` the git operations of the project run in the same
+    thread are added to the phase they belong to, other phases are timed
+    with ``phase``. Operations run inside another operation or phase are
+    only timed in the outer one.
+    """
+
+    def __init__(self, project, name):
+        self.project = project
+        self.name = name
+        self.duration = None
+        self.phases = OrderedDict()
+        self.subprocesses = 0
+        self.actions = OrderedDict()
+        self.paths = {}
+        # time spent in the nested phases of each running phase
+        self._phases = []
+        self._thread = None
+
+    def __str__(self):
+        return "\n".join(self.lines())
+
+    @property
+    def dispatch_uid(self):
+        return "pootle_fs_git.profile.%s" % id(self)
+
+    @contextmanager
+    def profiling(self):
+        self._thread = threading.current_thread()
+        git_operation_done.connect(
+            self.receive,
+            sender=GitOperation,
+            weak=False,
+            dispatch_uid=self.dispatch_uid)
+        start = time.time()
+        try:
+            yield self
+        finally:
+            self.duration = time.time() - start
+            git_operation_done.disconnect(
+                sender=GitOperation,
+                dispatch_uid=self.dispatch_uid)
+
+    @contextmanager
+    def phase(self, name):
+        """Times ``name``, excluding any phases nested in it"""
+        self._phases.append(0)
+        start = time.time()
+        try:
+            yield
+        finally:
+            duration = time.time() - start
+            nested = self._phases.pop()
+            if self._phases:
+                self._phases[-1] += duration
+            self.add_phase(name, duration - nested)
+
+    def add_phase(self, name, duration):
+        self.phases[name] = self.phases.get(name, 0) + duration
+
+    def add_path(self, path, duration):
+        self.paths[path] = self.paths.get(path, 0) + duration
+
+    def add_actions(self, response, action_types):
+        for action_type in action_types:
+            count = len(list(response.completed(action_type)))
+            if count:
+                self.actions[action_type] = count
+
+    def receive(self, sender, operation, **kwargs):
+        ignored = (
+            operation.project != self.project
+            or threading.current_thread() is not self._thread
+            or active_operations())
+        if ignored:
+            return
+        self.subprocesses += operation.subprocesses
+        if not self._phases:
+            self.add_phase(
+                OPERATION_PHASES.get(operation.name, operation.name),
+                operation.duration)
+
+    def slowest_paths(self, limit=DEFAULT_PROFILE_PATHS):
+        return sorted(
+            self.paths.items(),
+            key=lambda item: (-item[1], item[0]))[:limit]
+
+    def lines(self, limit=DEFAULT_PROFILE_PATHS):
+        lines = [
+            "%s (%s): %.3fs, %s git subprocesses"
+            % (self.name, self.project, self.duration or 0,
+               self.subprocesses)]
+        if self.phases:
+            lines.append("  phases:")
+        for phase, duration in self.phases.items():
+            lines.append("    %-20s %.3fs" % (phase, duration))
+        if self.actions:
+            lines.append("  files:")
+        for action_type, count in self.actions.items():
+            lines.append("    %-20s %s" % (action_type, count))
+        slowest_paths = self.slowest_paths(limit)
+        if slowest_paths:
+            lines.append("  slowest paths:")
+        for path, duration in slowest_paths:
+            lines.append("    %.3fs %s" % (duration, path))
+        return lines
+
+
+@contextmanager
+def _no_phase():
+    yield
+
+
+def profile_phase(profile, name):
+    """Times ``name`` in ``profile``, if there is one"""
+    if profile is None:
+        return _no_phase()
+    return profile.phase(name)
+
+
+def profile_iter(profile, name, iterable):
+    """Yields the items of ``iterable``, timing each step in ``profile``"""
+    iterator = iter(iterable)
+    while True:
+        with profile_phase(profile, name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
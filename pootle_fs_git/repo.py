@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) Pootle contributors.
+#
+# This file is a part of the Pootle project. It is distributed under the GPL3
+# or later license. See the LICENSE file for a copy of the license and the
+# AUTHORS file for copyright and authorship information.
+
+import logging
+import threading
+
+from .instrumentation import InstrumentedRepo
+
+
+logger = logging.getLogger(__name__)
+
+
+class RepoHandles(object):
+    """Keeps a single ``git.Repo`` per working copy path in each thread.
+
+    Constructing a ``Repo`` rediscovers the git dir, rereads config and
+    starts new persistent ``git cat-file`` processes, so handles are shared
+    between all plugins, branches and files for a project until they are
+    invalidated. GitPython repos are not safe to use from several threads,
+    so each thread opens its own.
+
+    Invalidating a path, or closing the handles, closes those of the
+    calling thread, the handles of other threads are closed the next time
+    they ask for them.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # counts invalidations, handles opened before the last invalidation
+        # of their path, or the last close, are stale
+        self._generation = 0
+        self._invalidated = {}
+        self._closed = 0
+
+    @property
+    def _repos(self):
+        if not hasattr(self._local, "repos"):
+            self._local.repos = {}
+        return self._local.repos
+
+    def __contains__(self, path):
+        return self._get(path) is not None
+
+    def _get(self, path):
+        handle = self._repos.get(path)
+        if handle is None:
+            return None
+        generation, repo = handle
+        stale = (
+            generation < self._closed
+            or generation < self._invalidated.get(path, 0))
+        if stale:
+            del self._repos[path]
+            self._close(repo)
+            logger.debug("Closed git repository: %s", path)
+            return None
+        return repo
+
+    def get(self, path):
+        repo = self._get(path)
+        if repo is None:
+            generation = self._generation
+            repo = InstrumentedRepo(path)
+            self._repos[path] = (generation, repo)
+            logger.debug("Opened git repository: %s", path)
+        return repo
+
+    def invalidate(self, path):
+        with self._lock:
+            self._generation += 1
+            self._invalidated[path] = self._generation
+        handle = self._repos.pop(path, None)
+        if handle is not None:
+            self._close(handle[1])
+            logger.debug("Closed git repository: %s", path)
+
+    def close(self):
+        with self._lock:
+            self._generation += 1
+            self._closed = self._generation
+        repos = self._repos
+        self._local.repos = {}
+        for generation_, repo in repos.values():
+            self._close(repo)
+
+    def _close(self, repo):
+        # stops the persistent cat-file processes
+        repo.git.clear_cache()
+
+
+repos = RepoHandles()
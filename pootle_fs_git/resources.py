@@ -6,19 +6,32 @@
 # or later license. See the LICENSE file for a copy of the license and the
 # AUTHORS file for copyright and authorship information.
 
+from django.utils.functional import cached_property
+
 from pootle_fs.resources import FSProjectStateResources
 
 
 class GitProjectStateResources(FSProjectStateResources):
 
-    @property
+    @cached_property
     def file_hashes(self):
-        _hashes = {}
-        found = [x[1] for x in self.found_file_matches]
-        for item in self.context.repo.tree().traverse():
-            if "/%s" % item.path in found:
-                _hashes["/%s" % item.path] = item.hexsha
-        hashes = {}
-        for pootle_path, path in self.found_file_matches:
-            hashes[pootle_path] = _hashes[path]
-        return hashes
+        """Blob shas of the found files, cached for the state. The plugin
+        updates the pushed paths after pushing
+        """
+        with self.context.lock.read():
+            tree_index = self.context.tree_index
+            return {
+                pootle_path: tree_index.get(path)
+                for pootle_path, path
+                in self.found_file_matches}
+
+    @cached_property
+    def changed_file_paths(self):
+        """Paths changed in the repository since the tree hashes were last
+        indexed, or ``None`` if they are not known
+        """
+        with self.context.lock.read():
+            tree_index = self.context.tree_index
+            # changed paths are only known once the hashes have been loaded
+            tree_index.hashes
+            return tree_index.changed_paths
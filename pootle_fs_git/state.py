@@ -21,3 +21,8 @@ class GitProjectState(ProjectFSState):
             self.context,
             pootle_path=self.pootle_path,
             fs_path=self.fs_path)
+
+    def reload(self):
+        # the hashes of all of the files are read under one lock
+        with self.context.lock.read():
+            return super(GitProjectState, self).reload()
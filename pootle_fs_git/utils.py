@@ -8,6 +8,7 @@
 
 import os
 import shutil
+import tempfile
 from contextlib import contextmanager
 
 from git import Repo
@@ -15,12 +16,17 @@ from git import Repo
 
 @contextmanager
 def tmp_git(url):
+    """Clones ``url`` into a new temporary directory, which is removed
+    afterwards, so that concurrent callers do not share a checkout
+    """
     from django.conf import settings
     repo = Repo(url)
-    tmp_repo_path = os.path.join(
-        settings.POOTLE_FS_PATH, "__tmp_git_src__")
-    if os.path.exists(tmp_repo_path):
-        shutil.rmtree(tmp_repo_path)
-    tmp_repo = repo.clone(tmp_repo_path)
-    yield tmp_repo_path, tmp_repo
-    shutil.rmtree(tmp_repo_path)
+    if not os.path.exists(settings.POOTLE_FS_PATH):
+        os.makedirs(settings.POOTLE_FS_PATH)
+    tmp_repo_path = tempfile.mkdtemp(
+        prefix="__tmp_git_src_", dir=settings.POOTLE_FS_PATH)
+    try:
+        tmp_repo = repo.clone(tmp_repo_path)
+        yield tmp_repo_path, tmp_repo
+    finally:
+        shutil.rmtree(tmp_repo_path, ignore_errors=True)
@@ -10,11 +10,17 @@
 """
 
 import re
+import sys
 
 from distutils import log
 
 # Always prefer setuptools over distutils
 from setuptools import setup, find_packages
+from setuptools.command.build_py import build_py
+
+# modules that are only installed with a later Python
+PY3_MODULES = {
+    ('pootle_fs_git', 'aio'): (3, 5)}
 
 
 def parse_requirements(file_name, recurse=False):
@@ -55,7 +61,20 @@ def parse_requirements(file_name, recurse=False):
 
     return requirements
 
+
+class BuildPy(build_py):
+    """Leaves out the modules that cannot be compiled with this Python"""
+
+    def find_package_modules(self, package, package_dir):
+        return [
+            module for module
+            in build_py.find_package_modules(self, package, package_dir)
+            if sys.version_info >= PY3_MODULES.get(module[:2], (0, ))]
+
+
 install_requires = parse_requirements('requirements/base.txt')
+extras_require = {
+    'dulwich': parse_requirements('requirements/dulwich.txt')}
 
 setup(
     name='pootle_fs_git',
@@ -76,4 +95,6 @@ setup(
     keywords='pootle filesystem plugins',
     packages=find_packages(exclude=['contrib', 'docs', 'tests*']),
     install_requires=install_requires,
+    extras_require=extras_require,
+    cmdclass={'build_py': BuildPy},
 )
@@ -9,6 +9,7 @@
 
 import os
 import shutil
+import sys
 import tempfile
 from pkgutil import iter_modules
 
@@ -20,6 +21,12 @@ from django.conf import settings
 from . import fixtures
 
 
+collect_ignore = []
+if sys.version_info < (3, 5):
+    # the asyncio API is not available
+    collect_ignore.append("pootle_fs_git/aio.py")
+
+
 @pytest.fixture(autouse=True, scope='session')
 def setup_db_if_needed(request, tests_use_db):
     """Sets up the site DB only if tests requested to use the DB (autouse)."""
@@ -0,0 +1,361 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) Pootle contributors.
+#
+# This file is a part of the Pootle project. It is distributed under the GPL3
+# or later license. See the LICENSE file for a copy of the license and the
+# AUTHORS file for copyright and authorship information.
+
+"""Benchmarks for the git FS plugin on synthetic repositories.
+
+The benchmarks are skipped unless ``--benchmark`` is given, eg::
+
+    py.test --benchmark --benchmark-languages=20 --benchmark-files=500 \\
+        tests/pootle_fs_git/benchmarks.py
+
+Results are compared with the baseline stored for the same repository
+size, use ``--benchmark-save`` to store them as the new baseline.
+"""
+
+from collections import OrderedDict
+from contextlib import contextmanager
+import json
+import os
+import resource
+import time
+
+import pytest
+
+import git.cmd
+from git import Actor, Repo
+
+from .plugin import DEFAULT_TRANSLATION_PATHS
+
+
+BENCHMARK_BASELINE = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), "data", "benchmarks.json")
+
+BENCHMARK_AUTHORS = 5
+
+BENCHMARK_NOISE_SIZE = 64 * 1024
+
+# metrics that must not grow, the others may vary within the tolerance
+BENCHMARK_COUNTS = ("subprocesses", "queries")
+
+PO_TEMPLATE = """msgid ""
+msgstr ""
+"Content-Type: text/plain; charset=UTF-8\\n"
+"Language: %(lang)s\\n"
+
+msgid "%(path)s"
+msgstr "%(path)s %(revision)s"
+"""
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("benchmark")
+    group.addoption(
+        "--benchmark", action="store_true", default=False,
+        help="Run the git FS benchmarks")
+    group.addoption(
+        "--benchmark-languages", type=int, default=5,
+        help="Number of languages in the benchmark repository")
+    group.addoption(
+        "--benchmark-files", type=int, default=50,
+        help="Number of translation files for each language")
+    group.addoption(
+        "--benchmark-history", type=int, default=20,
+        help="Number of commits after the initial commit")
+    group.addoption(
+        "--benchmark-noise", type=int, default=10,
+        help="Number of binary files outside the translation paths")
+    group.addoption(
+        "--benchmark-layout", default="subdir3",
+        choices=list(DEFAULT_TRANSLATION_PATHS),
+        help="Translation path layout of the benchmark repository")
+    group.addoption(
+        "--benchmark-baseline", default=BENCHMARK_BASELINE,
+        help="JSON file with the baseline results")
+    group.addoption(
+        "--benchmark-tolerance", type=float, default=0.25,
+        help="Allowed increase in wall time and peak RSS over the baseline")
+    group.addoption(
+        "--benchmark-save", action="store_true", default=False,
+        help="Save the results as the new baseline")
+
+
+def pytest_configure(config):
+    config.benchmarks = Benchmarks(config)
+
+
+def pytest_terminal_summary(terminalreporter):
+    benchmarks = terminalreporter.config.benchmarks
+    if not benchmarks.results:
+        return
+    terminalreporter.section("git FS benchmarks (%s)" % benchmarks.signature)
+    terminalreporter.write_line(
+        "%-30s %10s %12s %8s %12s %12s"
+        % ("operation", "time (s)", "subprocesses", "queries",
+           "rss (KB)", "git rss (KB)"))
+    for name, result in benchmarks.results.items():
+        terminalreporter.write_line(
+            "%-30s %10.3f %12d %8d %12d %12d"
+            % (name, result["wall_time"], result["subprocesses"],
+               result["queries"], result["peak_rss"],
+               result["peak_child_rss"]))
+    for regression in benchmarks.regressions:
+        terminalreporter.write_line("REGRESSION %s" % regression, red=True)
+    if benchmarks.saved:
+        terminalreporter.write_line(
+            "Saved baseline: %s" % benchmarks.baseline_path)
+
+
+class Benchmarks(object):
+    """Measures operations and compares them with a stored baseline"""
+
+    def __init__(self, config):
+        self.config = config
+        self.results = OrderedDict()
+        self.regressions = []
+        self.saved = False
+
+    def option(self, name):
+        return self.config.getoption("benchmark_%s" % name)
+
+    @property
+    def enabled(self):
+        return self.config.getoption("benchmark")
+
+    @property
+    def signature(self):
+        return (
+            "%s-l%s-f%s-h%s-n%s"
+            % tuple(self.option(name)
+                    for name
+                    in ["layout", "languages", "files", "history", "noise"]))
+
+    @property
+    def baseline_path(self):
+        return self.option("baseline")
+
+    def read_baselines(self):
+        if not os.path.exists(self.baseline_path):
+            return {}
+        with open(self.baseline_path) as f:
+            return json.load(f)
+
+    @property
+    def baseline(self):
+        return self.read_baselines().get(self.signature, {})
+
+    def compare(self, name, result):
+        baseline = self.baseline.get(name)
+        if not baseline:
+            return []
+        regressions = []
+        tolerance = 1 + self.option("tolerance")
+        for metric, value in result.items():
+            if metric not in baseline:
+                continue
+            limit = baseline[metric]
+            if metric not in BENCHMARK_COUNTS:
+                limit = limit * tolerance
+            if value > limit:
+                regressions.append(
+                    "%s %s: %s (baseline %s)"
+                    % (name, metric, value, baseline[metric]))
+        return regressions
+
+    @contextmanager
+    def measure(self, name):
+        """Records wall time, git subprocesses, SQL queries and peak RSS of
+        the operation run in the context.
+
+        Peak RSS is the high-water mark of the test process and of its
+        finished child processes, so it only grows during a run.
+        """
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        popen = git.cmd.Popen
+        subprocesses = []
+
+        def counting_popen(*args, **kwargs):
+            subprocesses.append(args)
+            return popen(*args, **kwargs)
+
+        git.cmd.Popen = counting_popen
+        start = time.time()
+        try:
+            with CaptureQueriesContext(connection) as queries:
+                yield
+            wall_time = time.time() - start
+        finally:
+            git.cmd.Popen = popen
+        result = OrderedDict(
+            [("wall_time", wall_time),
+             ("subprocesses", len(subprocesses)),
+             ("queries", len(queries)),
+             ("peak_rss",
+              resource.getrusage(resource.RUSAGE_SELF).ru_maxrss),
+             ("peak_child_rss",
+              resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)])
+        self.results[name] = result
+        regressions = self.compare(name, result)
+        self.regressions += regressions
+        assert not regressions, "\n".join(regressions)
+
+    def save(self):
+        baselines = self.read_baselines()
+        baselines[self.signature] = self.results
+        dir_name = os.path.dirname(self.baseline_path)
+        if not os.path.exists(dir_name):
+            os.makedirs(dir_name)
+        with open(self.baseline_path, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        self.saved = True
+
+
+def _layout_path(layout, lang, index):
+    return (
+        DEFAULT_TRANSLATION_PATHS[layout]
+        .replace("<lang>", lang)
+        .replace("<filename>", "file%s" % index)
+        .replace("<directory_path>", "dir%s" % (index % 10)))
+
+
+def layout_mapping(layout):
+    """The ``pootle_fs.translation_mappings`` for a layout of
+    ``DEFAULT_TRANSLATION_PATHS``
+    """
+    path = (
+        DEFAULT_TRANSLATION_PATHS[layout]
+        .replace("<lang>", "<language_code>")
+        .replace("<directory_path>", "<dir_path>"))
+    return "/%s.<ext>" % os.path.splitext(path)[0]
+
+
+def _write(repo, path, content):
+    file_path = os.path.join(repo.working_dir, path)
+    if not os.path.exists(os.path.dirname(file_path)):
+        os.makedirs(os.path.dirname(file_path))
+    with open(file_path, "wb") as f:
+        f.write(content)
+
+
+def _write_po(repo, path, lang, revision):
+    _write(
+        repo, path,
+        (PO_TEMPLATE
+         % dict(lang=lang, path=path, revision=revision)).encode("utf-8"))
+
+
+def create_benchmark_repo(path, languages, files, history, noise,
+                          layout="subdir3"):
+    """Creates a bare repository at ``path`` with ``files`` translation files
+    for each of ``languages``, followed by ``history`` commits that each
+    change a tenth of the files and one of the ``noise`` binary files.
+
+    Layouts without a ``<filename>`` have one file for each language.
+
+    :returns: a dictionary of translation file path -> language code
+    """
+    Repo.init(path, bare=True)
+    repo = Repo.clone_from(path, "%s.src" % path)
+    path_languages = dict(
+        (_layout_path(layout, lang, index), lang)
+        for lang in languages
+        for index in range(files))
+    paths = sorted(path_languages)
+    for path_ in paths:
+        _write_po(repo, path_, path_languages[path_], 0)
+    noise_paths = ["assets/noise%s.bin" % i for i in range(noise)]
+    for noise_path in noise_paths:
+        _write(repo, noise_path, os.urandom(BENCHMARK_NOISE_SIZE))
+    repo.index.add(paths + noise_paths)
+    repo.index.commit(
+        "Initial commit", author=Actor("Author 0", "author0@example.com"))
+    changes = max(1, len(paths) // 10)
+    for revision in range(1, history + 1):
+        start = (revision * changes) % len(paths)
+        changed = (paths + paths)[start:start + changes]
+        for path_ in changed:
+            _write_po(repo, path_, path_languages[path_], revision)
+        if noise_paths:
+            noise_path = noise_paths[revision % len(noise_paths)]
+            _write(repo, noise_path, os.urandom(BENCHMARK_NOISE_SIZE))
+            changed = changed + [noise_path]
+        repo.index.add(changed)
+        author = revision % BENCHMARK_AUTHORS
+        repo.index.commit(
+            "Revision %s" % revision,
+            author=Actor(
+                "Author %s" % author, "author%s@example.com" % author))
+    repo.remotes.origin.push("master:master")
+    return path_languages
+
+
+@pytest.fixture(scope="session")
+def benchmarks(request):
+    benchmarks = request.config.benchmarks
+    if not benchmarks.enabled:
+        pytest.skip("Benchmarks are run with --benchmark")
+
+    def save_baseline():
+        if benchmarks.option("save") and benchmarks.results:
+            benchmarks.save()
+
+    request.addfinalizer(save_baseline)
+    return benchmarks
+
+
+@pytest.fixture(scope="session")
+def benchmark_repo(benchmarks, tmpdir_factory):
+    languages = [
+        "bench%s" % i for i in range(benchmarks.option("languages"))]
+    path = str(tmpdir_factory.mktemp("benchmark").join("remote.git"))
+    paths = create_benchmark_repo(
+        path,
+        languages,
+        benchmarks.option("files"),
+        benchmarks.option("history"),
+        benchmarks.option("noise"),
+        layout=benchmarks.option("layout"))
+    return dict(path=path, languages=languages, paths=paths)
+
+
+@pytest.fixture
+def benchmark_project(benchmarks, benchmark_repo, tmpdir, settings):
+    from pytest_pootle.factories import LanguageDBFactory, ProjectDBFactory
+
+    from pootle_language.models import Language
+
+    settings.POOTLE_FS_WORKING_PATH = str(tmpdir)
+    for code in benchmark_repo["languages"]:
+        LanguageDBFactory(code=code)
+    project = ProjectDBFactory(
+        source_language=Language.objects.get(code="en"),
+        code="benchmark_project")
+    project.config["pootle_fs.fs_type"] = "git"
+    project.config["pootle_fs.fs_url"] = benchmark_repo["path"]
+    project.config["pootle_fs.translation_mappings"] = {
+        "default": layout_mapping(benchmarks.option("layout"))}
+    return project
+
+
+@pytest.fixture
+def benchmark_upstream(benchmark_repo):
+    """Returns a function that commits new revisions of translation files
+    upstream
+    """
+    repo = Repo("%s.src" % benchmark_repo["path"])
+
+    def _push_upstream(paths, revision):
+        for path in paths:
+            _write_po(repo, path, benchmark_repo["paths"][path], revision)
+        repo.index.add(paths)
+        repo.index.commit(
+            "Upstream revision %s" % revision,
+            author=Actor("Upstream", "upstream@example.com"))
+        repo.remotes.origin.push("master:master")
+    return _push_upstream
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) Pootle contributors.
+#
+# This file is a part of the Pootle project. It is distributed under the GPL3
+# or later license. See the LICENSE file for a copy of the license and the
+# AUTHORS file for copyright and authorship information.
+
+import os
+
+import pytest
+
+from django.utils.functional import cached_property
+
+from git import Actor, Repo
+
+from pootle_fs_git.hashes import TreeHashIndex
+from pootle_fs_git.repo import RepoHandles
+
+
+def _write_files(repo, files, content="content"):
+    """Writes ``files`` to the working tree of ``repo``, either a dictionary
+    of path -> content or a list of paths which are written with ``content``
+    """
+    for path in files:
+        file_path = os.path.join(repo.working_dir, path)
+        if not os.path.exists(os.path.dirname(file_path)):
+            os.makedirs(os.path.dirname(file_path))
+        with open(file_path, "w") as f:
+            if isinstance(files, dict):
+                f.write(files[path])
+            else:
+                f.write("%s: %s" % (path, content))
+
+
+def _commit_files(repo, files, message="Adding files", author=None):
+    """Writes and commits ``files``, ``author`` is a name, email tuple"""
+    _write_files(repo, files, message)
+    repo.index.add(list(files))
+    return repo.index.commit(message, author=author and Actor(*author))
+
+
+def _push_upstream(tmpdir, changes):
+    """Pushes ``changes`` to the remote of ``dummy_git_plugin`` from another
+    clone
+    """
+    upstream = Repo.clone_from(
+        str(tmpdir.join("remote.git")), str(tmpdir.join("upstream")))
+    _commit_files(upstream, changes, "Upstream changes")
+    upstream.remotes.origin.push("master:master")
+    return upstream
+
+
+class DummyProject(object):
+
+    def __init__(self, local_fs_path):
+        self.code = "dummy_project"
+        self.local_fs_path = local_fs_path
+
+
+class DummyPlugin(object):
+
+    def __init__(self, local_fs_path):
+        self.project = DummyProject(local_fs_path)
+        self.repos = RepoHandles()
+
+    @property
+    def repo(self):
+        return self.repos.get(self.project.local_fs_path)
+
+    @cached_property
+    def tree_index(self):
+        return TreeHashIndex(self.repo, self.repo.head.commit.hexsha)
+
+    def invalidate_repo(self):
+        self.repos.invalidate(self.project.local_fs_path)
+
+
+@pytest.fixture
+def dummy_git_plugin(tmpdir):
+    """A plugin without a project in the db, with a clone of a local
+    remote
+    """
+    remote_path = str(tmpdir.join("remote.git"))
+    Repo.init(remote_path, bare=True)
+    src = Repo.clone_from(remote_path, str(tmpdir.join("src")))
+    _commit_files(
+        src, {"po/de.po": "de", "po/fr.po": "fr"}, "Initial commit")
+    src.remotes.origin.push("master:master")
+    local_path = str(tmpdir.join("local"))
+    Repo.clone_from(remote_path, local_path)
+    return DummyPlugin(local_path)
@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) Pootle contributors.
+#
+# This file is a part of the Pootle project. It is distributed under the GPL3
+# or later license. See the LICENSE file for a copy of the license and the
+# AUTHORS file for copyright and authorship information.
+
+import asyncio
+import os
+import threading
+
+import pytest
+
+from git import Repo
+from git.exc import GitCommandError
+
+from pootle_fs.utils import FSPlugin
+
+from pootle_fs_git.aio import (
+    AsyncProjectsFetcher, AsyncRepoLock, execute, fetch, push,
+    read_progress, run_steps)
+from pootle_fs_git.branch import PushRejected, tmp_object_branch
+from pootle_fs_git.commands import GitCommand
+from pootle_fs_git.instrumentation import GitOperation, git_operation_done
+from pootle_fs_git.locks import LockTimeout, RepoLock
+from pootle_fs_git.utils import tmp_git
+
+from ..fixtures.repo import _push_upstream
+
+
+def _run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def test_aio_read_progress():
+    lines = []
+
+    async def read():
+        stream = asyncio.StreamReader()
+        stream.feed_data(b"Receiving objects:  50%\rReceiving ")
+        stream.feed_data(b"objects: 100%\r\nDone\n\nremote: ok")
+        stream.feed_eof()
+        return await read_progress(stream, lines.append)
+
+    output = _run(read())
+    assert output.startswith(b"Receiving objects:  50%\r")
+    assert lines == [
+        "Receiving objects:  50%",
+        "Receiving objects: 100%",
+        "Done",
+        "remote: ok"]
+
+
+def test_aio_execute(tmpdir):
+    Repo.init(str(tmpdir)).index.commit("Initial commit")
+    operations = []
+
+    def receive(sender, operation, **kwargs):
+        operations.append(operation)
+
+    git_operation_done.connect(receive, sender=GitOperation)
+    try:
+        sha = _run(
+            execute(
+                GitCommand("log", ["rev-parse", "HEAD"],
+                           project="project0", cwd=str(tmpdir)))).check()
+        failed = _run(
+            execute(
+                GitCommand("log", ["rev-parse", "missing"],
+                           cwd=str(tmpdir))))
+    finally:
+        git_operation_done.disconnect(receive, sender=GitOperation)
+    with pytest.raises(GitCommandError):
+        failed.check()
+    assert sha == Repo(str(tmpdir)).head.commit.hexsha
+    assert [(op.project, op.subprocesses, op.failed)
+            for op in operations] == [
+        ("project0", 1, False), (None, 1, True)]
+    assert operations[0].bytes == len(sha)
+
+
+def test_aio_lock(tmpdir):
+    lock = RepoLock(str(tmpdir.join("project0.lock")), timeout=0)
+    events = []
+    timed_out = []
+
+    def write_in_thread():
+        try:
+            with lock.write():
+                pass
+        except LockTimeout:
+            timed_out.append(True)
+
+    async def locked(name):
+        async with AsyncRepoLock(lock):
+            events.append("%s start" % name)
+            # sync code in the loop's thread sees the lock as held
+            with lock.write():
+                await asyncio.sleep(0.01)
+            thread = threading.Thread(target=write_in_thread)
+            thread.start()
+            thread.join()
+            events.append("%s end" % name)
+
+    async def both():
+        await asyncio.gather(locked("first"), locked("second"))
+
+    _run(both())
+    assert events == [
+        "first start", "first end", "second start", "second end"]
+    assert timed_out == [True, True]
+    assert lock.held == {}
+    # the lock is released
+    write_in_thread()
+    assert len(timed_out) == 2
+
+
+def test_aio_push_rejected(dummy_git_plugin, tmpdir):
+    plugin = dummy_git_plugin
+    local_path = plugin.project.local_fs_path
+    lines = []
+    with open(os.path.join(local_path, "po", "fr.po"), "w") as f:
+        f.write("fr from pootle")
+    with tmp_object_branch(plugin, backoff=0) as branch:
+        branch.add([os.path.join(local_path, "po", "fr.po")])
+        branch.commit("Updating")
+        _push_upstream(tmpdir, {"po/it.po": "it from upstream"})
+        _run(run_steps(branch.push_steps(), lines.append))
+        assert branch.pushed == branch.head_sha
+    remote = Repo(str(tmpdir.join("remote.git")))
+    tree = remote.commit("master").tree
+    assert tree["po/fr.po"].data_stream.read() == b"fr from pootle"
+    assert tree["po/it.po"].data_stream.read() == b"it from upstream"
+    assert plugin.repo.head.commit.hexsha == remote.commit("master").hexsha
+    assert lines
+
+
+def test_aio_push_retries(dummy_git_plugin, tmpdir):
+    plugin = dummy_git_plugin
+    local_path = plugin.project.local_fs_path
+    with open(os.path.join(local_path, "po", "de.po"), "w") as f:
+        f.write("de from pootle")
+    with pytest.raises(PushRejected):
+        with tmp_object_branch(plugin, retries=0) as branch:
+            branch.add([os.path.join(local_path, "po", "de.po")])
+            branch.commit("Updating")
+            _push_upstream(tmpdir, {"po/it.po": "it from upstream"})
+            _run(run_steps(branch.push_steps()))
+
+
+@pytest.mark.django_db
+def test_aio_fetch(git_project_1):
+    plugin = FSPlugin(git_project_1).plugin
+    assert plugin.is_cloned is False
+    lines = []
+    result = _run(fetch(plugin, lines.append))
+    assert plugin.is_cloned is True
+    assert result.new_sha == plugin.latest_hash
+    assert lines
+    result = _run(fetch(plugin))
+    assert result.old_sha == result.new_sha == plugin.latest_hash
+    assert result.changed_paths == set()
+
+
+def _read_in_thread(lock_path, results):
+    def read():
+        try:
+            with RepoLock(lock_path, timeout=0.1).read():
+                results.append("read")
+        except LockTimeout:
+            results.append("timed out")
+
+    thread = threading.Thread(target=read)
+    thread.start()
+    thread.join()
+
+
+def _sync_push(plugin):
+    """Writes a changed unit of a store to the working tree, as ``sync``
+    does before pushing, returning the store and the response
+    """
+    store_fs = plugin.resources.tracked.select_related("store").first()
+    unit = store_fs.store.units[0]
+    unit.target = "Changed in Pootle"
+    unit.save()
+    state = plugin.state()
+    # the hashes are cached before pushing, as ``sync`` reads them
+    assert store_fs.pootle_path in state.resources.file_hashes
+    return store_fs, plugin.sync_push(state, plugin.response(state))
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("push_mode", ["checkout", "worktree", "objects"])
+def test_aio_push(git_project, push_mode):
+    git_project.config["pootle.fs.push_mode"] = push_mode
+    plugin = FSPlugin(git_project).plugin
+    store_fs, response = _sync_push(plugin)
+    push_steps = plugin.push_steps
+    results = []
+
+    def locked_push_steps(response):
+        # readers in other threads are locked out while pushing
+        _read_in_thread(plugin.lock.path, results)
+        return push_steps(response)
+
+    plugin.push_steps = locked_push_steps
+    lines = []
+    assert _run(push(plugin, response, lines.append)) is response
+    assert results == ["timed out"]
+    assert lines
+    pushed = list(response.completed("pushed_to_fs"))
+    assert [item.pootle_path for item in pushed] == [store_fs.pootle_path]
+    remote = Repo(plugin.fs_url).commit("master")
+    # the checkout is moved to the pushed commit
+    assert plugin.repo.head.commit.hexsha == remote.hexsha
+    blob_sha = remote.tree[store_fs.path[1:]].hexsha
+    assert plugin.tree_index.get(store_fs.path) == blob_sha
+    file_hashes = response.context.resources.file_hashes
+    assert file_hashes[store_fs.pootle_path] == blob_sha
+
+
+@pytest.mark.django_db
+def test_aio_push_conflict(git_project):
+    git_project.config["pootle.fs.push_mode"] = "objects"
+    git_project.config["pootle.fs.push_backoff"] = 0
+    plugin = FSPlugin(git_project).plugin
+    store_fs, response = _sync_push(plugin)
+    file_hashes = response.context.resources.file_hashes
+    file_hash = file_hashes[store_fs.pootle_path]
+    with tmp_git(plugin.fs_url) as (tmp_repo_path, tmp_repo):
+        with open(os.path.join(tmp_repo_path, store_fs.path[1:]), "a") as f:
+            f.write("\n# Changed upstream\n")
+        tmp_repo.index.add([store_fs.path[1:]])
+        tmp_repo.index.commit("Changing upstream")
+        tmp_repo.remotes.origin.push("master:master")
+    _run(push(plugin, response))
+    # the upstream change is kept and the pushed store conflicted
+    assert not list(response.completed("pushed_to_fs"))
+    assert [item.pootle_path for item in response.failed("pushed_to_fs")] == [
+        store_fs.pootle_path]
+    tree = Repo(plugin.fs_url).commit("master").tree
+    assert tree[store_fs.path[1:]].data_stream.read().endswith(
+        b"# Changed upstream\n")
+    assert file_hashes[store_fs.pootle_path] == file_hash
+
+
+@pytest.mark.django_db
+def test_aio_fetch_projects(git_project, git_project_1, tmpdir):
+    git_project_1.config["pootle_fs.fs_url"] = str(tmpdir.join("missing"))
+    fetcher = AsyncProjectsFetcher(
+        [git_project, git_project_1], workers=2, host_workers=1)
+    fetched = _run(fetcher.fetch())
+    assert [f.project for f in fetched] == [git_project, git_project_1]
+    assert not fetched[0].failed
+    assert fetched[0].result.changed_paths == set()
+    assert fetched[1].failed
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) Pootle contributors.
+#
+# This file is a part of the Pootle project. It is distributed under the GPL3
+# or later license. See the LICENSE file for a copy of the license and the
+# AUTHORS file for copyright and authorship information.
+
+import pytest
+
+from git import Repo
+
+from pootle_fs_git.backends import Backends, get_backend_class
+from pootle_fs_git.hashes import TreeHashIndex
+from pootle_fs_git.history import LastCommits
+
+from ..fixtures.repo import _commit_files
+
+
+BACKENDS = ["gitpython", "dulwich"]
+
+
+@pytest.fixture(params=BACKENDS)
+def backend_class(request):
+    if request.param == "dulwich":
+        pytest.importorskip("dulwich")
+    return get_backend_class(request.param)
+
+
+@pytest.fixture
+def upstream(tmpdir):
+    remote_path = str(tmpdir.join("remote.git"))
+    Repo.init(remote_path, bare=True)
+    upstream = Repo.clone_from(remote_path, str(tmpdir.join("upstream")))
+    _commit_files(
+        upstream,
+        {"po/de.po": "de", "po/fr.po": "fr", "po/sub/it.po": "it",
+         "src/main.c": "main"})
+    upstream.remotes.origin.push("master:master")
+    return upstream
+
+
+@pytest.fixture
+def backend(backend_class, upstream, tmpdir):
+    local_path = str(tmpdir.join("local"))
+    Repo.clone_from(upstream.remotes.origin.url, local_path)
+    return backend_class(local_path)
+
+
+def _fetch(backend):
+    # the plugin fetches with the git command, the backend reads the result
+    repo = Repo(backend.path)
+    repo.remotes.origin.pull()
+    return repo.head.commit.hexsha
+
+
+def test_backend_unknown():
+    with pytest.raises(ValueError):
+        get_backend_class("svn")
+
+
+def test_backend_handles(backend_class, upstream):
+    handles = Backends()
+    backend = handles.get(backend_class.name, upstream.working_dir)
+    assert isinstance(backend, backend_class)
+    assert handles.get(backend_class.name, upstream.working_dir) is backend
+    handles.invalidate(upstream.working_dir)
+    assert handles.get(backend_class.name, upstream.working_dir) is not backend
+
+
+def test_backend_read_tree(backend, upstream):
+    head = upstream.head.commit
+    assert backend.head == head.hexsha
+    tree = backend.read_tree(head.hexsha)
+    assert sorted(tree) == [
+        "/po/de.po", "/po/fr.po", "/po/sub/it.po", "/src/main.c"]
+    assert tree["/po/de.po"] == head.tree["po/de.po"].hexsha
+    assert sorted(backend.read_tree(head.hexsha, ["po/sub", "missing"])) == [
+        "/po/sub/it.po"]
+
+
+def test_backend_read_changes(backend, upstream):
+    base = upstream.head.commit
+    _commit_files(upstream, {"po/de.po": "de updated", "po/es.po": "es"})
+    upstream.index.remove(["po/fr.po", "src/main.c"], working_tree=True)
+    commit = upstream.index.commit("Changes")
+    upstream.remotes.origin.push("master:master")
+    assert _fetch(backend) == commit.hexsha
+    assert backend.read_changes(base.hexsha, commit.hexsha, ["po"]) == {
+        "/po/de.po": commit.tree["po/de.po"].hexsha,
+        "/po/es.po": commit.tree["po/es.po"].hexsha,
+        "/po/fr.po": None}
+    assert "/src/main.c" in backend.read_changes(base.hexsha, commit.hexsha)
+    assert backend.read_changes("f" * 40, commit.hexsha) is None
+
+
+def test_backend_iter_log(backend, upstream):
+    first = upstream.head.commit
+    second = _commit_files(
+        upstream, {"po/de.po": "de updated"}, "Updating",
+        author=("Author", "author@example.com"))
+    upstream.remotes.origin.push("master:master")
+    _fetch(backend)
+    log = [
+        (commit.hexsha, commit.author_name, path)
+        for commit, path
+        in backend.iter_log(second.hexsha, ["po"])]
+    assert log[0] == (second.hexsha, "Author", "/po/de.po")
+    assert sorted(path for sha, name_, path in log[1:]) == [
+        "/po/de.po", "/po/fr.po", "/po/sub/it.po"]
+    assert set(sha for sha, name_, path in log[1:]) == set([first.hexsha])
+
+
+def test_backend_indexes(backend, upstream):
+    repo = Repo(backend.path)
+    sha = _commit_files(repo, {"po/de.po": "de updated"}, "Updating").hexsha
+    index = TreeHashIndex(repo, sha, ["po"], backend=backend)
+    assert index.hashes == TreeHashIndex(repo, sha, ["po"]).hashes
+    paths = ["/po/de.po", "/po/fr.po", "/po/missing.po"]
+    last_commits = LastCommits(repo, sha, ["po"], backend=backend)
+    last_commits.resolve(paths)
+    git_last_commits = LastCommits(repo, sha, ["po"])
+    git_last_commits.resolve(paths)
+    for path in paths:
+        assert last_commits.get(path) == git_last_commits.get(path)
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) Pootle contributors.
+#
+# This file is a part of the Pootle project. It is distributed under the GPL3
+# or later license. See the LICENSE file for a copy of the license and the
+# AUTHORS file for copyright and authorship information.
+
+import os
+
+import pytest
+
+from pootle_fs.models import StoreFS
+from pootle_fs.utils import FSPlugin
+
+from pootle_fs_git.plugin import Changelog
+
+
+class BenchmarkResponseItem(object):
+
+    def __init__(self, store_fs, action_type="pushed_to_fs"):
+        self.action_type = action_type
+        self.store_fs = store_fs
+        self.pootle_path = store_fs.pootle_path
+        self.fs_path = store_fs.path
+        self.complete = True
+
+    @property
+    def failed(self):
+        return not self.complete
+
+
+class BenchmarkResponse(object):
+
+    def __init__(self, items):
+        self.items = items
+
+    @property
+    def made_changes(self):
+        return bool(self.items)
+
+    def __contains__(self, action_type):
+        return any(item.action_type == action_type for item in self.items)
+
+    def __getitem__(self, action_type):
+        return [
+            item for item in self.items
+            if item.action_type == action_type]
+
+    def completed(self, *action_types):
+        for item in self.items:
+            if item.action_type in action_types and not item.failed:
+                yield item
+
+
+def _synced(project):
+    plugin = FSPlugin(project)
+    plugin.fetch()
+    plugin.add()
+    plugin.sync()
+    return plugin
+
+
+def _store_fs(project):
+    return list(
+        StoreFS.objects.filter(project=project)
+                       .select_related("store")
+                       .order_by("pk"))
+
+
+@pytest.mark.django_db
+def test_benchmark_fetch(benchmarks, benchmark_project, benchmark_repo,
+                         benchmark_upstream):
+    plugin = FSPlugin(benchmark_project)
+    with benchmarks.measure("fetch (clone)"):
+        plugin.fetch()
+    with benchmarks.measure("fetch (up to date)"):
+        plugin.fetch()
+    paths = sorted(benchmark_repo["paths"])
+    benchmark_upstream(paths[::10], "upstream")
+    with benchmarks.measure("fetch (pull)"):
+        result = plugin.fetch()
+    assert result.changed_paths == set(
+        "/%s" % path for path in paths[::10])
+
+
+@pytest.mark.django_db
+def test_benchmark_file_hashes(benchmarks, benchmark_project):
+    plugin = FSPlugin(benchmark_project)
+    plugin.fetch()
+    state = plugin.state()
+    with benchmarks.measure("file_hashes"):
+        file_hashes = state.resources.file_hashes
+    assert file_hashes
+
+
+@pytest.mark.django_db
+def test_benchmark_by_author(benchmarks, benchmark_project):
+    plugin = _synced(benchmark_project)
+    response = BenchmarkResponse(
+        [BenchmarkResponseItem(store_fs)
+         for store_fs in _store_fs(benchmark_project)])
+    with benchmarks.measure("Changelog.by_author"):
+        commits = Changelog(plugin, response, grouping="author").commits
+    assert (
+        sum(len(commit.to_add) for commit in commits)
+        == len(response.items))
+
+
+@pytest.mark.django_db
+def test_benchmark_changelog_removals(benchmarks, benchmark_project):
+    plugin = _synced(benchmark_project)
+    store_fs = _store_fs(benchmark_project)
+    for count in [1000, 10000]:
+        # each path is removed once, however many responses there are for it
+        response = BenchmarkResponse(
+            [BenchmarkResponseItem(store_fs[i % len(store_fs)], "removed")
+             for i in range(count)])
+        with benchmarks.measure("Changelog (%s removals)" % count):
+            commits = Changelog(plugin, response).commits
+        assert (
+            sum(len(commit.to_remove) for commit in commits)
+            == min(count, len(store_fs)))
+
+
+@pytest.mark.django_db
+def test_benchmark_push(benchmarks, benchmark_project):
+    plugin = _synced(benchmark_project)
+    items = []
+    for store_fs in _store_fs(benchmark_project)[::10]:
+        file_path = os.path.join(
+            benchmark_project.local_fs_path, store_fs.path.strip("/"))
+        with open(file_path, "a") as f:
+            f.write("\n# pushed from pootle\n")
+        items.append(BenchmarkResponseItem(store_fs))
+    response = BenchmarkResponse(items)
+    with benchmarks.measure("push"):
+        plugin.push(response)
+    assert not [item for item in response.items if item.failed]
+
+
+@pytest.mark.django_db
+def test_benchmark_latest_author(benchmarks, benchmark_project):
+    _synced(benchmark_project)
+    store_fss = _store_fs(benchmark_project)
+    with benchmarks.measure("latest_author"):
+        authors = set(store_fs.file.latest_author for store_fs in store_fss)
+    assert (None, None) not in authors
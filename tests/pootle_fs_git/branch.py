@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) Pootle contributors.
+#
+# This file is a part of the Pootle project. It is distributed under the GPL3
+# or later license. See the LICENSE file for a copy of the license and the
+# AUTHORS file for copyright and authorship information.
+
+import os
+
+import pytest
+
+from git import Actor, Repo
+
+from pootle_fs_git.branch import (
+    PushRejected, tmp_branch, tmp_object_branch, tmp_worktree)
+from pootle_fs_git.commands import run_steps
+from pootle_fs_git.instrumentation import clone_repo
+
+from ..fixtures.repo import DummyPlugin, _push_upstream
+
+
+def test_branch_worktree_push(dummy_git_plugin):
+    plugin = dummy_git_plugin
+    repo = plugin.repo
+    local_path = plugin.project.local_fs_path
+    with open(os.path.join(local_path, "po", "de.po"), "w") as f:
+        f.write("de updated")
+    os.unlink(os.path.join(local_path, "po", "fr.po"))
+    with tmp_worktree(plugin) as branch:
+        assert branch.exists
+        # the main checkout is not switched
+        assert repo.active_branch.name == "master"
+        branch.rm(["/po/fr.po"])
+        branch.add([os.path.join(local_path, "po", "de.po")])
+        assert branch.is_dirty
+        commit = branch.commit(
+            "Updating", author=Actor("Author", "author@example.com"))
+        assert commit.author.name == "Author"
+        branch.push()
+    assert not os.path.exists(branch.path)
+    assert [head.name for head in repo.heads] == ["master"]
+    assert repo.head.commit.hexsha == commit.hexsha
+    assert repo.remotes.origin.refs.master.commit.hexsha == commit.hexsha
+    assert sorted(
+        blob.path for blob in commit.tree.traverse()
+        if blob.type == "blob") == ["po/de.po"]
+    assert not repo.is_dirty()
+
+
+def test_branch_worktree_no_push(dummy_git_plugin):
+    plugin = dummy_git_plugin
+    repo = plugin.repo
+    head = repo.head.commit.hexsha
+    with tmp_worktree(plugin) as branch:
+        assert not branch.is_dirty
+    assert not os.path.exists(branch.path)
+    assert repo.head.commit.hexsha == head
+    assert [head.name for head in repo.heads] == ["master"]
+
+
+def test_branch_objects_push(dummy_git_plugin):
+    plugin = dummy_git_plugin
+    repo = plugin.repo
+    local_path = plugin.project.local_fs_path
+    with open(os.path.join(local_path, "po", "de.po"), "w") as f:
+        f.write("de updated")
+    os.unlink(os.path.join(local_path, "po", "fr.po"))
+    with tmp_object_branch(plugin) as branch:
+        # nothing is checked out
+        assert repo.active_branch.name == "master"
+        branch.rm(["/po/fr.po"])
+        branch.add([os.path.join(local_path, "po", "de.po")])
+        assert branch.is_dirty
+        commit = branch.commit(
+            "Updating", author=Actor("Author", "author@example.com"))
+        assert commit.author.name == "Author"
+        branch.push()
+    assert [head.name for head in repo.heads] == ["master"]
+    assert repo.head.commit.hexsha == commit.hexsha
+    assert repo.remotes.origin.refs.master.commit.hexsha == commit.hexsha
+    assert sorted(
+        blob.path for blob in commit.tree.traverse()
+        if blob.type == "blob") == ["po/de.po"]
+    assert not repo.is_dirty()
+
+
+def test_branch_objects_no_push(dummy_git_plugin):
+    plugin = dummy_git_plugin
+    repo = plugin.repo
+    head = repo.head.commit.hexsha
+    with tmp_object_branch(plugin) as branch:
+        assert not branch.is_dirty
+        assert branch.commit("Nothing") is None
+    assert repo.head.commit.hexsha == head
+    assert [head.name for head in repo.heads] == ["master"]
+
+
+@pytest.mark.parametrize(
+    "branch_context", [tmp_branch, tmp_worktree, tmp_object_branch])
+def test_branch_rm(dummy_git_plugin, branch_context):
+    plugin = dummy_git_plugin
+    with branch_context(plugin) as branch:
+        untracked = branch.rm(
+            ["/po/de.po", "/po/missing.po", "/po/fr.po"])
+        assert untracked == ["/po/missing.po"]
+        assert branch.is_dirty
+        assert branch.rm([]) == []
+
+
+def test_branch_objects_push_rejected(dummy_git_plugin, tmpdir):
+    plugin = dummy_git_plugin
+    repo = plugin.repo
+    local_path = plugin.project.local_fs_path
+    with open(os.path.join(local_path, "po", "de.po"), "w") as f:
+        f.write("de from pootle")
+    with open(os.path.join(local_path, "po", "fr.po"), "w") as f:
+        f.write("fr from pootle")
+    with tmp_object_branch(plugin, backoff=0) as branch:
+        branch.add(
+            [os.path.join(local_path, "po", "de.po"),
+             os.path.join(local_path, "po", "fr.po")])
+        branch.commit("Updating")
+        # upstream moves on while pootle is committing
+        _push_upstream(
+            tmpdir,
+            {"po/de.po": "de from upstream",
+             "po/it.po": "it from upstream"})
+        branch.push()
+        assert branch.conflicts == set(["/po/de.po"])
+    remote = Repo(str(tmpdir.join("remote.git")))
+    tree = remote.commit("master").tree
+    assert tree["po/de.po"].data_stream.read() == b"de from upstream"
+    assert tree["po/fr.po"].data_stream.read() == b"fr from pootle"
+    assert tree["po/it.po"].data_stream.read() == b"it from upstream"
+    # the main checkout has the pushed commit
+    assert repo.head.commit.hexsha == remote.commit("master").hexsha
+    with open(os.path.join(local_path, "po", "de.po")) as f:
+        assert f.read() == "de from upstream"
+    assert os.path.exists(os.path.join(local_path, "po", "it.po"))
+    assert not repo.is_dirty(untracked_files=True)
+
+
+def test_branch_objects_push_retries(dummy_git_plugin, tmpdir):
+    plugin = dummy_git_plugin
+    local_path = plugin.project.local_fs_path
+    with open(os.path.join(local_path, "po", "de.po"), "w") as f:
+        f.write("de from pootle")
+    with pytest.raises(PushRejected):
+        with tmp_object_branch(plugin, retries=0) as branch:
+            branch.add([os.path.join(local_path, "po", "de.po")])
+            branch.commit("Updating")
+            _push_upstream(tmpdir, {"po/it.po": "it from upstream"})
+            branch.push()
+
+
+@pytest.mark.parametrize(
+    "branch_context", [tmp_branch, tmp_worktree, tmp_object_branch])
+def test_branch_reset(dummy_git_plugin, branch_context):
+    plugin = dummy_git_plugin
+    local_path = plugin.project.local_fs_path
+    with open(os.path.join(local_path, "po", "de.po"), "w") as f:
+        f.write("de updated")
+    with branch_context(plugin) as branch:
+        head = branch.head_sha
+        branch.add([os.path.join(local_path, "po", "de.po")])
+        branch.commit("Updating")
+        assert branch.head_sha != head
+        branch.reset(head)
+        assert branch.head_sha == head
+        assert not branch.is_dirty
+
+
+def test_branch_sparse_push(dummy_git_plugin, tmpdir):
+    upstream = _push_upstream(tmpdir, {"docs/README": "upstream"})
+    remote_path = str(tmpdir.join("remote.git"))
+    local_path = str(tmpdir.join("sparse"))
+    clone_repo(
+        "file://%s" % remote_path, local_path,
+        depth=1, filter="blob:none", sparse=True).git.sparse_checkout(
+            "set", "po")
+    plugin = DummyPlugin(local_path)
+    repo = plugin.repo
+    assert repo.git.rev_parse("--is-shallow-repository") == "true"
+    assert not os.path.exists(os.path.join(local_path, "docs"))
+    with open(os.path.join(local_path, "po", "de.po"), "w") as f:
+        f.write("de updated")
+    with tmp_branch(plugin) as branch:
+        assert branch.is_sparse
+        assert branch.rm(["/po/fr.po", "/po/it.po"]) == ["/po/it.po"]
+        branch.add([os.path.join(local_path, "po", "de.po")])
+        assert branch.is_dirty
+        commit = branch.commit(
+            "Updating",
+            author=Actor("Author", "author@example.com"),
+            committer=Actor("Committer", "committer@example.com"))
+        assert commit.author.name == "Author"
+        assert commit.committer.email == "committer@example.com"
+        branch.push()
+    assert repo.head.commit.hexsha != commit.hexsha
+    run_steps(branch.update_steps())
+    # master is pulled once the branch is destroyed
+    assert plugin.repo.head.commit.hexsha == commit.hexsha
+    tree = Repo(remote_path).commit("master").tree
+    assert tree.hexsha == commit.tree.hexsha
+    assert tree["po/de.po"].data_stream.read() == b"de updated"
+    # files outside of the sparse checkout are kept
+    assert tree["docs/README"].data_stream.read() == b"upstream"
+    assert "po/fr.po" not in [blob.path for blob in tree.traverse()]
+    assert commit.parents[0].hexsha == upstream.head.commit.hexsha
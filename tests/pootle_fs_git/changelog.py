@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) Pootle contributors.
+#
+# This file is a part of the Pootle project. It is distributed under the GPL3
+# or later license. See the LICENSE file for a copy of the license and the
+# AUTHORS file for copyright and authorship information.
+
+import pytest
+
+from git import Repo
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from pootle_fs.models import StoreFS
+from pootle_fs.utils import FSPlugin
+from pootle_store.models import Store
+
+from pootle_fs_git.plugin import Changelog, Commit
+
+from ..fixtures.repo import DummyPlugin, _commit_files
+
+
+class DummyResponseItem(object):
+
+    def __init__(self, pootle_path, fs_path, store_fs=None,
+                 action_type="pushed_to_fs"):
+        self.action_type = action_type
+        self.pootle_path = pootle_path
+        self.fs_path = fs_path
+        self.store_fs = store_fs
+
+
+def _pushed(store):
+    lang, project_, path = store.pootle_path.strip("/").split("/", 2)
+    fs_path = "/%s/%s" % (lang, path)
+    store_fs = (
+        store.fs.first()
+        or StoreFS.objects.create(store=store, path=fs_path))
+    return DummyResponseItem(store.pootle_path, fs_path, store_fs)
+
+
+def _removed(project, fs_path):
+    lang, path = fs_path.strip("/").split("/", 1)
+    return DummyResponseItem(
+        "/%s/%s/%s" % (lang, project.code, path), fs_path,
+        action_type="removed")
+
+
+class DummyResponse(object):
+
+    def __init__(self, items):
+        self.items = items
+
+    def completed(self, *action_types):
+        for item in self.items:
+            if item.action_type in action_types:
+                yield item
+
+
+def _submitter(store):
+    submission = store.data.last_submission
+    if submission:
+        user = submission.submitter
+        return user.display_name, user.email
+
+
+@pytest.mark.django_db
+def test_changelog_grouping(git_project):
+    plugin = FSPlugin(git_project).plugin
+    stores = list(
+        Store.objects.filter(
+            translation_project__project=git_project).order_by("pk"))
+    assert len(stores) > 1
+    removed = sorted(plugin.tree_index.hashes)[0]
+    response = DummyResponse(
+        [_pushed(store) for store in stores]
+        + [_removed(git_project, removed)])
+
+    single = Changelog(plugin, response).commits
+    assert len(single) == 1
+    assert single[0].to_remove == set([removed])
+    assert (
+        single[0].to_add
+        == set(item.fs_path for item in response.items[:-1]))
+
+    by_author = Changelog(plugin, response, grouping="author").commits
+    # removals are committed along with any stores without a submitter
+    authors = set(_submitter(store) for store in stores)
+    assert len(by_author) == len(authors.union([None]))
+    for commit in by_author:
+        assert len(commit.authors) <= 1
+    assert (
+        set().union(*[commit.to_add for commit in by_author])
+        == single[0].to_add)
+
+    by_language = Changelog(plugin, response, grouping="language").commits
+    languages = set(
+        item.pootle_path.split("/")[1] for item in response.items)
+    assert len(by_language) == len(languages)
+    for commit in by_language:
+        assert len(set(path.split("/")[1] for path in commit.paths)) == 1
+
+    with pytest.raises(ValueError):
+        Changelog(plugin, response, grouping="colour")
+
+
+@pytest.mark.django_db
+def test_changelog_queries(git_project):
+    plugin = FSPlugin(git_project).plugin
+    stores = Store.objects.filter(translation_project__project=git_project)
+    response = DummyResponse([_pushed(store) for store in stores])
+    assert len(response.items) > 1
+    # warm the git caches
+    plugin.repo.tree()
+    for grouping in Changelog.groupings:
+        with CaptureQueriesContext(connection) as queries:
+            commits = Changelog(plugin, response, grouping=grouping).commits
+        assert sum(len(commit.to_add) for commit in commits) == len(stores)
+        assert len(queries) == 1
+        with CaptureQueriesContext(connection) as queries:
+            Changelog(
+                plugin,
+                DummyResponse(response.items[:1]),
+                grouping=grouping).commits
+        assert len(queries) == 1
+
+
+def test_changelog_commit_paths():
+    commit = Commit()
+    commit.add("/po/de.po")
+    commit.remove("/po/fr.po")
+    assert "/po/de.po" in commit
+    assert "/po/fr.po" in commit
+    assert commit.paths == set(["/po/de.po", "/po/fr.po"])
+
+
+def _removed_response(count):
+    items = []
+    for i in range(count):
+        fs_path = "/po/%s.po" % (i % 10 and i or 0)
+        items.append(
+            DummyResponseItem(
+                "/lang%s/project%s" % (i, fs_path), fs_path,
+                action_type="removed"))
+    return DummyResponse(items)
+
+
+class CountingIndex(object):
+    """Counts the lookups of paths in a tree index"""
+
+    def __init__(self, index):
+        self.index = index
+        self.lookups = 0
+
+    def __contains__(self, path):
+        self.lookups += 1
+        return path in self.index
+
+
+def test_changelog_scaling(tmpdir):
+    repo = Repo.init(str(tmpdir))
+    _commit_files(repo, ["po/0.po"], "Initial commit")
+    plugin = DummyPlugin(repo.working_dir)
+
+    # duplicated paths are only committed once
+    commits = Changelog(plugin, _removed_response(100)).commits
+    assert len(commits) == 1
+    assert commits[0].to_remove == set(["/po/0.po"])
+    assert isinstance(commits[0].paths, set)
+
+    # each path is looked up in the tree once, however many responses
+    # there are for it
+    response = _removed_response(1000)
+    plugin.tree_index = CountingIndex(plugin.tree_index)
+    Changelog(plugin, response).commits
+    assert plugin.tree_index.lookups == len(
+        set(item.fs_path for item in response.items))
+
+
+def test_changelog_chunks(tmpdir):
+    repo = Repo.init(str(tmpdir))
+    _commit_files(repo, ["po/%s.po" % i for i in range(5)], "Initial commit")
+    plugin = DummyPlugin(repo.working_dir)
+    response = _removed_response(5)
+    changelog = Changelog(plugin, response, max_files=2)
+    assert changelog.is_chunked
+    chunks = changelog.commits
+    assert [len(chunk.paths) for chunk in chunks] == [2, 2, 1]
+    for chunk in chunks:
+        assert chunk.paths == set(
+            action.fs_path for action in chunk.actions)
+    assert not Changelog(plugin, response).is_chunked
+    assert len(Changelog(plugin, response).commits) == 1
+
+
+def test_changelog_chunk_bytes():
+    changelog = Changelog(None, None, max_bytes=10)
+    commit = Commit()
+    # a file larger than the limit gets a commit of its own
+    assert not changelog.is_full(commit, 20)
+    commit.add("/po/de.po", 20)
+    assert changelog.is_full(commit, 1)
+    commit = Commit()
+    commit.add("/po/de.po", 6)
+    assert not changelog.is_full(commit, 4)
+    assert changelog.is_full(commit, 5)
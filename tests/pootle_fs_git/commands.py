@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) Pootle contributors.
+#
+# This file is a part of the Pootle project. It is distributed under the GPL3
+# or later license. See the LICENSE file for a copy of the license and the
+# AUTHORS file for copyright and authorship information.
+
+import pytest
+
+from git import Repo
+from git.exc import GitCommandError
+
+from pootle_fs_git.commands import (
+    Delay, GitCommand, GitResult, Steps, run_steps)
+from pootle_fs_git.instrumentation import GitOperation, git_operation_done
+
+
+def test_git_command():
+    command = GitCommand("pull", ["pull", "origin"], progress=True)
+    assert command.command() == ["git", "pull", "origin"]
+    assert command.command(progress=True) == [
+        "git", "pull", "--progress", "origin"]
+    command = GitCommand("ls_remote", ["ls-remote", "origin"])
+    assert command.command(progress=True) == ["git", "ls-remote", "origin"]
+    assert GitResult(command, 0, "out", "").check() == "out"
+    with pytest.raises(GitCommandError):
+        GitResult(command, 1, "", "error").check()
+
+
+def _inner(events):
+    result = yield GitCommand("inner", ["inner"])
+    events.append(result)
+    yield "inner result"
+
+
+def _failing():
+    yield GitCommand("failing", ["failing"])
+    raise ValueError("failed")
+
+
+def _nothing():
+    if False:
+        yield
+
+
+def _outer(events):
+    events.append((yield _inner(events)))
+    yield Delay(1)
+    try:
+        yield _failing()
+    except ValueError as e:
+        events.append(str(e))
+    # steps that end without a result send None
+    events.append((yield _nothing()))
+    yield "outer result"
+
+
+def test_steps():
+    events = []
+    steps = Steps(_outer(events))
+    step = steps.resume()
+    assert step.name == "inner"
+    step = steps.resume("inner output")
+    assert isinstance(step, Delay)
+    assert step.seconds == 1
+    assert steps.resume().name == "failing"
+    assert steps.resume("failing output") is None
+    assert steps.result == "outer result"
+    assert events == [
+        "inner output", "inner result", "failed", None]
+
+
+def test_steps_error():
+    steps = Steps(_failing())
+    steps.resume()
+    with pytest.raises(ValueError):
+        steps.resume()
+
+
+def test_run_steps(tmpdir):
+    repo = Repo.init(str(tmpdir))
+    repo.index.commit("Initial commit")
+    operations = []
+
+    def receive(sender, operation, **kwargs):
+        operations.append(operation)
+
+    def steps():
+        result = yield GitCommand(
+            "log", ["rev-parse", "HEAD"], project="project0",
+            cwd=str(tmpdir))
+        try:
+            (yield GitCommand(
+                "log", ["rev-parse", "missing"], cwd=str(tmpdir))).check()
+        except GitCommandError:
+            pass
+        yield result.check()
+
+    git_operation_done.connect(receive, sender=GitOperation)
+    try:
+        assert run_steps(steps()) == repo.head.commit.hexsha
+    finally:
+        git_operation_done.disconnect(receive, sender=GitOperation)
+    assert [(op.project, op.subprocesses, op.failed)
+            for op in operations] == [
+        ("project0", 1, False), (None, 1, True)]
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) Pootle contributors.
+#
+# This file is a part of the Pootle project. It is distributed under the GPL3
+# or later license. See the LICENSE file for a copy of the license and the
+# AUTHORS file for copyright and authorship information.
+
+import threading
+import time
+from collections import defaultdict
+
+import pytest
+
+from pootle_fs.exceptions import FSFetchError
+
+from pootle_fs_git import fetch
+from pootle_fs_git.fetch import ProjectsFetcher, fetching, fs_url_host
+
+
+class DummyProject(object):
+
+    def __init__(self, code, fs_url):
+        self.code = code
+        self.fs_url = fs_url
+
+
+class DummyFetches(object):
+    """Records how many dummy fetches run at once, overall and by host"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = defaultdict(int)
+        self.max_running = defaultdict(int)
+        self.closed = set()
+
+    def start(self, host):
+        with self.lock:
+            for key in (None, host):
+                self.running[key] += 1
+                self.max_running[key] = max(
+                    self.max_running[key], self.running[key])
+
+    def stop(self, host):
+        with self.lock:
+            for key in (None, host):
+                self.running[key] -= 1
+
+    def plugin(self, project):
+        return DummyFetchPlugin(self, project)
+
+    def all(self):
+        # stands in for the db connections of the thread
+        return [DummyConnection(self)]
+
+
+class DummyConnection(object):
+
+    def __init__(self, fetches):
+        self.fetches = fetches
+
+    def close(self):
+        self.fetches.closed.add(threading.current_thread().ident)
+
+
+class DummyFetchPlugin(object):
+
+    def __init__(self, fetches, project):
+        self.fetches = fetches
+        self.project = project
+        self.fs_url = project.fs_url
+
+    def fetch(self):
+        host = fs_url_host(self.fs_url)
+        self.fetches.start(host)
+        try:
+            time.sleep(0.02)
+            if self.project.code == "broken":
+                raise FSFetchError("Unable to fetch")
+            return "fetched %s" % self.project.code
+        finally:
+            self.fetches.stop(host)
+
+
+@pytest.mark.parametrize(
+    "fs_url, host",
+    [("https://github.com/translate/pootle.git", "github.com"),
+     ("ssh://git@git.example.org:2222/repo.git", "git.example.org"),
+     ("git@github.com:translate/pootle.git", "github.com"),
+     ("example.org:repo.git", "example.org"),
+     ("/var/lib/git/repo.git", ""),
+     ("file:///var/lib/git/repo.git", "")])
+def test_fetch_fs_url_host(fs_url, host):
+    assert fs_url_host(fs_url) == host
+
+
+def test_fetching():
+    project = DummyProject("project0", "/var/lib/git/project0.git")
+    with fetching(project) as fetched:
+        fetched.result = "fetched"
+    assert fetched.result == "fetched"
+    assert not fetched.failed
+    assert fetched.duration >= 0
+    # errors are kept rather than raised
+    with fetching(project) as fetched:
+        raise FSFetchError("Unable to fetch")
+    assert isinstance(fetched.error, FSFetchError)
+    with fetching(project) as fetched:
+        raise ValueError("Unexpected")
+    assert isinstance(fetched.error, ValueError)
+    assert fetched.failed
+    assert fetched.duration >= 0
+
+
+@pytest.mark.django_db
+def test_fetch_project(git_project):
+    fetcher = ProjectsFetcher([git_project], workers=2, host_workers=1)
+    fetched = fetcher.fetch_project(git_project)
+    assert not fetched.failed
+    assert fetched.result.changed_paths == set()
+    assert fetched.duration >= 0
+
+
+@pytest.mark.django_db
+def test_fetch_project_error(git_project_1, tmpdir):
+    git_project_1.config["pootle_fs.fs_url"] = str(tmpdir.join("missing"))
+    fetcher = ProjectsFetcher([git_project_1])
+    fetched = fetcher.fetch_project(git_project_1)
+    assert fetched.failed
+    assert isinstance(fetched.error, FSFetchError)
+    assert fetched.result is None
+
+
+def test_fetch_projects_limits(monkeypatch):
+    fetches = DummyFetches()
+    monkeypatch.setattr(fetch, "FSPlugin", fetches.plugin)
+    monkeypatch.setattr(fetch, "connections", fetches)
+    projects = [
+        DummyProject(
+            "project%s" % i,
+            "https://git%s.example.org/project%s.git" % (i % 2, i))
+        for i in range(6)]
+    projects.insert(3, DummyProject("broken", "/var/lib/git/broken.git"))
+    fetcher = ProjectsFetcher(projects, workers=3, host_workers=1)
+    fetched = fetcher.fetch()
+    assert [f.project for f in fetched] == projects
+    assert [f.result for f in fetched if not f.failed] == [
+        "fetched project%s" % i for i in range(6)]
+    assert [f.project.code for f in fetched if f.failed] == ["broken"]
+    assert isinstance(fetched[3].error, FSFetchError)
+    assert all(f.duration >= 0 for f in fetched)
+    assert fetches.max_running[None] <= 3
+    assert fetches.max_running["git0.example.org"] == 1
+    assert fetches.max_running["git1.example.org"] == 1
+    # each thread of the pool closed its db connections
+    assert fetches.closed
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) Pootle contributors.
+#
+# This file is a part of the Pootle project. It is distributed under the GPL3
+# or later license. See the LICENSE file for a copy of the license and the
+# AUTHORS file for copyright and authorship information.
+
+import os
+import threading
+
+from git import Repo
+
+from pootle_fs_git.hashes import (
+    TreeHashCache, TreeHashIndex, TreeHashIndexes, translation_prefixes)
+
+from ..fixtures.plugin import DEFAULT_TRANSLATION_PATHS
+from ..fixtures.repo import _commit_files
+
+
+def test_translation_prefixes():
+    assert (
+        translation_prefixes(DEFAULT_TRANSLATION_PATHS.values())
+        == ["gnu_style/po",
+            "gnu_style_named_files/po",
+            "gnu_style_named_folders",
+            "non_gnu_style/locales"])
+    assert translation_prefixes(
+        ["/<language_code>/<dir_path>/<filename>.<ext>"]) == []
+    assert translation_prefixes(
+        ["/po/<language_code>.po",
+         "/po/sub/<language_code>.po"]) == ["po"]
+
+
+def test_tree_hash_index(tmpdir):
+    repo = Repo.init(str(tmpdir))
+    commit = _commit_files(
+        repo,
+        ["po/de.po", "po/fr.po", "po/sub/it.po", "src/main.c", "README"])
+    index = TreeHashIndex(repo, commit.hexsha, ["po"])
+    assert sorted(index.hashes) == ["/po/de.po", "/po/fr.po", "/po/sub/it.po"]
+    assert index["/po/de.po"] == commit.tree["po/de.po"].hexsha
+    assert "/src/main.c" not in index
+    assert index.get("/README") is None
+    full_index = TreeHashIndex(repo, commit.hexsha)
+    assert "/src/main.c" in full_index
+    assert "/README" in full_index
+
+
+def test_tree_hash_indexes(tmpdir):
+    repo = Repo.init(str(tmpdir))
+    commit = _commit_files(repo, ["po/de.po"])
+    indexes = TreeHashIndexes()
+    index = indexes.get(repo, commit.hexsha, ["po"])
+    assert indexes.get(repo, commit.hexsha, ["po"]) is index
+    assert indexes.get(repo, commit.hexsha) is not index
+    new_commit = _commit_files(repo, ["po/de.po"], "Updating de")
+    new_index = indexes.get(repo, new_commit.hexsha)
+    assert new_index is not index
+    assert new_index["/po/de.po"] != index["/po/de.po"]
+
+
+def test_tree_hash_cache(tmpdir):
+    cache = TreeHashCache(str(tmpdir.join("cache", "hashes")))
+    assert cache.load() == (None, None)
+    hashes = {
+        u"/po/de.po": "a" * 40,
+        u"/po/f\xfc.po": "0" * 39 + "1"}
+    cache.save("b" * 40, hashes)
+    assert cache.load() == ("b" * 40, hashes)
+    cache.save("c" * 40, {})
+    assert cache.load() == ("c" * 40, {})
+
+
+def test_tree_hash_cache_threads(tmpdir):
+    cache = TreeHashCache(str(tmpdir.join("cache", "hashes")))
+    saves = [
+        ("%040x" % i,
+         dict((u"/po/%s.po" % j, "%040x" % (i * j)) for j in range(1000)))
+        for i in range(8)]
+    errors = []
+
+    def save(sha, hashes):
+        try:
+            for i_ in range(10):
+                cache.save(sha, hashes)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [
+        threading.Thread(target=save, args=args)
+        for args in saves]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    # the cache holds one of the saves whole, and no files are left over
+    sha, hashes = cache.load()
+    assert (sha, hashes) in saves
+    assert os.listdir(str(tmpdir.join("cache"))) == ["hashes"]
+
+
+def test_tree_hash_index_cached(tmpdir):
+    repo = Repo.init(str(tmpdir.join("repo")))
+    commit = _commit_files(repo, ["po/de.po", "po/fr.po"])
+    cache = TreeHashCache(str(tmpdir.join("hashes")))
+    hashes = TreeHashIndex(repo, commit.hexsha, ["po"], cache=cache).hashes
+    assert cache.load() == (commit.hexsha, hashes)
+
+    class NoTreeIndex(TreeHashIndex):
+
+        def read_tree(self):
+            raise AssertionError("Tree should not be read")
+
+    cached = NoTreeIndex(repo, commit.hexsha, ["po"], cache=cache)
+    assert cached.hashes == hashes
+
+
+def test_tree_hash_index_changes(tmpdir):
+    repo = Repo.init(str(tmpdir.join("repo")))
+    commit = _commit_files(repo, ["po/de.po", "po/fr.po", "src/main.c"])
+    cache = TreeHashCache(str(tmpdir.join("hashes")))
+    index = TreeHashIndex(repo, commit.hexsha, ["po"], cache=cache)
+    assert sorted(index.hashes) == ["/po/de.po", "/po/fr.po"]
+    assert index.changed_paths is None
+    _commit_files(repo, ["po/de.po", "po/it.po", "src/main.c"], "Updating")
+    repo.index.remove(["po/fr.po"], working_tree=True)
+    new_commit = repo.index.commit("Removing fr")
+
+    class NoTreeIndex(TreeHashIndex):
+
+        def read_tree(self):
+            raise AssertionError("Tree should not be read")
+
+    new_index = NoTreeIndex(repo, new_commit.hexsha, ["po"], cache=cache)
+    assert new_index.hashes == TreeHashIndex(
+        repo, new_commit.hexsha, ["po"]).hashes
+    assert new_index.base_sha == commit.hexsha
+    assert new_index.changed_paths == set(
+        ["/po/de.po", "/po/fr.po", "/po/it.po"])
+    assert cache.load() == (new_commit.hexsha, new_index.hashes)
+    same_index = NoTreeIndex(repo, new_commit.hexsha, ["po"], cache=cache)
+    assert same_index.hashes == new_index.hashes
+    assert same_index.changed_paths == set()
+
+
+def test_tree_hash_index_unknown_base(tmpdir):
+    repo = Repo.init(str(tmpdir.join("repo")))
+    commit = _commit_files(repo, ["po/de.po"])
+    cache = TreeHashCache(str(tmpdir.join("hashes")))
+    cache.save("f" * 40, {"/po/gone.po": "a" * 40})
+    index = TreeHashIndex(repo, commit.hexsha, ["po"], cache=cache)
+    assert sorted(index.hashes) == ["/po/de.po"]
+    assert index.changed_paths is None
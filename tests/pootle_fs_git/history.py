@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) Pootle contributors.
+#
+# This file is a part of the Pootle project. It is distributed under the GPL3
+# or later license. See the LICENSE file for a copy of the license and the
+# AUTHORS file for copyright and authorship information.
+
+import io
+
+from git import Repo
+
+from pootle_fs_git.history import LastCommits, LastCommitsCache, parse_log
+
+from ..fixtures.repo import _commit_files
+
+
+def test_parse_log():
+    output = (
+        b"\x01sha2\0Author 2\0two@example.com\0\npo/de.po\0po/f\xc3\xbc.po\0"
+        b"\x01sha1\0Author 1\0one@example.com\0\npo/de.po\0po/fr.po\0")
+    parsed = list(parse_log(io.BytesIO(output), chunk_size=7))
+    assert (
+        [(commit.hexsha, path) for commit, path in parsed]
+        == [("sha2", "/po/de.po"),
+            ("sha2", u"/po/f\xfc.po"),
+            ("sha1", "/po/de.po"),
+            ("sha1", "/po/fr.po")])
+    assert parsed[0][0].author_name == "Author 2"
+    assert parsed[-1][0].author_email == "one@example.com"
+
+
+def test_last_commits(tmpdir):
+    repo = Repo.init(str(tmpdir))
+    first = _commit_files(
+        repo, ["po/de.po", "po/fr.po", "README"],
+        author=("Author 1", "one@example.com"))
+    second = _commit_files(
+        repo, ["po/de.po"],
+        "Updating de",
+        author=("Author 2", "two@example.com"))
+    last_commits = LastCommits(repo, second.hexsha, ["po"])
+    last_commits.resolve(["/po/de.po", "/po/fr.po", "/po/missing.po"])
+    assert last_commits.get("/po/de.po") == (
+        second.hexsha, "Author 2", "two@example.com")
+    assert last_commits.get("/po/fr.po") == (
+        first.hexsha, "Author 1", "one@example.com")
+    assert "/po/missing.po" in last_commits
+    assert last_commits.get("/po/missing.po") is None
+    # paths outside the prefixes are not walked
+    assert "/README" not in last_commits
+    # history as of an older commit
+    old_commits = LastCommits(repo, first.hexsha, ["po"])
+    old_commits.resolve(["/po/de.po"])
+    assert old_commits.get("/po/de.po").hexsha == first.hexsha
+
+
+def test_last_commits_stop_early(tmpdir):
+    repo = Repo.init(str(tmpdir))
+    _commit_files(
+        repo, ["po/fr.po"],
+        author=("Author 1", "one@example.com"))
+    latest = _commit_files(
+        repo, ["po/de.po"],
+        author=("Author 2", "two@example.com"))
+    last_commits = LastCommits(repo, latest.hexsha, ["po"])
+    last_commits.resolve(["/po/de.po"])
+    assert last_commits.get("/po/de.po").hexsha == latest.hexsha
+    assert "/po/fr.po" not in last_commits
+
+
+def test_last_commits_cache(tmpdir):
+    repo = Repo.init(str(tmpdir))
+    commit = _commit_files(
+        repo, ["po/de.po"],
+        author=("Author 1", "one@example.com"))
+    cache = LastCommitsCache()
+    last_commits = cache.get(repo, commit.hexsha, ["po"])
+    assert cache.get(repo, commit.hexsha, ["po"]) is last_commits
+    new_commit = _commit_files(
+        repo, ["po/de.po"],
+        author=("Author 1", "one@example.com"))
+    assert cache.get(repo, new_commit.hexsha, ["po"]) is not last_commits
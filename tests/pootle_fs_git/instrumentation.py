@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) Pootle contributors.
+#
+# This file is a part of the Pootle project. It is distributed under the GPL3
+# or later license. See the LICENSE file for a copy of the license and the
+# AUTHORS file for copyright and authorship information.
+
+import pytest
+
+from git import Repo
+
+from pootle_fs_git.instrumentation import (
+    GitOperation, GitOperationStats, InstrumentedRepo, clone_repo,
+    git_operation, git_operation_done, repo_project, stats)
+
+
+@pytest.fixture
+def operations():
+    operations = []
+
+    def receive(sender, operation, **kwargs):
+        operations.append(operation)
+
+    git_operation_done.connect(receive, sender=GitOperation)
+    yield operations
+    git_operation_done.disconnect(receive, sender=GitOperation)
+
+
+@pytest.fixture
+def repo(tmpdir):
+    repo = Repo.init(str(tmpdir.join("project0")))
+    repo.index.commit("Initial commit")
+    return InstrumentedRepo(repo.working_dir)
+
+
+def test_instrumentation_operation(repo, operations):
+    with git_operation("tree", repo_project(repo)) as tree:
+        output = repo.git.ls_tree("-r", "HEAD")
+        with git_operation("log", "project0") as log:
+            repo.git.log("--oneline")
+    assert repo_project(repo) == "project0"
+    assert operations == [log, tree]
+    assert log.subprocesses == 1
+    # processes of inner operations are counted in the outer ones
+    assert tree.subprocesses == 2
+    assert log.bytes > 0
+    assert tree.bytes == log.bytes + len(output)
+    assert tree.duration >= log.duration
+    assert not tree.failed
+    # nothing is counted outside of an operation
+    repo.git.log()
+    assert tree.subprocesses == 2
+
+
+def test_instrumentation_operation_failed(repo, operations):
+    with pytest.raises(ValueError):
+        with git_operation("push", "project0"):
+            raise ValueError("Not pushed")
+    assert operations[0].failed
+    assert operations[0].duration is not None
+
+
+def test_instrumentation_clone(repo, tmpdir, operations):
+    with git_operation("clone", "project1") as clone:
+        cloned = clone_repo(repo.working_dir, str(tmpdir.join("project1")))
+        cloned.git.rev_parse("HEAD")
+    assert isinstance(cloned, InstrumentedRepo)
+    assert cloned.head.commit == repo.head.commit
+    assert clone.subprocesses == 2
+
+
+def test_instrumentation_stats(repo):
+    operation_stats = GitOperationStats()
+    for duration in [1, 3]:
+        operation = GitOperation("pull", "project0")
+        operation.duration = duration
+        operation.subprocesses = 2
+        operation.bytes = 10
+        operation_stats.add(operation)
+    operation.failed = True
+    operation.project = "project1"
+    operation_stats.add(operation)
+    assert operation_stats.get("project0") == {
+        ("project0", "pull"): dict(
+            count=2, failed=0, duration=4, max_duration=3,
+            subprocesses=4, bytes=20)}
+    assert operation_stats.get()[("project1", "pull")]["failed"] == 1
+    operation_stats.reset()
+    assert operation_stats.get() == {}
+
+    # the default aggregator receives every operation
+    with git_operation("tree", "project2"):
+        repo.git.ls_tree("HEAD")
+    assert stats.get("project2")[("project2", "tree")]["subprocesses"] == 1
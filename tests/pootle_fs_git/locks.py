@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) Pootle contributors.
+#
+# This file is a part of the Pootle project. It is distributed under the GPL3
+# or later license. See the LICENSE file for a copy of the license and the
+# AUTHORS file for copyright and authorship information.
+
+import threading
+
+import pytest
+
+from pootle_fs_git.locks import LockTimeout, RepoLock
+
+
+def _try_lock(path, exclusive, results):
+    try:
+        with RepoLock(path, timeout=0.2).acquire(exclusive):
+            results.append(True)
+    except LockTimeout:
+        results.append(False)
+
+
+def _locked_by_other_thread(path, exclusive):
+    results = []
+    thread = threading.Thread(
+        target=_try_lock, args=(path, exclusive, results))
+    thread.start()
+    thread.join()
+    return not results[0]
+
+
+@pytest.fixture
+def lock_path(tmpdir):
+    pytest.importorskip("fcntl")
+    return str(tmpdir.join("locks", "project0.lock"))
+
+
+def test_lock_read(lock_path):
+    with RepoLock(lock_path).read():
+        # readers share the lock, writers wait
+        assert not _locked_by_other_thread(lock_path, False)
+        assert _locked_by_other_thread(lock_path, True)
+    assert not _locked_by_other_thread(lock_path, True)
+
+
+def test_lock_write(lock_path):
+    lock = RepoLock(lock_path)
+    with lock.write():
+        assert _locked_by_other_thread(lock_path, False)
+        # locks are reentrant, and a nested read keeps the write lock
+        with lock.read():
+            with lock.write():
+                assert lock.held[lock_path].depth == 3
+            assert _locked_by_other_thread(lock_path, False)
+    assert lock_path not in lock.held
+    assert not _locked_by_other_thread(lock_path, False)
+
+
+def test_lock_upgrade(lock_path):
+    lock = RepoLock(lock_path)
+    with lock.read():
+        with lock.write():
+            assert _locked_by_other_thread(lock_path, False)
+        # the read lock is restored
+        assert not _locked_by_other_thread(lock_path, False)
+        assert _locked_by_other_thread(lock_path, True)
+
+
+def _hold_read(path, held, release):
+    with RepoLock(path).read():
+        held.set()
+        release.wait()
+
+
+def test_lock_upgrade_timeout(lock_path):
+    held = threading.Event()
+    release = threading.Event()
+    thread = threading.Thread(
+        target=_hold_read, args=(lock_path, held, release))
+    thread.start()
+    held.wait()
+    lock = RepoLock(lock_path, timeout=0.2)
+    try:
+        with lock.read():
+            # another reader holds the lock, so it cannot be upgraded
+            with pytest.raises(LockTimeout):
+                with lock.write():
+                    pass
+            release.set()
+            thread.join()
+            # the read lock is still held
+            assert not lock.held[lock_path].exclusive
+            assert _locked_by_other_thread(lock_path, True)
+    finally:
+        release.set()
+        thread.join()
+    assert not _locked_by_other_thread(lock_path, True)
+
+
+def _timeout(path, results):
+    _try_lock(path, True, results)
+    results.append(path in RepoLock(path).held)
+
+
+def test_lock_timeout(lock_path):
+    results = []
+    with RepoLock(lock_path).write():
+        thread = threading.Thread(target=_timeout, args=(lock_path, results))
+        thread.start()
+        thread.join()
+    # the lock is not held after timing out
+    assert results == [False, False]
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) Pootle contributors.
+#
+# This file is a part of the Pootle project. It is distributed under the GPL3
+# or later license. See the LICENSE file for a copy of the license and the
+# AUTHORS file for copyright and authorship information.
+
+import os
+
+from git import Actor, Repo
+
+from pootle_fs_git.objects import TreeBuilder
+
+from ..fixtures.repo import _write_files
+
+
+def test_tree_builder(tmpdir):
+    repo = Repo.init(str(tmpdir))
+    paths = [
+        "po/de.po", "po/fr.po", "po/sub/it.po",
+        "po-extra/de.po", "po.d", "src/main.c"]
+    _write_files(repo, paths)
+    repo.index.add(paths)
+    parent = repo.index.commit("Initial commit")
+    _write_files(repo, ["po/de.po", "po/sub/new/pt.po"], "updated")
+    builder = TreeBuilder(repo, parent.tree.hexsha)
+    assert not builder.is_dirty
+    builder.add(
+        "/po/de.po", os.path.join(repo.working_dir, "po", "de.po"))
+    builder.add(
+        "/po/sub/new/pt.po",
+        os.path.join(repo.working_dir, "po", "sub", "new", "pt.po"))
+    builder.remove("/po/fr.po")
+    builder.remove("/po/sub/it.po")
+    assert builder.is_dirty
+    commit = builder.commit(
+        "Updating", parent, author=Actor("Author", "author@example.com"))
+    assert [p.hexsha for p in commit.parents] == [parent.hexsha]
+    assert commit.author.name == "Author"
+    # matches the tree git would write from the index
+    repo.index.add(["po/de.po", "po/sub/new/pt.po"])
+    repo.index.remove(["po/fr.po", "po/sub/it.po"])
+    assert commit.tree.hexsha == repo.index.write_tree().hexsha
+    # unchanged subtrees are reused
+    assert commit.tree["src"].hexsha == parent.tree["src"].hexsha
+    # the head and working tree are untouched
+    assert repo.head.commit == parent
+    assert os.path.exists(os.path.join(repo.working_dir, "po", "fr.po"))
+
+
+def test_tree_builder_no_changes(tmpdir):
+    repo = Repo.init(str(tmpdir))
+    _write_files(repo, ["po/de.po"])
+    repo.index.add(["po/de.po"])
+    parent = repo.index.commit("Initial commit")
+    builder = TreeBuilder(repo, parent.tree.hexsha)
+    builder.add("/po/de.po", os.path.join(repo.working_dir, "po", "de.po"))
+    builder.remove("/po/missing.po")
+    assert not builder.is_dirty
+    assert builder.commit("Nothing", parent) is None
@@ -9,10 +9,17 @@
 
 import shutil
 import os
+import threading
 
 import pytest
 
-from pytest_pootle.factories import ProjectDBFactory
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from git import Repo
+
+from pytest_pootle.factories import (
+    ProjectDBFactory, TranslationProjectFactory)
 # from pytest_pootle.fs.suite import (
 #    run_add_test, run_fetch_test, run_rm_test, run_merge_test,
 #    check_files_match)
@@ -20,10 +27,14 @@ from pytest_pootle.factories import ProjectDBFactory
 from pootle_fs.utils import FSPlugin
 
 from pootle_config.utils import ObjectConfig
+from pootle_language.models import Language
 
+from pootle_fs_git.locks import LockTimeout, RepoLock
 from pootle_fs_git.plugin import DEFAULT_COMMIT_MSG
 from pootle_fs_git.utils import tmp_git
 
+from ..fixtures.benchmark import (
+    _write, create_benchmark_repo, layout_mapping)
 from ..fixtures.plugin import DEFAULT_TRANSLATION_PATHS
 
 
@@ -65,6 +76,274 @@ def test_plugin_fetch(git_project_1):
     assert git_plugin.is_cloned is True
 
 
+@pytest.mark.django_db
+def test_plugin_fetch_up_to_date(git_project):
+    git_plugin = FSPlugin(git_project)
+    latest_hash = git_plugin.latest_hash
+    result = git_plugin.fetch()
+    assert result.old_sha == result.new_sha == latest_hash
+    assert result.changed_paths == set()
+
+
+@pytest.mark.django_db
+def test_plugin_fetch_changed_paths(git_project):
+    git_plugin = FSPlugin(git_project)
+    latest_hash = git_plugin.latest_hash
+    fs_path = sorted(git_plugin.tree_index.hashes)[0]
+    with tmp_git(git_plugin.fs_url) as (tmp_repo_path, tmp_repo):
+        with open(os.path.join(tmp_repo_path, fs_path[1:]), "a") as f:
+            f.write("\n")
+        tmp_repo.index.add([fs_path[1:]])
+        tmp_repo.index.commit("Editing %s" % fs_path)
+        tmp_repo.remotes.origin.push()
+    result = git_plugin.fetch()
+    assert result.old_sha == latest_hash
+    assert result.new_sha == git_plugin.latest_hash != latest_hash
+    assert result.changed_paths == set([fs_path])
+    assert result.profile is None
+
+
+@pytest.mark.django_db
+def test_plugin_fetch_profile(git_project):
+    git_project.config["pootle.fs.profile"] = True
+    git_plugin = FSPlugin(git_project)
+    fs_path = sorted(git_plugin.tree_index.hashes)[0]
+    with tmp_git(git_plugin.fs_url) as (tmp_repo_path, tmp_repo):
+        with open(os.path.join(tmp_repo_path, fs_path[1:]), "a") as f:
+            f.write("\n")
+        tmp_repo.index.add([fs_path[1:]])
+        tmp_repo.index.commit("Editing %s" % fs_path)
+        tmp_repo.remotes.origin.push()
+    profile = git_plugin.fetch().profile
+    assert profile.name == "fetch"
+    assert profile.project == git_project.code
+    assert list(profile.phases) == ["remote check", "pull", "changed paths"]
+    assert profile.actions == {"changed": 1}
+    assert profile.subprocesses
+    assert git_plugin.plugin.profile is None
+
+
+def _read_in_thread(lock_path, results):
+    try:
+        with RepoLock(lock_path, timeout=0.1).read():
+            results.append("read")
+    except LockTimeout:
+        results.append("timed out")
+
+
+@pytest.mark.django_db
+def test_plugin_fetch_lock(git_project):
+    git_plugin = FSPlugin(git_project).plugin
+    lock_path = git_plugin.lock.path
+    fetch_repo = git_plugin.fetch_repo
+    results = []
+
+    def locked_fetch_repo():
+        # readers in other threads are locked out while fetching
+        thread = threading.Thread(
+            target=_read_in_thread, args=(lock_path, results))
+        thread.start()
+        thread.join()
+        return fetch_repo()
+
+    git_plugin.fetch_repo = locked_fetch_repo
+    git_plugin.fetch()
+    _read_in_thread(lock_path, results)
+    assert results == ["timed out", "read"]
+
+
+@pytest.mark.django_db
+def test_plugin_sync_lock(git_project):
+    git_plugin = FSPlugin(git_project).plugin
+    lock_path = git_plugin.lock.path
+    store_fs = git_plugin.resources.tracked.select_related("store").first()
+    unit = store_fs.store.units[0]
+    unit.target = "Changed in Pootle"
+    unit.save()
+    sync_push = git_plugin.sync_push
+    results = []
+
+    def locked_sync_push(*args, **kwargs):
+        # readers in other threads are locked out while the files are
+        # written to the working tree
+        thread = threading.Thread(
+            target=_read_in_thread, args=(lock_path, results))
+        thread.start()
+        thread.join()
+        return sync_push(*args, **kwargs)
+
+    git_plugin.sync_push = locked_sync_push
+    response = git_plugin.sync()
+    _read_in_thread(lock_path, results)
+    assert results == ["timed out", "read"]
+    assert list(response.completed("pushed_to_fs"))
+
+
+@pytest.mark.django_db
+def test_plugin_state_lock(git_project, monkeypatch):
+    git_plugin = FSPlugin(git_project).plugin
+    opened = []
+    repo_lock_open = RepoLock.open
+
+    def counting_open(self):
+        opened.append(self.path)
+        return repo_lock_open(self)
+
+    monkeypatch.setattr(RepoLock, "open", counting_open)
+    state = git_plugin.state()
+    # one read lock is taken for the state, not one for each file
+    assert opened == [git_plugin.lock.path]
+    assert "file_hashes" in state.resources.__dict__
+
+
+@pytest.mark.django_db
+def test_plugin_git_settings(git_project):
+    git_project.config["pootle.fs.author_name"] = "Author"
+    git_project.config["pootle.fs.author_email"] = "author@example.com"
+    git_plugin = FSPlugin(git_project).plugin
+    assert git_plugin.author.name == "Author"
+    with CaptureQueriesContext(connection) as queries:
+        for i in range(10):
+            git_project.config.reload()
+            git_plugin.author
+            git_plugin.committer
+            git_plugin.commit_message
+    # the settings are only read once
+    assert len(queries) == 0
+    with pytest.raises(AttributeError):
+        git_plugin.git_settings.author = None
+    git_project.config["pootle.fs.commit_message"] = "Updating"
+    assert git_plugin.commit_message == DEFAULT_COMMIT_MSG
+    git_plugin.reload()
+    assert git_plugin.commit_message == "Updating"
+    assert git_plugin.committer is None
+
+
+@pytest.mark.django_db
+def test_plugin_clone_kwargs(git_project_1):
+    git_plugin = FSPlugin(git_project_1)
+    assert git_plugin.clone_kwargs == {}
+    git_project_1.config["pootle.fs.clone_depth"] = 1
+    git_project_1.config["pootle.fs.clone_filter"] = "blob:none"
+    git_project_1.config["pootle.fs.sparse_checkout"] = True
+    # the default mapping has no directory to limit the checkout to
+    assert git_plugin.clone_kwargs == dict(depth=1, filter="blob:none")
+    git_project_1.config["pootle_fs.translation_mappings"] = {
+        "default": "/po/<language_code>.<ext>"}
+    assert git_plugin.clone_kwargs == dict(
+        depth=1, filter="blob:none", sparse=True)
+
+
+@pytest.mark.django_db
+def test_plugin_sparse_clone(english, tmpdir, settings):
+    settings.POOTLE_FS_WORKING_PATH = str(tmpdir.join("working"))
+    repo_path = str(tmpdir.join("sparse.git"))
+    create_benchmark_repo(
+        repo_path, ["language0"], files=1, history=2, noise=2,
+        layout="default")
+    project = ProjectDBFactory(source_language=english, code="git_sparse")
+    TranslationProjectFactory(
+        project=project, language=Language.objects.get(code="language0"))
+    project.config["pootle_fs.fs_type"] = "git"
+    # local paths are always cloned in full
+    project.config["pootle_fs.fs_url"] = "file://%s" % repo_path
+    project.config["pootle_fs.translation_mappings"] = {
+        "default": layout_mapping("default")}
+    project.config["pootle.fs.clone_depth"] = 1
+    project.config["pootle.fs.clone_filter"] = "blob:none"
+    project.config["pootle.fs.sparse_checkout"] = True
+    git_plugin = FSPlugin(project)
+    git_plugin.fetch()
+    repo = git_plugin.repo
+    fs_path = "/gnu_style/po/language0.po"
+    assert repo.git.rev_parse("--is-shallow-repository") == "true"
+    assert not os.path.exists(
+        os.path.join(project.local_fs_path, "assets"))
+    assert list(git_plugin.tree_index.hashes) == [fs_path]
+    git_plugin.add()
+    git_plugin.sync()
+
+    # upstream changes a file outside of the sparse checkout
+    upstream = Repo("%s.src" % repo_path)
+    _write(upstream, "assets/noise0.bin", b"upstream")
+    upstream.index.add(["assets/noise0.bin"])
+    upstream.index.commit("Upstream change")
+    upstream.remotes.origin.push("master:master")
+    result = git_plugin.fetch()
+    assert result.new_sha == upstream.head.commit.hexsha
+    assert result.changed_paths == set()
+    assert repo.git.rev_parse("--is-shallow-repository") == "true"
+
+    store_fs = git_plugin.resources.tracked.select_related("store").get()
+    unit = store_fs.store.units[0]
+    unit.target = "Changed in Pootle"
+    unit.save()
+    response = git_plugin.sync()
+    assert [item.fs_path for item in response.completed("pushed_to_fs")] == [
+        fs_path]
+    tree = Repo(repo_path).commit("master").tree
+    assert (
+        b"Changed in Pootle"
+        in tree[fs_path[1:]].data_stream.read())
+    # files outside of the sparse checkout are not removed by the commit
+    assert tree["assets/noise0.bin"].data_stream.read() == b"upstream"
+    assert tree["assets/noise1.bin"]
+    assert list(git_plugin.state()) == []
+
+
+@pytest.mark.django_db
+def test_plugin_get_file_hashes(git_project):
+    git_plugin = FSPlugin(git_project)
+    repo = git_plugin.repo
+    paths = sorted(git_plugin.tree_index.hashes)[:5]
+    assert paths
+    hashes = git_plugin.get_file_hashes(paths + ["/does/not/exist.po"])
+    assert sorted(hashes) == paths
+    for path in paths:
+        assert hashes[path] == repo.git.log(
+            '-1', '--pretty=%H', '--follow', '--', path[1:])
+        assert git_plugin.get_file_hash(path) == hashes[path]
+        assert git_plugin.get_file_hash(path[1:]) == hashes[path]
+    assert git_plugin.get_file_hash("/does/not/exist.po") is None
+
+
+@pytest.mark.django_db
+def test_plugin_get_file_hashes_unindexed(git_project):
+    git_plugin = FSPlugin(git_project)
+    repo = git_plugin.repo
+    paths = sorted(git_plugin.tree_index.hashes)
+    indexed = paths[0]
+    directory = indexed.split("/")[1]
+    unindexed = [
+        path for path in paths
+        if path.split("/")[1] != directory][0]
+    git_project.config["pootle_fs.translation_mappings"] = {
+        "default": "/%s/<language_code>/<filename>.<ext>" % directory}
+    assert unindexed not in git_plugin.tree_index
+    # files outside of the translation mappings are looked up directly
+    hashes = git_plugin.get_file_hashes([indexed, unindexed])
+    assert hashes == {
+        path: repo.git.log('-1', '--pretty=%H', '--', path[1:])
+        for path in [indexed, unindexed]}
+
+
+@pytest.mark.django_db
+def test_plugin_sync_state(git_project):
+    git_plugin = FSPlugin(git_project)
+    store_fs = git_plugin.resources.tracked.select_related("store").first()
+    unit = store_fs.store.units[0]
+    unit.target = "Changed in Pootle"
+    unit.save()
+    response = git_plugin.sync()
+    pushed = list(response.completed("pushed_to_fs"))
+    assert [item.pootle_path for item in pushed] == [store_fs.pootle_path]
+    store_fs.refresh_from_db()
+    # the stores are synced with the hashes of the pushed files
+    assert store_fs.last_sync_hash == git_plugin.tree_index.get(
+        store_fs.path)
+    assert list(git_plugin.state()) == []
+
+
 @pytest.mark.django_db
 def __test_plugin_commit_message(git_project):
     git_plugin = FSPlugin(git_project)
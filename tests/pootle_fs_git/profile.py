@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) Pootle contributors.
+#
+# This file is a part of the Pootle project. It is distributed under the GPL3
+# or later license. See the LICENSE file for a copy of the license and the
+# AUTHORS file for copyright and authorship information.
+
+import threading
+
+from git import Repo
+
+from pootle_fs_git.instrumentation import InstrumentedRepo, git_operation
+from pootle_fs_git.profile import SyncProfile, profile_iter, profile_phase
+
+
+def _push_project0():
+    with git_operation("push", "project0"):
+        pass
+
+
+def test_profile_phases(tmpdir):
+    Repo.init(str(tmpdir)).index.commit("Initial commit")
+    repo = InstrumentedRepo(str(tmpdir))
+    profile = SyncProfile("project0", "push")
+    with profile.profiling():
+        with git_operation("index_add", "project0"):
+            repo.git.rev_parse("HEAD")
+            with git_operation("tree", "project0"):
+                repo.git.ls_tree("HEAD")
+        with profile.phase("changelog"):
+            with git_operation("tree", "project0"):
+                repo.git.ls_tree("HEAD")
+            with profile.phase("author resolution"):
+                pass
+        # other projects and threads are not profiled
+        with git_operation("push", "project1"):
+            repo.git.rev_parse("HEAD")
+        thread = threading.Thread(target=_push_project0)
+        thread.start()
+        thread.join()
+    # git operations in other phases or operations are only timed there
+    assert list(profile.phases) == [
+        "staging", "author resolution", "changelog"]
+    assert profile.subprocesses == 3
+    assert profile.duration >= sum(profile.phases.values())
+    with git_operation("commit", "project0"):
+        pass
+    assert "commit" not in profile.phases
+
+
+def test_profile_report():
+    profile = SyncProfile("project0", "push")
+    for path, duration in [("/po/de.po", 1), ("/po/fr.po", 3),
+                           ("/po/it.po", 2), ("/po/de.po", 2)]:
+        profile.add_path(path, duration)
+    assert profile.slowest_paths(2) == [("/po/de.po", 3), ("/po/fr.po", 3)]
+    profile.add_phase("commit", 0.5)
+    profile.actions["pushed_to_fs"] = 3
+    assert str(profile) == "\n".join([
+        "push (project0): 0.000s, 0 git subprocesses",
+        "  phases:",
+        "    commit               0.500s",
+        "  files:",
+        "    pushed_to_fs         3",
+        "  slowest paths:",
+        "    3.000s /po/de.po",
+        "    3.000s /po/fr.po",
+        "    2.000s /po/it.po"])
+
+
+def test_profile_optional():
+    with profile_phase(None, "changelog"):
+        pass
+    assert list(profile_iter(None, "changelog", [1, 2])) == [1, 2]
+    profile = SyncProfile("project0", "push")
+    assert list(profile_iter(profile, "changelog", iter([1, 2]))) == [1, 2]
+    assert list(profile.phases) == ["changelog"]
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) Pootle contributors.
+#
+# This file is a part of the Pootle project. It is distributed under the GPL3
+# or later license. See the LICENSE file for a copy of the license and the
+# AUTHORS file for copyright and authorship information.
+
+import threading
+
+from git import Repo
+
+from pootle_fs_git.repo import RepoHandles
+
+
+def test_repo_handles_get(tmpdir):
+    repo_path = str(tmpdir)
+    Repo.init(repo_path)
+    handles = RepoHandles()
+    assert repo_path not in handles
+    repo = handles.get(repo_path)
+    assert repo_path in handles
+    assert handles.get(repo_path) is repo
+
+
+def test_repo_handles_invalidate(tmpdir):
+    repo_path = str(tmpdir)
+    Repo.init(repo_path)
+    handles = RepoHandles()
+    repo = handles.get(repo_path)
+    handles.invalidate(repo_path)
+    assert repo_path not in handles
+    assert handles.get(repo_path) is not repo
+    # invalidating unknown paths is harmless
+    handles.invalidate(str(tmpdir.join("missing")))
+
+
+def test_repo_handles_close(tmpdir):
+    paths = [str(tmpdir.join("repo%s" % i)) for i in range(3)]
+    handles = RepoHandles()
+    for path in paths:
+        Repo.init(path)
+        handles.get(path)
+    handles.close()
+    for path in paths:
+        assert path not in handles
+
+
+def _get_in_thread(handles, path):
+    repos = []
+    thread = threading.Thread(
+        target=lambda: repos.append(handles.get(path)))
+    thread.start()
+    thread.join()
+    return repos[0]
+
+
+def test_repo_handles_threads(tmpdir):
+    repo_path = str(tmpdir)
+    Repo.init(repo_path)
+    handles = RepoHandles()
+    repo = handles.get(repo_path)
+    # each thread opens its own handle
+    thread_repo = _get_in_thread(handles, repo_path)
+    assert thread_repo is not repo
+    assert handles.get(repo_path) is repo
+    # invalidating in another thread drops the handles of all threads
+    invalidate = threading.Thread(
+        target=handles.invalidate, args=(repo_path, ))
+    invalidate.start()
+    invalidate.join()
+    assert repo_path not in handles
+    new_repo = handles.get(repo_path)
+    assert new_repo is not repo
+    assert handles.get(repo_path) is new_repo
+    handles.close()
+    assert repo_path not in handles
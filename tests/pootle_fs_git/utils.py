@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) Pootle contributors.
+#
+# This file is a part of the Pootle project. It is distributed under the GPL3
+# or later license. See the LICENSE file for a copy of the license and the
+# AUTHORS file for copyright and authorship information.
+
+import os
+
+from git import Repo
+
+from pootle_fs_git.utils import tmp_git
+
+
+def test_tmp_git_paths(tmpdir, settings):
+    settings.POOTLE_FS_PATH = str(tmpdir.join("fs"))
+    remote_path = str(tmpdir.join("remote.git"))
+    Repo.init(remote_path, bare=True)
+    with tmp_git(remote_path) as (tmp_repo_path, tmp_repo):
+        # concurrent callers get their own checkout
+        with tmp_git(remote_path) as (other_path, other_repo):
+            assert other_path != tmp_repo_path
+            assert other_repo.working_dir == other_path
+        assert not os.path.exists(other_path)
+        assert tmp_repo.working_dir == tmp_repo_path
+        assert os.path.dirname(tmp_repo_path) == settings.POOTLE_FS_PATH
+    assert not os.path.exists(tmp_repo_path)